@@ -11,13 +11,32 @@ information see the article in the parent directory.*
 """
 
 import os
+import logging
 import subprocess
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-# Load dipole- and analytical routines
-from empymod import dipole, analytical
+# Load dipole- and analytical routines (chunked)
+from empymod import dipole
+from reference import reference
+
+# Chunked, parallel grid evaluation
+import resources
+from gridcalc import (ErrorKernel, adaptive_dipole, check_single, fill_cells,
+                      grid_dipole, interp_dipole)
+
+# Result cache
+from resultcache import ResultCache
+
+# Profiling of the stages of empymod
+from profiling import Profile
+
+# EMmod reader
+from emmodio import read_out, read_scr
+
+# Parallel figure rendering
+from render import contourf, render
 
 # Plotting style adjustments
 mpl.rc('text', usetex=True)         # Comment this if you don't have LaTeX. You
@@ -39,7 +58,7 @@ mpl.rc('figure', dpi=300)
 # for the versions submitted to Geophysics.
 
 # Set axis and limits
-def limits(i):
+def limits(axs, i):
     plt.sca(axs[i])
     plt.xlim(min(x)/1000, max(x)/1000)
     plt.ylim(min(x)/1000, max(x)/1000)
@@ -69,262 +88,150 @@ params = {
 }
 
 
-# Calculate and plot analytical solution
+# Calculate analytical solution
 
 # 1. Analytical solution
-resp = analytical(params['src'], params['rec'], params['res'][1],
-                  params['freqtime'], solution='dhs', aniso=params['aniso'][1],
-                  ab=params['ab'])
-resp = resp.reshape(np.shape(rx))
-
+resp = reference(params['src'], rx, ry, params['rec'][2], params['res'][1],
+                 params['freqtime'], params['ab'], params['aniso'][1])
 
-# Create figure
-fig, axs = plt.subplots(figsize=(8.05, 2.93), facecolor='w', nrows=1,
-                        ncols=2, sharey=True)
-axs = axs.ravel()
+# Relative error with respect to the analytical solution; amplitude and phase
+# of the analytical solution are calculated once for all configurations
+error = ErrorKernel(resp, chunksize=30000, nthreads=None)
 
 
-# 1. AMPLITUDE; Set axis and limits
-limits(0)
+# Calculate `empymod` for different Hankel transforms
 
-# Title and labels
-plt.title(r'(a) $G^{\rm{ee}}_{xx}$ analytical, amplitude')
-plt.ylabel('Crossline offset (km)')
-plt.xlabel('Inline offset (km)')
+# Number of processes for the chunked calculation; None uses all CPUs. The
+# cores are split between the processes and their numexpr/BLAS threads, so
+# they are not oversubscribed; the layout of every calculation is logged.
+nproc = None
+logging.basicConfig(format='  %(message)s', level=logging.INFO)
+
+# Memory budget (bytes) of the chunked calculation; None uses half of the
+# available memory. The number of receivers per chunk is derived from it, for
+# the number of layers, frequencies and filter or QWE points, and adapted to
+# the measured memory of the chunks.
+resources.MEMORY = None
+
+# If set, the grid is calculated by offset-interpolation with this relative
+# tolerance, instead of at every receiver (seconds instead of minutes). Keep
+# it None to reproduce the figures, which show the error of the transforms.
+rtol = None
+
+# If True, the grid is calculated by adaptive refinement of a coarse grid,
+# near the source and where amplitude, phase or error vary (about 9 % of the
+# receivers); the errors of the receivers which are not calculated are
+# interpolated. Keep it False to reproduce the figures.
+adaptive = False
+
+# If True, the error maps are stored in single precision (float32), which
+# halves their memory and disk use; they are still calculated in double
+# precision. The response is stored in single precision (complex64) as well,
+# if rounding it changes the errors of a sample of receivers by less than
+# half a contour level (50 levels over 8 decades); see `check_single`.
+single = False
+
+# If True, the stages of empymod (input checks, kernel, Hankel transform, ...)
+# are profiled for every calculated configuration, and written as Chrome trace
+# to *./data/profile/<name>.json*; see profiling.py.
+profile = False
+
+
+def calc_err(params, ht=None, htarg=None, loop=None, opt=None,
+             filename=None):
+    """Function to calculate error
 
-# Draw filled contours and contour lines
-cf1 = plt.contourf(rx/1000, ry/1000, np.abs(resp), 10,
-                   locator=mpl.ticker.LogLocator(), cmap='Greys')
-cf1l = plt.contour(cf1, colors='.5')
+    The model is very big (1 million cells), so it gives a very detailed view
+    of the error, as used by Hunziker et al 2015. However, this is more an
+    academic use. On my laptop, all except the lagged FHT would fail due to
+    memory issues. Hence I carry out the calculation in loops. More
+    'industry'-like values can be seen in Key 2012.
 
-# Plot colorbar
-cb1 = plt.colorbar(cf1)
-cb1.set_label('Amplitude (V/m)')
+    The chunks are distributed over `nproc` processes (all CPUs if None).
+    Receivers which mirror others about the source are not calculated.
 
+    If `filename` is given, it has to return for an array name ('resp', 'amp',
+    'pha') a `.npy`-file name; response and errors are then streamed chunk by
+    chunk into these files, and returned memory-mapped.
+    """
+    if filename is None:
+        def filename(name):
+            return None
+
+    # Precision of the stored response and errors
+    rdtype, edtype = complex, float
+    if single:
+        edtype = np.float32
+        dev = check_single(params, rx, ry, resp, ht=ht, htarg=htarg, opt=opt)
+        if dev < 0.08:
+            rdtype = np.complex64
+        print('  Single precision: deviation %.2f decades, response %s' % (
+              dev, np.dtype(rdtype).name))
+
+    if rtol is not None:
+        inpresp, info = interp_dipole(params, rx, ry, rtol=rtol, nproc=nproc,
+                                      ht=ht, htarg=htarg, opt=opt)
+        print('  Interpolation error: %.2e' % info['error'])
+    elif adaptive:
+        inpresp, info = adaptive_dipole(params, rx, ry, ref=resp,
+                                        chunksize=None, nproc=nproc, ht=ht,
+                                        htarg=htarg, opt=opt)
+        print('  Calculated %d of %d receivers' % (info['ncomputed'], rx.size))
+    elif loop:
+        inpresp = grid_dipole(params, rx, ry, chunksize=None, nproc=nproc,
+                              symmetry=True, out=filename('resp'),
+                              dtype=rdtype, ht=ht, htarg=htarg, opt=opt)
+    else:
+        inpresp = dipole(**params, ht=ht, htarg=htarg, opt=opt)
 
-# 2. PHASE; Set axis and limits
-limits(1)
+    # Reshape and calculate log10-error for phase and amplitude
+    inpresp = inpresp.reshape(np.shape(rx)).astype(rdtype, copy=False)
+    amperr, phaerr = error(inpresp, filename('amp'), filename('pha'), edtype)
 
-vmin2 = -np.pi
-vmax2 = np.pi
+    # Errors of the receivers which were not calculated are interpolated
+    if adaptive and rtol is None:
+        fill_cells(amperr, info['cells'], info['mask'])
+        fill_cells(phaerr, info['cells'], info['mask'])
 
-# Title and labels
-plt.title(r'(b) $G^{\rm{ee}}_{xx}$ analytical, phase')
-plt.xlabel('Inline offset (km)')
+    return amperr, phaerr, inpresp
 
-# Draw filled contours and contour lines
-cf2 = plt.contourf(rx/1000, ry/1000, np.angle(resp), 50,
-                   vmin=vmin2, vmax=vmax2, cmap='Greys')
-cf2l = plt.contour(cf2, levels=np.linspace(-np.pi, np.pi, 12), colors='.5')
 
-# Plot colourbar
-cb2 = plt.colorbar(cf2, ticks=np.arange(7)-3)
-cb2.set_label('Phase (rad)')
+# The calculation is time intensive. It therefore stores the result in a
+# cache in *./data/cache*, and only calculates it if it is not in the cache.
+# The cache key is created from all inputs (model, receivers, transform
+# arguments, and empymod version), so changed configurations are recalculated.
+# The results are loaded memory-mapped, so only what is plotted is read.
+cache = ResultCache('data/cache')
 
-# Save figure and show it
-# plt.savefig('../figures/Figure_1.tif', bbox_inches='tight')
-plt.savefig('../figures/Figure_1.jpg', bbox_inches='tight')
-plt.close()
 
-# Calculate `empymod` for different Hankel transforms
+def cached_err(name, **kwargs):
+    """Return calc_err(params, **kwargs) from the cache, or calculate it."""
+    def calc(filename):
+        with Profile('data/profile/%s.json' % name.replace(' ', '_'),
+                     enabled=profile):
+            amp, pha, inpresp = calc_err(params, filename=filename, **kwargs)
+        print(name + ' finished')
+        return {'amp': amp, 'pha': pha, 'resp': inpresp}
 
+    call = {'params': params, 'kwargs': kwargs, 'rtol': rtol,
+            'adaptive': adaptive, 'single': single}
+    out = cache.fetch(call, calc, name)
+    return out['amp'], out['pha']
 
-def calc_err(params, ht=None, htarg=None, loop=None, opt=None):
-    """Function to calculate error
 
-    The model is very big (1 million cells), so it gives a very detailed view
-    of the error, as used by Hunziker et al 2015. However, this is more an
-    academic use. On my laptop, all except the lagged FHT would fail due to
-    memory issues. Hence I carry out the calculation in loops. More
-    'industry'-like values can be seen in Key 2012.
-    """
-    if loop:
-        inpresp = np.zeros(rx.ravel().shape, dtype=complex)
-        for i in range(37):
-            cc = 30000
-            params['rec'] = [rx.ravel()[i*cc:(i+1)*cc],
-                             ry.ravel()[i*cc:(i+1)*cc], 200]
-            inpresp[i*cc:(i+1)*cc] = dipole(**params, ht=ht, htarg=htarg,
-                                            opt=opt)
-        params['rec'] = [rx.ravel(), ry.ravel(), 200]
-    else:
-        inpresp = dipole(**params, ht=ht, htarg=htarg, opt=opt)
+# Calculate the QWE models
+qwe1amp, qwe1pha = cached_err('QWE 1', ht='QWE', htarg={'maxint': 40},
+                              loop=True)
+qwe2amp, qwe2pha = cached_err('QWE 2', ht='QWE', htarg=[1e-8, 1e-30, 21, 40],
+                              loop=True)
+qwe3amp, qwe3pha = cached_err('QWE 3', ht='QWE', htarg=[1e-8, 1e-18, 15, 40],
+                              loop=True)
 
-    # Reshape and calculate log10-error for phase and amplitude
-    inpresp = inpresp.reshape(np.shape(rx))
-    amperr = np.abs((np.abs(resp) - np.abs(inpresp))/np.abs(resp))*100
-    phaerr = np.abs((np.angle(resp) - np.angle(inpresp))/np.angle(resp))*100
-
-    return amperr, phaerr
-
-# The calculation is time intensive. It therefore stores the result in
-# *./data*, and only calculates it, if those files don't exist.
-
-if os.path.isfile('./data/qwe1err.npz'):  # If results exist, load them
-    qwe1amp = np.load('data/qwe1err.npz')['amp']
-    qwe1pha = np.load('data/qwe1err.npz')['pha']
-    qwe2amp = np.load('data/qwe2err.npz')['amp']
-    qwe2pha = np.load('data/qwe2err.npz')['pha']
-    qwe3amp = np.load('data/qwe3err.npz')['amp']
-    qwe3pha = np.load('data/qwe3err.npz')['pha']
-    fht1amp = np.load('data/fht1err.npz')['amp']
-    fht1pha = np.load('data/fht1err.npz')['pha']
-    fht2amp = np.load('data/fht2err.npz')['amp']
-    fht2pha = np.load('data/fht2err.npz')['pha']
-    fht3amp = np.load('data/fht3err.npz')['amp']
-    fht3pha = np.load('data/fht3err.npz')['pha']
-
-else:  # If not pre-calculated, run empymod
-    # Calculate the QWE models
-    qwe1amp, qwe1pha = calc_err(params, ht='QWE', htarg={'maxint': 40},
-                                loop=True)
-    np.savez('data/qwe1err', amp=qwe1amp, pha=qwe1pha)
-    print('QWE 1 finished')
-    qwe2amp, qwe2pha = calc_err(params, ht='QWE', htarg=[1e-8, 1e-30, 21, 40],
-                                loop=True)
-    np.savez('data/qwe2err', amp=qwe2amp, pha=qwe2pha)
-    print('QWE 2 finished')
-    qwe3amp, qwe3pha = calc_err(params, ht='QWE', htarg=[1e-8, 1e-18, 15, 40],
-                                loop=True)
-    np.savez('data/qwe3err', amp=qwe3amp, pha=qwe3pha)
-    print('QWE 3 finished')
-
-    # Calculate the FHT models
-    fht1amp, fht1pha = calc_err(params, ht='FHT', loop=True)
-    np.savez('data/fht1err', amp=fht1amp, pha=fht1pha)
-    print('FHT 1 finished')
-    fht2amp, fht2pha = calc_err(params, ht='FHT', htarg={'pts_per_dec': 40},
-                                opt='spline', loop=True)
-    np.savez('data/fht2err', amp=fht2amp, pha=fht2pha)
-    print('FHT 2 finished')
-    fht3amp, fht3pha = calc_err(params, ht='FHT', opt='spline')
-    np.savez('data/fht3err', amp=fht3amp, pha=fht3pha)
-    print('FHT 3 finished')
-
-
-# Plot amplitude error of `empymod`
-
-fig, axs = plt.subplots(figsize=(8.1, 6.2), facecolor='w', nrows=2, ncols=3,
-                        sharex=True, sharey=True)
-axs = axs.ravel()
-
-# Min and max, properties
-vmin = 1e-8
-vmax = 1e0
-props = {'levels': np.logspace(np.log10(vmin), np.log10(vmax), 50),
-         'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys'}
-
-# QWE 1
-limits(0)
-plt.title(r'(a) QWE 1 [1e-12, 1e-30, 51]')
-cf1 = plt.contourf(rx/1000, ry/1000, qwe1amp.clip(vmin, vmax), **props)
-plt.ylabel('Crossline offset (km)')
-
-# QWE 2
-limits(1)
-plt.title(r'(b) QWE 2 [1e-8, 1e-30, 21]')
-cf2 = plt.contourf(rx/1000, ry/1000, qwe2amp.clip(vmin, vmax), **props)
-
-# QWE 3
-limits(2)
-plt.title(r'(c) QWE 3 [1e-8, 1e-18, 15]')
-cf3 = plt.contourf(rx/1000, ry/1000, qwe3amp.clip(vmin, vmax), **props)
-
-# FHT 1
-limits(3)
-plt.title(r'(d) FHT 1')
-cf4 = plt.contourf(rx/1000, ry/1000, fht1amp.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-plt.ylabel('Crossline offset (km)')
-plt.xticks(np.arange(6)*2)
-
-
-# FHT 2 (splined)
-limits(4)
-plt.title(r'(e) FHT 2, splined [40]')
-cf5 = plt.contourf(rx/1000, ry/1000, fht2amp.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-# FHT 3 (lagged)
-limits(5)
-plt.title(r'(f) FHT 3, lagged')
-cf6 = plt.contourf(rx/1000, ry/1000, fht3amp.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-# Plot colorbar
-cax, kw = mpl.colorbar.make_axes([axs[0], axs[1], axs[2], axs[3], axs[4],
-                                  axs[5]],
-                                 location='bottom', fraction=.05, pad=0.1,
-                                 aspect=30)
-cb = plt.colorbar(cf6, cax=cax, ticks=10**(-(np.arange(11.)[::-1])+2), **kw)
-cb.set_label(r'Relative Error $(\%)$')
-
-# Save and show
-# plt.savefig('../figures/Figure_2.tif', bbox_inches='tight')
-plt.savefig('../figures/Figure_2.jpg', bbox_inches='tight')
-plt.close()
-
-
-# Plot phase error of `empymod`
-
-fig, axs = plt.subplots(figsize=(8.1, 6.2), facecolor='w', nrows=2, ncols=3,
-                        sharex=True, sharey=True)
-axs = axs.ravel()
-
-# Min and max, properties
-vmin = 1e-8
-vmax = 1e0
-props = {'levels': np.logspace(np.log10(vmin), np.log10(vmax), 50),
-         'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys'}
-
-# QWE 1
-limits(0)
-plt.title(r'(a) QWE 1 [1e-12, 1e-30, 51]')
-cf1 = plt.contourf(rx/1000, ry/1000, qwe1pha.clip(vmin, vmax), **props)
-plt.ylabel('Crossline offset (km)')
-
-# QWE 2
-limits(1)
-plt.title(r'(b) QWE 2 [1e-8, 1e-30, 21]')
-cf2 = plt.contourf(rx/1000, ry/1000, qwe2pha.clip(vmin, vmax), **props)
-
-# QWE 3
-limits(2)
-plt.title(r'(c) QWE 3 [1e-8, 1e-18, 15]')
-cf3 = plt.contourf(rx/1000, ry/1000, qwe3pha.clip(vmin, vmax), **props)
-
-# FHT 1
-limits(3)
-plt.title(r'(d) FHT 1')
-cf4 = plt.contourf(rx/1000, ry/1000, fht1pha.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-plt.ylabel('Crossline offset (km)')
-plt.xticks(np.arange(6)*2)
-
-# FHT 2 (splined)
-limits(4)
-plt.title(r'(e) FHT 2, splined [40]')
-cf5 = plt.contourf(rx/1000, ry/1000, fht2pha.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-# FHT 3 (lagged)
-limits(5)
-plt.title(r'(f) FHT 3, lagged')
-cf6 = plt.contourf(rx/1000, ry/1000, fht3pha.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-# Plot colorbar
-cax, kw = mpl.colorbar.make_axes([axs[0], axs[1], axs[2], axs[3], axs[4],
-                                  axs[5]],
-                                 location='bottom', fraction=.05, pad=0.1,
-                                 aspect=30)
-cb = plt.colorbar(cf6, cax=cax, ticks=10**(-(np.arange(11.)[::-1])+2), **kw)
-cb.set_label(r'Relative Error $(\%)$')
-
-# Save and show
-# plt.savefig('../figures/Figure_3.tif', bbox_inches='tight')
-plt.savefig('../figures/Figure_3.jpg', bbox_inches='tight')
-plt.close()
+# Calculate the FHT models
+fht1amp, fht1pha = cached_err('FHT 1', ht='FHT', loop=True)
+fht2amp, fht2pha = cached_err('FHT 2', ht='FHT', htarg={'pts_per_dec': 40},
+                              opt='spline', loop=True)
+fht3amp, fht3pha = cached_err('FHT 3', ht='FHT', opt='spline')
 
 
 # Calculate `EMmod` results
@@ -342,80 +249,180 @@ if not os.path.isfile(ffile):  # If results exist, load them
                    stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
     os.chdir('..')
 
-# Read result and calculate error
-with open(ffile, 'rb') as outfile:
-    temp = np.loadtxt(outfile, skiprows=1, unpack=True)
-
-    # Get same x/y as requested (round to mm)
-    tct = np.round(temp[0], 3) + 1j*np.round(temp[1], 3)
-    tcr = np.round(params['rec'][0], 3) + 1j*np.round(params['rec'][1], 3)
-    itr = np.in1d(tct, tcr)
-
-    # Put into data and reshape
-    data = temp[3][itr] + 1j*temp[4][itr]
-    data = data.reshape(np.shape(rx))
-
-    # Calculate error for amplitude and phase
-    emmodamp = np.abs((np.abs(resp) - np.abs(data))/np.abs(resp))*100
-    emmodpha = np.abs((np.angle(resp) - np.angle(data))/np.angle(resp))*100
-
-
-# Plot amplitude and phase error of `EMmod`
-
-fig, axs = plt.subplots(figsize=(4.75, 5.6), facecolor='w', nrows=2, ncols=2,
-                        sharex=True, sharey=True)
-axs = axs.ravel()
-
-# Properties for scale 0 to 2
-vmin1 = 1e0
-vmax1 = 1e2
-props1 = {'levels': np.logspace(np.log10(vmin1), np.log10(vmax1), 50),
-          'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys'}
-
-# Properties for scale -8 to 0
-vmin2 = 1e-8
-vmax2 = 1e0
-props2 = {'levels': np.logspace(np.log10(vmin2), np.log10(vmax2), 50),
-          'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys'}
-
-# 1. Amplitude on scale as 0 to 2
-limits(0)
-plt.title(r'(a) Amplitude')
-cf1 = plt.contourf(rx/1000, ry/1000, emmodamp.clip(vmin1, vmax1), **props1)
-plt.ylabel('Crossline offset (km)')
-plt.xticks([0, 2, 4, 6, 8, 10])
-
-# 2. Amplitude on scale -8 to 0
-limits(1)
-plt.title(r'(b) Amplitude')
-cf2 = plt.contourf(rx/1000, ry/1000, emmodamp.clip(vmin2, vmax2), **props2)
-
-# 3. Phase on scale 0 to 2
-limits(2)
-plt.title(r'(c) Phase')
-cf3 = plt.contourf(rx/1000, ry/1000, emmodpha.clip(vmin1, vmax1), **props1)
-plt.xlabel('Inline offset (km)')
-plt.ylabel('Crossline offset (km)')
-
-# 4. Phase on scale -8 to 0
-limits(3)
-plt.title(r'(d) Phase')
-cf4 = plt.contourf(rx/1000, ry/1000, emmodpha.clip(vmin2, vmax2), **props2)
-plt.xlabel('Inline offset (km)')
-
-# Draw colorbar for scale 0 to 2
-cax, kw = mpl.colorbar.make_axes([axs[0], axs[2]], location='bottom',
-                                 fraction=.05, pad=0.1, aspect=20)
-cb = plt.colorbar(cf3, cax=cax, ticks=10**(np.arange(5.)/2), **kw)
-cb.set_label(r'Relative Error (a) \& (c) $(\%)$')
-
-# Draw colorbar for scale -8 to 0
-cax, kw = mpl.colorbar.make_axes([axs[1], axs[3]], location='bottom',
-                                 fraction=.05, pad=0.1, aspect=20)
-cb2 = plt.colorbar(cf4, cax=cax, ticks=10**(-(np.arange(11.)[::-2])+2), **kw)
-cb2.set_label(r'Relative Error (b) \& (d) $(\%)$')
-
-# Save figure and show it
-# plt.savefig('../figures/Figure_5.tif', bbox_inches='tight')
-plt.savefig('../figures/Figure_5.jpg', bbox_inches='tight')
-plt.close()
+# Read result and calculate error. The text output is converted once to a
+# binary file, the receivers are mapped to the grid defined in the scr-file.
+scr = read_scr('./data/halfspacemod_10m.scr')
+data = read_out(ffile, rx, ry, scr['dx'], scr['dy'], scr['nx'], scr['ny'])
+
+# Calculate error for amplitude and phase
+emmodamp, emmodpha = error(data)
+
+
+# Plot the figures
+
+# The figures are rendered at the end, each in its own process (render.py).
+# If `decimated`, the fields are decimated to the pixel size of the panels,
+# which is much faster; keep it False to reproduce the figures.
+decimated = False
+
+
+def plot_analytical():
+    """Plot amplitude and phase of the analytical solution (Figure 1)."""
+    fig, axs = plt.subplots(figsize=(8.05, 2.93), facecolor='w', nrows=1,
+                            ncols=2, sharey=True)
+    axs = axs.ravel()
+
+    # 1. AMPLITUDE; Set axis and limits
+    limits(axs, 0)
+
+    # Title and labels
+    plt.title(r'(a) $G^{\rm{ee}}_{xx}$ analytical, amplitude')
+    plt.ylabel('Crossline offset (km)')
+    plt.xlabel('Inline offset (km)')
+
+    # Draw filled contours and contour lines
+    cf1 = contourf(rx/1000, ry/1000, np.abs(resp), 10,
+                   locator=mpl.ticker.LogLocator(), cmap='Greys',
+                   decimated=decimated)
+    plt.contour(cf1, colors='.5')
+
+    # Plot colorbar
+    cb1 = plt.colorbar(cf1)
+    cb1.set_label('Amplitude (V/m)')
+
+    # 2. PHASE; Set axis and limits
+    limits(axs, 1)
+
+    vmin2 = -np.pi
+    vmax2 = np.pi
+
+    # Title and labels
+    plt.title(r'(b) $G^{\rm{ee}}_{xx}$ analytical, phase')
+    plt.xlabel('Inline offset (km)')
+
+    # Draw filled contours and contour lines
+    cf2 = contourf(rx/1000, ry/1000, np.angle(resp), 50, vmin=vmin2,
+                   vmax=vmax2, cmap='Greys', decimated=decimated)
+    plt.contour(cf2, levels=np.linspace(-np.pi, np.pi, 12), colors='.5')
+
+    # Plot colourbar
+    cb2 = plt.colorbar(cf2, ticks=np.arange(7)-3)
+    cb2.set_label('Phase (rad)')
+
+    # Save figure
+    plt.savefig('../figures/Figure_1.jpg', bbox_inches='tight')
+    plt.close()
+
+
+def plot_errors(errors, fname):
+    """Plot the six error maps `errors` (amplitude or phase) to `fname`."""
+    fig, axs = plt.subplots(figsize=(8.1, 6.2), facecolor='w', nrows=2,
+                            ncols=3, sharex=True, sharey=True)
+    axs = axs.ravel()
+
+    # Min and max, properties
+    vmin = 1e-8
+    vmax = 1e0
+    props = {'levels': np.logspace(np.log10(vmin), np.log10(vmax), 50),
+             'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys',
+             'decimated': decimated}
+
+    # QWE 1-3 and FHT 1-3
+    titles = [r'(a) QWE 1 [1e-12, 1e-30, 51]', r'(b) QWE 2 [1e-8, 1e-30, 21]',
+              r'(c) QWE 3 [1e-8, 1e-18, 15]', r'(d) FHT 1',
+              r'(e) FHT 2, splined [40]', r'(f) FHT 3, lagged']
+    for i, (title, err) in enumerate(zip(titles, errors)):
+        limits(axs, i)
+        plt.title(title)
+        cf = contourf(rx/1000, ry/1000, err.clip(vmin, vmax), **props)
+        if i % 3 == 0:
+            plt.ylabel('Crossline offset (km)')
+        if i >= 3:
+            plt.xlabel('Inline offset (km)')
+    plt.sca(axs[3])
+    plt.xticks(np.arange(6)*2)
+
+    # Plot colorbar
+    cax, kw = mpl.colorbar.make_axes(list(axs), location='bottom',
+                                     fraction=.05, pad=0.1, aspect=30)
+    cb = plt.colorbar(cf, cax=cax, ticks=10**(-(np.arange(11.)[::-1])+2),
+                      **kw)
+    cb.set_label(r'Relative Error $(\%)$')
+
+    # Save
+    plt.savefig(fname, bbox_inches='tight')
+    plt.close()
+
+
+def plot_emmod():
+    """Plot amplitude and phase error of `EMmod` (Figure 5)."""
+    fig, axs = plt.subplots(figsize=(4.75, 5.6), facecolor='w', nrows=2,
+                            ncols=2, sharex=True, sharey=True)
+    axs = axs.ravel()
+
+    # Properties for scale 0 to 2
+    vmin1 = 1e0
+    vmax1 = 1e2
+    props1 = {'levels': np.logspace(np.log10(vmin1), np.log10(vmax1), 50),
+              'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys',
+              'decimated': decimated}
+
+    # Properties for scale -8 to 0
+    vmin2 = 1e-8
+    vmax2 = 1e0
+    props2 = {'levels': np.logspace(np.log10(vmin2), np.log10(vmax2), 50),
+              'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys',
+              'decimated': decimated}
+
+    # 1. Amplitude on scale as 0 to 2
+    limits(axs, 0)
+    plt.title(r'(a) Amplitude')
+    contourf(rx/1000, ry/1000, emmodamp.clip(vmin1, vmax1), **props1)
+    plt.ylabel('Crossline offset (km)')
+    plt.xticks([0, 2, 4, 6, 8, 10])
+
+    # 2. Amplitude on scale -8 to 0
+    limits(axs, 1)
+    plt.title(r'(b) Amplitude')
+    contourf(rx/1000, ry/1000, emmodamp.clip(vmin2, vmax2), **props2)
+
+    # 3. Phase on scale 0 to 2
+    limits(axs, 2)
+    plt.title(r'(c) Phase')
+    cf3 = contourf(rx/1000, ry/1000, emmodpha.clip(vmin1, vmax1), **props1)
+    plt.xlabel('Inline offset (km)')
+    plt.ylabel('Crossline offset (km)')
+
+    # 4. Phase on scale -8 to 0
+    limits(axs, 3)
+    plt.title(r'(d) Phase')
+    cf4 = contourf(rx/1000, ry/1000, emmodpha.clip(vmin2, vmax2), **props2)
+    plt.xlabel('Inline offset (km)')
+
+    # Draw colorbar for scale 0 to 2
+    cax, kw = mpl.colorbar.make_axes([axs[0], axs[2]], location='bottom',
+                                     fraction=.05, pad=0.1, aspect=20)
+    cb = plt.colorbar(cf3, cax=cax, ticks=10**(np.arange(5.)/2), **kw)
+    cb.set_label(r'Relative Error (a) \& (c) $(\%)$')
+
+    # Draw colorbar for scale -8 to 0
+    cax, kw = mpl.colorbar.make_axes([axs[1], axs[3]], location='bottom',
+                                     fraction=.05, pad=0.1, aspect=20)
+    cb2 = plt.colorbar(cf4, cax=cax, ticks=10**(-(np.arange(11.)[::-2])+2),
+                       **kw)
+    cb2.set_label(r'Relative Error (b) \& (d) $(\%)$')
+
+    # Save figure
+    plt.savefig('../figures/Figure_5.jpg', bbox_inches='tight')
+    plt.close()
+
+
+# Render all figures (use '.tif' to save them as tif)
+render({'Figure_1': plot_analytical,
+        'Figure_2': lambda: plot_errors(
+            [qwe1amp, qwe2amp, qwe3amp, fht1amp, fht2amp, fht3amp],
+            '../figures/Figure_2.jpg'),
+        'Figure_3': lambda: plot_errors(
+            [qwe1pha, qwe2pha, qwe3pha, fht1pha, fht2pha, fht3pha],
+            '../figures/Figure_3.jpg'),
+        'Figure_5': plot_emmod})
@@ -0,0 +1,194 @@
+"""
+Run-time benchmarks of `empymod`, as in Tables 2 and 3 of the article.
+
+This is the scriptable version of the `empymod`-part of *runtimes.ipynb*. The
+cases are defined in the tables `MODELS` and `TRANSFORMS` below. Every case is
+run after a warm-up for a number of repeats, and the best and median times
+are stored as JSON, together with information about the environment. Given a
+baseline (an earlier JSON output), cases which got slower than a threshold are
+flagged as regressions. With `-p` every case is run once more with the
+profiling hooks of *profiling.py*, and the time per stage of `empymod` (input
+checks, kernel, Hankel transform, ...) is stored with the case.
+
+Usage:
+
+    python benchmark.py -o bench.json                  # Run all cases
+    python benchmark.py -k 'Table 3' -r 3              # Run a subset
+    python benchmark.py -b baseline.json -t 1.2        # Compare to baseline
+    python benchmark.py -p -k 'QWE' -o qwe.json        # Per-stage breakdown
+
+The exit status is 1 if there are regressions, 0 otherwise.
+
+"""
+
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from empymod import dipole
+
+from printinfo import fingerprint
+from profiling import Profile
+
+
+# Models: 5 and 100 layers, 1 to 321 offsets
+DEPTH5 = [0, 1000, 2000, 2100]
+RES5 = [1e12, 0.3, 1, 100, 1]
+DEPTH100 = list(np.r_[0, 1000, 2000, 2100+np.linspace(0, 10000, 96)])
+RES100 = list(np.r_[1e12, .3, 1, 100, np.ones(96)])
+MODELS = [
+    {'depth': DEPTH5, 'res': RES5, 'noff': 1},
+    {'depth': DEPTH5, 'res': RES5, 'noff': 5},
+    {'depth': DEPTH5, 'res': RES5, 'noff': 21},
+    {'depth': DEPTH5, 'res': RES5, 'noff': 81},
+    {'depth': DEPTH5, 'res': RES5, 'noff': 321},
+    {'depth': DEPTH100, 'res': RES100, 'noff': 21},
+    {'depth': DEPTH100, 'res': RES100, 'noff': 81},
+    {'depth': DEPTH100, 'res': RES100, 'noff': 321},
+]
+
+# Hankel transforms and optimisations
+TRANSFORMS = [
+    # Table 2: QWE, FHT with 201 pt filter, and FHT with 801 pt filter
+    {'table': 'Table 2', 'name': 'QWE', 'ht': 'QWE',
+     'htarg': [1e-6, 1e-24, 9], 'opt': None},
+    {'table': 'Table 2', 'name': 'QWE', 'ht': 'QWE',
+     'htarg': [1e-2, 1e-24, 9, 40, 40], 'opt': 'spline'},
+    {'table': 'Table 2', 'name': 'FHT 201', 'ht': 'FHT',
+     'htarg': 'key_201_2012', 'opt': None},
+    {'table': 'Table 2', 'name': 'FHT 201', 'ht': 'FHT',
+     'htarg': 'key_201_2012', 'opt': 'spline'},
+    {'table': 'Table 2', 'name': 'FHT 801', 'ht': 'FHT',
+     'htarg': 'anderson_801_1982', 'opt': None},
+    {'table': 'Table 2', 'name': 'FHT 801', 'ht': 'FHT',
+     'htarg': 'anderson_801_1982', 'opt': 'spline'},
+
+    # Table 3: FHT with 201 pt filter, as DIPOLE1D
+    {'table': 'Table 3', 'name': 'FHT 201', 'ht': 'FHT',
+     'htarg': 'key_201_2009', 'opt': None},
+    {'table': 'Table 3', 'name': 'FHT 201', 'ht': 'FHT',
+     'htarg': 'key_201_2009', 'opt': 'parallel'},
+    {'table': 'Table 3', 'name': 'FHT 201', 'ht': 'FHT',
+     'htarg': 'key_201_2009', 'opt': 'spline'},
+]
+
+# All cases: every transform for every model
+CASES = [dict(model, **transform, model=i)
+         for transform in TRANSFORMS for i, model in enumerate(MODELS)]
+
+
+def case_name(case):
+    """Unique name of a case, used to match it with the baseline."""
+    return '%s :: %s :: opt=%s :: %d layers :: %d offsets' % (
+            case['table'], case['name'], case['opt'], len(case['res']),
+            case['noff'])
+
+
+def case_inputs(case):
+    """Input parameters for `dipole` of a case."""
+    noff = case['noff']
+    return {'src': [0, 0, 990],
+            'rec': [np.linspace(500, 20000, noff), np.zeros(noff), 1000],
+            'depth': case['depth'], 'res': case['res'], 'freqtime': 1,
+            'ab': 11, 'xdirect': False, 'ht': case['ht'],
+            'htarg': case['htarg'], 'opt': case['opt'], 'verb': 0}
+
+
+def timeit(func, repeat=7, warmup=1):
+    """Time `func` after `warmup` calls; return the `repeat` times (s)."""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        tstart = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tstart)
+    return times
+
+
+def environment():
+    """Information about the environment of the benchmark."""
+    return fingerprint(['empymod', 'numpy', 'scipy', 'numexpr'])
+
+
+def run(cases, repeat=7, warmup=1, verb=1, profile=False):
+    """Run the benchmark `cases`; return the results as list of dicts.
+
+    If `profile`, every case is run once more in a `Profile`, and its
+    per-stage summary is added as 'stages' (not included in the times).
+    """
+    results = []
+    for case in cases:
+        inp = case_inputs(case)
+        times = timeit(lambda: dipole(**inp), repeat, warmup)
+        result = {'name': case_name(case), 'best': min(times),
+                  'median': float(np.median(times)), 'times': times}
+        if profile:
+            with Profile() as prof:
+                dipole(**inp)
+            result['stages'] = prof.summary()
+        results.append(result)
+        if verb > 0:
+            print('%8.1f ms :: %s' % (1000*result['best'], result['name']))
+            if profile:
+                print('            %s' % ', '.join(
+                      '%s %.1f ms' % (k, 1000*v['time']) for k, v in
+                      result['stages'].items() if isinstance(v, dict)))
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    """Compare `results` to `baseline` results.
+
+    Returns a list of (name, ratio) of all cases of which the best time is
+    more than `threshold` times the best time of the baseline.
+    """
+    base = {r['name']: r['best'] for r in baseline}
+    regressions = []
+    for r in results:
+        if r['name'] in base:
+            ratio = r['best']/base[r['name']]
+            if ratio > threshold:
+                regressions.append((r['name'], ratio))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-o', '--output', help='JSON output file')
+    parser.add_argument('-b', '--baseline', help='JSON baseline file')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2,
+                        help='regression threshold (ratio to baseline)')
+    parser.add_argument('-r', '--repeat', type=int, default=7,
+                        help='number of timed repeats')
+    parser.add_argument('-w', '--warmup', type=int, default=1,
+                        help='number of warm-up calls')
+    parser.add_argument('-k', '--keyword', default='',
+                        help='only run cases which contain this keyword')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='add the time per stage of empymod')
+    args = parser.parse_args(args)
+
+    cases = [c for c in CASES if args.keyword in case_name(c)]
+    results = run(cases, args.repeat, args.warmup, profile=args.profile)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f,
+                      indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print('REGRESSION %5.2fx :: %s' % (ratio, name))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
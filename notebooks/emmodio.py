@@ -0,0 +1,235 @@
+"""
+Read `EMmod` results.
+
+`EMmod` writes the result on a regular grid of `nx` by `ny` receivers with
+spacing `dx`, `dy`, either as text (`writebin=0`) or binary (`writebin=1`).
+The text output is slow to parse; it is therefore converted once to a
+binary `.npy`-file, which is afterwards loaded memory-mapped. Requested
+receivers are mapped arithmetically to their grid indices.
+
+Binary outputs are written one file per frequency. They are memory-mapped
+and presented as one lazy (frequency, receiver) array, or packed once into a
+single `.npy`-file, of which the complex values are a strided view.
+
+"""
+
+import os
+
+import numpy as np
+
+from resultcache import write_atomic
+
+
+def read_scr(scrfile):
+    """Return the `key=value` arguments of an `EMmod` `.scr`-file as dict.
+
+    See `parse_args`.
+    """
+    with open(scrfile) as f:
+        tokens = f.read().replace('\\\n', ' ').split()
+    return parse_args(tokens)
+
+
+def parse_args(tokens):
+    """Return the `key=value` tokens of an `EMmod` call as dict.
+
+    Tokens without `=` are ignored. Numbers are converted to float,
+    comma-separated lists to arrays.
+    """
+    out = {}
+    for token in tokens:
+        if '=' not in token:
+            continue
+        key, value = token.split('=', 1)
+        try:
+            values = np.array(value.split(','), dtype=float)
+            out[key] = values if values.size > 1 else values[0]
+        except ValueError:
+            out[key] = value
+    return out
+
+
+def _fmt(value):
+    """Format a `.scr`-value: string, number, or comma-separated numbers."""
+    if isinstance(value, str):
+        return value
+    return ','.join('%.15g' % v for v in np.atleast_1d(value))
+
+
+def write_scr(scrfile, args):
+    """Write an `EMmod` `.scr`-file calling `emmod` with `args` (dict).
+
+    The inverse of `read_scr`.
+    """
+    lines = ['#!/bin/bash', '', 'emmod \\']
+    lines += ['\t%s=%s \\' % (k, _fmt(v)) for k, v in args.items()]
+    lines[-1] = lines[-1][:-2]
+    with open(scrfile, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def convert_out(ffile, binfile=None):
+    """Convert an `EMmod` text output to a binary `.npy`-file.
+
+    The conversion is only carried out if `binfile` does not exist or is
+    older than `ffile`. The `.npy`-file contains the columns of `ffile`
+    (x, y, z, real, imaginary), shape (ncol, nrec).
+
+    Returns the name of the `.npy`-file; defaults to `ffile` + '.npy'.
+    """
+    if binfile is None:
+        binfile = ffile + '.npy'
+    if (os.path.isfile(binfile) and
+            os.path.getmtime(binfile) >= os.path.getmtime(ffile)):
+        return binfile
+
+    with open(ffile, 'rb') as outfile:
+        outfile.readline()  # Header
+        first = outfile.readline()
+        temp = np.array((first + outfile.read()).split(), dtype=float)
+    temp = temp.reshape(-1, len(first.split())).T
+
+    write_atomic(binfile, lambda f: np.save(f, temp))
+    return binfile
+
+
+def read_out(ffile, x, y, dx, dy, nx, ny, tol=1e-3):
+    """Return the `EMmod` result at receivers `x`, `y`.
+
+    The text output is converted once to binary (see `convert_out`) and
+    loaded memory-mapped. The receivers are mapped to grid indices from the
+    first grid point and `dx`, `dy`, `nx`, `ny`; the grid coordinates of the
+    mapped indices are checked against `x`, `y` (to `tol`).
+
+    Parameters
+    ----------
+    ffile : str
+        `EMmod` text output (`writebin=0`).
+
+    x, y : array
+        Receiver coordinates; any shape, but the same for both.
+
+    dx, dy, nx, ny : float, float, int, int
+        Grid spacing and number of grid points, as in the `.scr`-file.
+
+    tol : float
+        Tolerance of the coordinate check (m).
+
+    Returns
+    -------
+    data : array
+        Complex result, same shape as `x`.
+
+    """
+    temp = np.load(convert_out(ffile), mmap_mode='r')
+    nx, ny = int(nx), int(ny)
+
+    # Grid origin and order (x or y varying fastest)
+    x0, y0 = temp[0, 0], temp[1, 0]
+    xfast = temp[0, 1] != temp[0, 0]
+
+    # Grid indices of the requested receivers
+    ix = np.rint((np.asarray(x, dtype=float) - x0)/dx).astype(int)
+    iy = np.rint((np.asarray(y, dtype=float) - y0)/dy).astype(int)
+    if np.any((ix < 0) | (ix >= nx) | (iy < 0) | (iy >= ny)):
+        raise ValueError('Receivers outside of the EMmod grid')
+    ind = iy*nx + ix if xfast else ix*ny + iy
+
+    # Check the mapping
+    if (np.any(np.abs(temp[0][ind] - x) > tol) or
+            np.any(np.abs(temp[1][ind] - y) > tol)):
+        raise ValueError('Receivers do not match the EMmod grid')
+
+    return temp[3][ind] + 1j*temp[4][ind]
+
+
+class BinStack:
+    """Lazy (frequency, receiver) array of per-frequency `EMmod` binaries.
+
+    Every file is a sequence of complex values (real and imaginary part
+    interleaved, float64). Of each file, `count` complex values starting at
+    complex value `start` are used. The files are only memory-mapped when
+    indexed; nothing is read before.
+
+    Parameters
+    ----------
+    filenames : list of str
+        One binary file per frequency, in order of the frequencies.
+
+    start, count : int
+        First complex value and number of complex values used of each file.
+
+    """
+
+    def __init__(self, filenames, start, count):
+        self.filenames = list(filenames)
+        self.start = start
+        self.count = count
+        self.shape = (len(self.filenames), count)
+        self.dtype = np.dtype(complex)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _row(self, i):
+        return np.memmap(self.filenames[i], dtype=complex, mode='r',
+                         offset=self.start*16, shape=(self.count, ))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        ifreq = np.arange(self.shape[0])[key[0]]
+        rest = key[1:] if len(key) > 1 else (slice(None), )
+        if np.ndim(ifreq) == 0:
+            return np.array(self._row(ifreq)[rest])
+        return np.array([self._row(i)[rest] for i in ifreq])
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:].astype(dtype or self.dtype, copy=False)
+
+
+def pack_bin(filenames, packfile):
+    """Pack per-frequency `EMmod` binaries into one `.npy`-file.
+
+    The `.npy`-file contains the raw float64 values of all files, shape
+    (nfreq, nvalues). It is only (re-)written if it does not exist or is
+    older than any of the files.
+    """
+    if os.path.isfile(packfile) and os.path.getmtime(packfile) >= max(
+            os.path.getmtime(f) for f in filenames):
+        return packfile
+
+    nvalues = os.path.getsize(filenames[0])//8
+    tmp = packfile + '.tmp%d.npy' % os.getpid()
+    out = np.lib.format.open_memmap(tmp, 'w+', float,
+                                    (len(filenames), nvalues))
+    for i, fname in enumerate(filenames):
+        out[i] = np.memmap(fname, dtype=float, mode='r', shape=(nvalues, ))
+    out.flush()
+    del out
+    os.replace(tmp, packfile)
+    return packfile
+
+
+def load_bin(filenames, start, count, packfile=None):
+    """Return (frequency, receiver) complex `EMmod` results of binaries.
+
+    Parameters
+    ----------
+    filenames : list of str
+        One binary file per frequency, in order of the frequencies.
+
+    start, count : int
+        First complex value and number of complex values used of each file.
+
+    packfile : str or None
+        If given, the files are packed into this `.npy`-file (see `pack_bin`)
+        and a strided complex view of it is returned, memory-mapped.
+        Otherwise a lazy `BinStack` is returned.
+
+    """
+    if packfile is None:
+        return BinStack(filenames, start, count)
+
+    raw = np.load(pack_bin(filenames, packfile), mmap_mode='r')
+    return raw[:, 2*start:2*(start+count)].view(complex)
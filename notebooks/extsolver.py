@@ -0,0 +1,332 @@
+"""
+Run-time harness for the external codes `DIPOLE1D` and `EMmod`.
+
+*runtimes.ipynb*, *analytical.py* and *gpr-create-data.py* write the input
+files of the external codes by hand and time `subprocess.run` of the whole
+call, which mixes process start-up, file I/O and the actual calculation.
+
+Here an external code is described by a `Solver`: its command line, a writer
+of its input files, and a parser of its output. `run` times the parts
+separately:
+
+- write: writing the input file(s);
+- spawn: starting a process that does nothing (`Solver.noop`);
+- solve: the call of the code, minus the spawn time;
+- read: parsing the output.
+
+*standin.py* provides stand-ins of both codes, which calculate the same
+quantities with `empymod` and write them in the same formats. With
+`standin=True` the executables in *./bin* are used instead of the real
+binaries, so the pipeline can be tested and benchmarked on machines without
+them.
+
+The `DIPOLE1D` output format (*.csem*) of `write_csem` and `read_csem` is
+taken from its documentation; it is unverified, as no output of the real
+code was at hand, and only tested against the stand-in, which uses the same
+writer. Check `read_csem` on a real output before relying on it.
+
+Usage:
+
+    python extsolver.py -s -o extsolver.json     # Stand-in cases
+    python extsolver.py -s -e 100m 10m           # Also the 10 m EMmod grid
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from emmodio import convert_out, read_scr, write_scr
+from benchmark import MODELS, environment
+
+# Directory of the stand-in executables
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+
+# `EMmod` cases: the half-space models of *analytical.py* (10 m spacing,
+# 2020 x 2020 receivers) and of the coarse variant (100 m, 202 x 202)
+EMMOD_CASES = {'100m': 'data/halfspacemod_100m.scr',
+               '10m': 'data/halfspacemod_10m.scr'}
+
+
+# DIPOLE1D I/O
+
+def write_runfile(fname, src, rec, depth, res, freq, filt='kk_ht_201',
+                  spline=False, output='dipole1d.csem'):
+    """Write a `DIPOLE1D` RUNFILE, as in *runtimes.ipynb*.
+
+    `src` is [x, y, z] of an x-directed dipole, `rec` [x, y, z] (x, y arrays),
+    `depth` the layer tops (without the top layer), `res` the resistivities.
+    """
+    freq = np.atleast_1d(freq)
+    with open(fname, 'wb') as runfile:
+        runfile.write(bytes(
+            'Version:          DIPOLE1D_1.0\n'
+            'Output Filename:  '+output+'\n'
+            'HT Filters:       '+filt+'\n'
+            'UseSpline1D:      '+('yes' if spline else 'no')+'\n'
+            'CompDerivatives:  no\n'
+            '# TRANSMITTERS:   1\n'
+            '          X           Y           Z    ROTATION         DIP\n',
+            'UTF-8'))
+        np.savetxt(runfile, np.atleast_2d(np.r_[src[0], src[1], src[2], 0, 0]),
+                   fmt='%12.4f')
+        runfile.write(bytes('# FREQUENCIES:    '+str(freq.size)+'\n', 'UTF-8'))
+        np.savetxt(runfile, freq, fmt='%10.3f')
+        runfile.write(bytes('# LAYERS:         '+str(np.size(depth)+1)+'\n',
+                            'UTF-8'))
+        np.savetxt(runfile, np.r_[[np.r_[-1000000, depth]], [res]].transpose(),
+                   fmt='%12.5g')
+        runfile.write(bytes('# RECEIVERS:      '+str(np.size(rec[0]))+'\n',
+                            'UTF-8'))
+        rec = np.r_[[np.ravel(rec[0])], [np.ravel(rec[1])],
+                    [np.ones(np.size(rec[0]))*rec[2]]]
+        np.savetxt(runfile, rec.transpose(), fmt='%12.4f')
+
+
+def _sections(fname):
+    """Header (dict) and the `# NAME: n`-sections (dict of arrays)."""
+    with open(fname) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    header, sections = {}, {}
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('#'):
+            name, n = line[1:].split(':')
+            name, n = name.strip().lower(), int(n)
+            rows = lines[i+1:i+1+n]
+            if rows and not rows[0][0].isdigit() and rows[0][0] not in '-.':
+                rows = lines[i+2:i+2+n]  # Column titles
+                i += 1
+            sections[name] = np.array([r.split() for r in rows], dtype=float)
+            i += n + 1
+        else:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                header[key.strip().lower()] = value.strip()
+            i += 1
+    return header, sections
+
+
+def read_runfile(fname):
+    """Return the inputs of a `DIPOLE1D` RUNFILE (see `write_runfile`)."""
+    header, sec = _sections(fname)
+    return {'src': sec['transmitters'][0, :3],
+            'rec': list(sec['receivers'].T),
+            'depth': sec['layers'][1:, 0], 'res': sec['layers'][:, 1],
+            'freq': sec['frequencies'][:, 0],
+            'filt': header.get('ht filters', 'kk_ht_201'),
+            'spline': header.get('usespline1d', 'no') == 'yes',
+            'output': header.get('output filename', 'dipole1d.csem')}
+
+
+def write_csem(fname, src, rec, freq, fields):
+    """Write a `DIPOLE1D` output file.
+
+    `fields` has shape (nfreq, nrec, 6): Ex, Ey, Ez, Bx, By, Bz. Each line
+    holds real and imaginary parts of the six fields of one frequency and
+    receiver, receivers varying fastest.
+    """
+    fields = np.asarray(fields).reshape(-1, 6)
+    data = np.empty((fields.shape[0], 12))
+    data[:, ::2] = fields.real
+    data[:, 1::2] = fields.imag
+    with open(fname, 'w') as f:
+        f.write('Dipole1D_1.0\n')
+        f.write('# Transmitters: 1\n')
+        f.write('%12.4f %12.4f %12.4f %12.4f %12.4f\n' % (*src[:3], 0, 0))
+        f.write('# Frequencies: %d\n' % np.size(freq))
+        np.savetxt(f, np.atleast_1d(freq), fmt='%12.5g')
+        f.write('# Receivers: %d\n' % np.size(rec[0]))
+        np.savetxt(f, np.c_[rec[0], rec[1], np.ones(np.size(rec[0]))*rec[2]],
+                   fmt='%12.4f')
+        np.savetxt(f, data, fmt='%22.14e')
+
+
+def read_csem(fname):
+    """Return the fields of a `DIPOLE1D` output, shape (nfreq, nrec, 6).
+
+    The format is as documented, see `write_csem`; unverified against the
+    output of the real code.
+    """
+    _, sec = _sections(fname)
+    nfreq, nrec = len(sec['frequencies']), len(sec['receivers'])
+    with open(fname) as f:
+        data = np.array(f.read().split()[-nfreq*nrec*12:], dtype=float)
+    return (data[::2] + 1j*data[1::2]).reshape(nfreq, nrec, 6)
+
+
+# EMmod I/O
+
+def read_emmod(fname, args):
+    """Return the result of `EMmod`, called with `args`, flat complex."""
+    if int(args.get('writebin', 0)):
+        return np.fromfile(fname, dtype=complex)
+    temp = np.load(convert_out(fname), mmap_mode='r')
+    return temp[3] + 1j*temp[4]
+
+
+# Solvers
+
+class Solver:
+    """Description of an external code.
+
+    Parameters
+    ----------
+    name : str
+        Name of the code.
+
+    command : list of str
+        Command line, run in the directory of the input files.
+
+    write, read : callable
+        `write(directory, inp)` writes the input files of the inputs `inp`
+        (dict) to `directory`; `read(directory, inp)` returns the result.
+
+    noop, standin_noop : list of str
+        Command line of a process that does nothing, for the real code and
+        the stand-in; its run time is the spawn overhead.
+
+    """
+
+    def __init__(self, name, command, write, read, noop, standin_noop):
+        self.name = name
+        self.command = command
+        self.write = write
+        self.read = read
+        self.noop = noop
+        self.standin_noop = standin_noop
+
+
+DIPOLE1D = Solver(
+    'DIPOLE1D', ['DIPOLE1D', 'RUNFILE'],
+    lambda d, inp: write_runfile(os.path.join(d, 'RUNFILE'), **inp),
+    lambda d, inp: read_csem(os.path.join(d, inp.get('output',
+                                                     'dipole1d.csem'))),
+    ['true'], ['DIPOLE1D', '--noop'])
+
+EMMOD = Solver(
+    'EMmod', ['bash', 'run.scr'],
+    lambda d, inp: write_scr(os.path.join(d, 'run.scr'), inp),
+    lambda d, inp: read_emmod(os.path.join(d, inp['file_out']), inp),
+    ['bash', '-c', 'true'], ['bash', '-c', 'emmod --noop'])
+
+
+def standin_env():
+    """Environment with the stand-in executables first in the PATH."""
+    env = dict(os.environ)
+    env['PATH'] = STANDIN + os.pathsep + env.get('PATH', '')
+    return env
+
+
+def _timed(func, *args, **kwargs):
+    tstart = time.perf_counter()
+    out = func(*args, **kwargs)
+    return time.perf_counter() - tstart, out
+
+
+def run(solver, inp, repeat=7, standin=False, directory=None):
+    """Time `solver` for the inputs `inp`.
+
+    Every part is timed `repeat` times, of which the best is taken. The
+    solve time is the best time of the call minus the best spawn time.
+
+    Returns
+    -------
+    times : dict
+        Times (s) of write, spawn, process (the whole call), solve, and read.
+
+    result : array
+        Result of the last call, as returned by `solver.read`.
+
+    """
+    env = standin_env() if standin else None
+    noop = solver.standin_noop if standin else solver.noop
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        parts = {'write': [], 'spawn': [], 'process': [], 'read': []}
+        for _ in range(repeat):
+            parts['write'].append(_timed(solver.write, tmp, inp)[0])
+            parts['spawn'].append(_timed(
+                subprocess.run, noop, cwd=tmp, env=env, check=True,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)[0])
+            parts['process'].append(_timed(
+                subprocess.run, solver.command, cwd=tmp, env=env, check=True,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)[0])
+            dt, result = _timed(solver.read, tmp, inp)
+            parts['read'].append(dt)
+            result = np.array(result)
+
+    times = {k: min(v) for k, v in parts.items()}
+    times['solve'] = max(times['process'] - times['spawn'], 0.0)
+    return times, result
+
+
+def dipole1d_cases(spline=False):
+    """Inputs of the `DIPOLE1D` cases of *runtimes.ipynb* (Table 3)."""
+    cases = []
+    for model in MODELS:
+        noff = model['noff']
+        cases.append({'src': [0, 0, 990],
+                      'rec': [np.linspace(500, 20000, noff), np.zeros(noff),
+                              1000],
+                      'depth': model['depth'], 'res': model['res'],
+                      'freq': 1, 'filt': 'kk_ht_201', 'spline': spline})
+    return cases
+
+
+def emmod_cases(names=('100m', )):
+    """Inputs of the `EMmod` cases `names` (see `EMMOD_CASES`)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [read_scr(os.path.join(here, EMMOD_CASES[name])) for name in names]
+
+
+def _report(results, solver, times, name):
+    """Append and print the times of a case."""
+    name = '%s :: %s' % (solver.name, name)
+    results.append(dict(times, name=name))
+    print('%s :: %s' % (' '.join(
+          '%s %7.1f ms' % (k, 1000*times[k]) for k in
+          ['write', 'spawn', 'solve', 'read']), name))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-o', '--output', help='JSON output file')
+    parser.add_argument('-r', '--repeat', type=int, default=7,
+                        help='number of timed repeats')
+    parser.add_argument('-s', '--standin', action='store_true',
+                        help='use the stand-ins instead of the real binaries')
+    parser.add_argument('-e', '--emmod', nargs='*', default=['100m'],
+                        choices=list(EMMOD_CASES),
+                        help='EMmod cases (default: 100m)')
+    args = parser.parse_args(args)
+
+    results = []
+    for spline in [False, True]:
+        for inp in dipole1d_cases(spline):
+            times, _ = run(DIPOLE1D, inp, args.repeat, args.standin)
+            _report(results, DIPOLE1D, times,
+                    'spline=%s :: %d layers :: %d offsets' % (
+                     spline, len(inp['res']), np.size(inp['rec'][0])))
+
+    for name, inp in zip(args.emmod, emmod_cases(args.emmod)):
+        times, _ = run(EMMOD, inp, args.repeat, args.standin)
+        _report(results, EMMOD, times, '%s :: %d x %d receivers' % (
+                name, inp['nx'], inp['ny']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'standin': args.standin,
+                       'results': results}, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,15 +2,32 @@
 Compare different FHT filters with analytical solution
 """
 
-import os
+import logging
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-# Load dipole- and analytical routines
-from empymod import dipole, analytical
+# Load analytical routine (chunked)
+from reference import reference
 from empymod import filters
 
+# Chunked, parallel grid evaluation
+import resources
+from gridcalc import (ErrorKernel, adaptive_dipole, check_single, fill_cells,
+                      grid_dipole, interp_dipole)
+
+# Result cache
+from resultcache import ResultCache
+
+# Profiling of the stages of empymod
+from profiling import Profile
+
+# Filter selection per offset band
+from filtersel import calibrate, save_table, select_dipole
+
+# Parallel figure rendering
+from render import contourf, render
+
 # Plotting style adjustments
 mpl.rc('text', usetex=True)         # Comment this if you don't have LaTeX. You
 font = {'family': 'sans-serif',    # might have to adjust some strings.
@@ -32,7 +49,7 @@ mpl.rc('figure', dpi=300)
 
 
 # Set axis and limits
-def limits(i):
+def limits(axs, i):
     plt.sca(axs[i])
     plt.xlim(min(x)/1000, max(x)/1000)
     plt.ylim(min(x)/1000, max(x)/1000)
@@ -61,13 +78,51 @@ params = {
 
 
 # Analytical solution
-resp = analytical(params['src'], params['rec'], params['res'][1],
-                  params['freqtime'], solution='dhs', aniso=params['aniso'][1],
-                  ab=params['ab'])
-resp = resp.reshape(np.shape(rx))
-
-
-def calc_err(params, htarg=None):
+resp = reference(params['src'], rx, ry, params['rec'][2], params['res'][1],
+                 params['freqtime'], params['ab'], params['aniso'][1])
+
+# Relative error with respect to the analytical solution; amplitude and phase
+# of the analytical solution are calculated once for all configurations
+error = ErrorKernel(resp, chunksize=15000, nthreads=None)
+
+
+# Number of processes for the chunked calculation; None uses all CPUs. The
+# cores are split between the processes and their numexpr/BLAS threads, so
+# they are not oversubscribed; the layout of every calculation is logged.
+nproc = None
+logging.basicConfig(format='  %(message)s', level=logging.INFO)
+
+# Memory budget (bytes) of the chunked calculation; None uses half of the
+# available memory. The number of receivers per chunk is derived from it, for
+# the number of layers, frequencies and filter or QWE points, and adapted to
+# the measured memory of the chunks.
+resources.MEMORY = None
+
+# If set, the grid is calculated by offset-interpolation with this relative
+# tolerance, instead of at every receiver (seconds instead of minutes). Keep
+# it None to reproduce the figures, which show the error of the filters.
+rtol = None
+
+# If True, the grid is calculated by adaptive refinement of a coarse grid,
+# near the source and where amplitude, phase or error vary (about 9 % of the
+# receivers); the errors of the receivers which are not calculated are
+# interpolated. Keep it False to reproduce the figures.
+adaptive = False
+
+# If True, the error maps are stored in single precision (float32), which
+# halves their memory and disk use; they are still calculated in double
+# precision. The response is stored in single precision (complex64) as well,
+# if rounding it changes the errors of a sample of receivers by less than
+# half a contour level (50 levels over 8 decades); see `check_single`.
+single = False
+
+# If True, the stages of empymod (input checks, kernel, Hankel transform, ...)
+# are profiled for every calculated configuration, and written as Chrome trace
+# to *./data/profile/<name>.json*; see profiling.py.
+profile = False
+
+
+def calc_err(params, htarg=None, filename=None):
     """Error calculation
 
     The model is very big (1 million cells), so it gives a very detailed view
@@ -75,197 +130,176 @@ def calc_err(params, htarg=None):
     academic use. On my laptop, all except the lagged FHT would fail due to
     memory issues. Hence I carry out the calculation in loops. More
     'industry'-like values can be seen in Key 2012.
+
+    The chunks are distributed over `nproc` processes (all CPUs if None).
+    Receivers which mirror others about the source are not calculated.
+
+    If `filename` is given, it has to return for an array name ('resp', 'amp',
+    'pha') a `.npy`-file name; response and errors are then streamed chunk by
+    chunk into these files, and returned memory-mapped.
     """
-    inpresp = np.zeros(rx.ravel().shape, dtype=complex)
-    for i in range(74):
-        cc = 15000
-        params['rec'] = [rx.ravel()[i*cc:(i+1)*cc],
-                         ry.ravel()[i*cc:(i+1)*cc], 200]
-        inpresp[i*cc:(i+1)*cc] = dipole(**params, htarg=htarg)
-    params['rec'] = [rx.ravel(), ry.ravel(), 200]
+    if filename is None:
+        def filename(name):
+            return None
+
+    # Precision of the stored response and errors
+    rdtype, edtype = complex, float
+    if single:
+        edtype = np.float32
+        dev = check_single(params, rx, ry, resp, htarg=htarg)
+        if dev < 0.08:
+            rdtype = np.complex64
+        print('  Single precision: deviation %.2f decades, response %s' % (
+              dev, np.dtype(rdtype).name))
+
+    if rtol is not None:
+        inpresp, info = interp_dipole(params, rx, ry, rtol=rtol, nproc=nproc,
+                                      htarg=htarg)
+        print('  Interpolation error: %.2e' % info['error'])
+    elif adaptive:
+        inpresp, info = adaptive_dipole(params, rx, ry, ref=resp,
+                                        chunksize=None, nproc=nproc,
+                                        htarg=htarg)
+        print('  Calculated %d of %d receivers' % (info['ncomputed'], rx.size))
+    else:
+        inpresp = grid_dipole(params, rx, ry, chunksize=None, nproc=nproc,
+                              symmetry=True, out=filename('resp'),
+                              dtype=rdtype, htarg=htarg)
 
     # Reshape and calculate log10-error for phase and amplitude
-    inpresp = inpresp.reshape(np.shape(rx))
-    amperr = np.abs((np.abs(resp) - np.abs(inpresp))/np.abs(resp))*100
-    phaerr = np.abs((np.angle(resp) - np.angle(inpresp))/np.angle(resp))*100
+    inpresp = inpresp.reshape(np.shape(rx)).astype(rdtype, copy=False)
+    amperr, phaerr = error(inpresp, filename('amp'), filename('pha'), edtype)
+
+    # Errors of the receivers which were not calculated are interpolated
+    if adaptive and rtol is None:
+        fill_cells(amperr, info['cells'], info['mask'])
+        fill_cells(phaerr, info['cells'], info['mask'])
 
-    return amperr, phaerr
+    return amperr, phaerr, inpresp
 
 
 # Calculate FHTs
 
-if os.path.isfile('./data/FilterComparison.npz'):  # If results exist,load them
-    data = np.load('data/FilterComparison.npz')
-    fht1amp, fht1pha = data['fht1amp'], data['fht1pha']
-    fht2amp, fht2pha = data['fht2amp'], data['fht2pha']
-    fht3amp, fht3pha = data['fht3amp'], data['fht3pha']
-    fht4amp, fht4pha = data['fht4amp'], data['fht4pha']
-    fht5amp, fht5pha = data['fht5amp'], data['fht5pha']
-    fht6amp, fht6pha = data['fht6amp'], data['fht6pha']
-    fht7amp, fht7pha = data['fht7amp'], data['fht7pha']
-    fht8amp, fht8pha = data['fht8amp'], data['fht8pha']
-    fht9amp, fht9pha = data['fht9amp'], data['fht9pha']
+# The calculation is time intensive. It therefore stores the result in a
+# cache in *./data/cache*, and only calculates it if it is not in the cache.
+# The cache key is created from all inputs (model, receivers, filter, and
+# empymod version), so changed configurations are recalculated.
+# The results are loaded memory-mapped, so only what is plotted is read.
+cache = ResultCache('data/cache')
+
+
+def cached_err(name, htarg):
+    """Return calc_err(params, htarg) from the cache, or calculate it."""
+    def calc(filename):
+        print(name)
+        with Profile('data/profile/%s.json' % name, enabled=profile):
+            amp, pha, inpresp = calc_err(params, htarg=htarg,
+                                         filename=filename)
+        return {'amp': amp, 'pha': pha, 'resp': inpresp}
+
+    call = {'params': params, 'htarg': htarg, 'rtol': rtol,
+            'adaptive': adaptive, 'single': single}
+    out = cache.fetch(call, calc, name)
+    return out['amp'], out['pha']
+
+
+fht1amp, fht1pha = cached_err('Kong07-61', filters.kong_61_2007())
+fht2amp, fht2pha = cached_err('Kong07-241', filters.kong_241_2007())
+fht3amp, fht3pha = cached_err('Key09-101', filters.key_101_2009())
+fht4amp, fht4pha = cached_err('Key09-201', filters.key_201_2009())
+fht5amp, fht5pha = cached_err('Key09-401', filters.key_401_2009())
+fht6amp, fht6pha = cached_err('Anderson82-801', filters.anderson_801_1982())
+fht7amp, fht7pha = cached_err('Key12-51', filters.key_51_2012())
+fht8amp, fht8pha = cached_err('Key12-101', filters.key_101_2012())
+fht9amp, fht9pha = cached_err('Key12-201', filters.key_201_2012())
+
+
+# Calibration table of the errors of the filters per offset band, for the
+# accuracy-targeted filter selection (see filtersel.py). It is only stored if
+# the error maps are exact, not interpolated (`rtol` or `adaptive`); else it
+# is only used in this run.
+off = np.hypot(rx - params['src'][0], ry - params['src'][1])
+table = calibrate({'kong_61_2007': (fht1amp, fht1pha),
+                   'kong_241_2007': (fht2amp, fht2pha),
+                   'key_101_2009': (fht3amp, fht3pha),
+                   'key_201_2009': (fht4amp, fht4pha),
+                   'key_401_2009': (fht5amp, fht5pha),
+                   'anderson_801_1982': (fht6amp, fht6pha),
+                   'key_51_2012': (fht7amp, fht7pha),
+                   'key_101_2012': (fht8amp, fht8pha),
+                   'key_201_2012': (fht9amp, fht9pha)}, off)
+if rtol is None and not adaptive:
+    save_table('data/filter-calibration.json', table)
 else:
-    print('Kong07-61')
-    fht1amp, fht1pha = calc_err(params, htarg=filters.kong_61_2007())
-    print('Kong07-241')
-    fht2amp, fht2pha = calc_err(params, htarg=filters.kong_241_2007())
-    print('Key09-101')
-    fht3amp, fht3pha = calc_err(params, htarg=filters.key_101_2009())
-    print('Key09-201')
-    fht4amp, fht4pha = calc_err(params, htarg=filters.key_201_2009())
-    print('Key09-401')
-    fht5amp, fht5pha = calc_err(params, htarg=filters.key_401_2009())
-    print('Anderson82-801')
-    fht6amp, fht6pha = calc_err(params, htarg=filters.anderson_801_1982())
-    print('Key12-51')
-    fht7amp, fht7pha = calc_err(params, htarg=filters.key_51_2012())
-    print('Key12-101')
-    fht8amp, fht8pha = calc_err(params, htarg=filters.key_101_2012())
-    print('Key12-201')
-    fht9amp, fht9pha = calc_err(params, htarg=filters.key_201_2012())
-    # Store results
-    np.savez('data/FilterComparison.npz',
-             fht1amp=fht1amp, fht1pha=fht1pha, fht2amp=fht2amp,
-             fht2pha=fht2pha, fht3amp=fht3amp, fht3pha=fht3pha,
-             fht4amp=fht4amp, fht4pha=fht4pha, fht5amp=fht5amp,
-             fht5pha=fht5pha, fht6amp=fht6amp, fht6pha=fht6pha,
-             fht7amp=fht7amp, fht7pha=fht7pha, fht8amp=fht8amp,
-             fht8pha=fht8pha, fht9amp=fht9amp, fht9pha=fht9pha)
-
-
-# Plot amplitude
-fig, axs = plt.subplots(figsize=(8.1, 9.6), facecolor='w', nrows=3, ncols=3,
-                        sharex=True, sharey=True)
-axs = axs.ravel()
-
-# Min and max, properties
-vmin = 1e-8
-vmax = 1e0
-props = {'levels': np.logspace(np.log10(vmin), np.log10(vmax), 50),
-         'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys'}
-
-limits(0)
-plt.title(r'(a) Kong07-61')
-cf1 = plt.contourf(rx/1000, ry/1000, fht1amp.clip(vmin, vmax), **props)
-plt.ylabel('Crossline offset (km)')
-
-limits(1)
-plt.title(r'(b) Kong07-241')
-cf2 = plt.contourf(rx/1000, ry/1000, fht2amp.clip(vmin, vmax), **props)
-
-limits(3)
-plt.title(r'(d) Key09-101')
-cf3 = plt.contourf(rx/1000, ry/1000, fht3amp.clip(vmin, vmax), **props)
-plt.ylabel('Crossline offset (km)')
-
-limits(4)
-plt.title(r'(e) Key09-201')
-cf4 = plt.contourf(rx/1000, ry/1000, fht4amp.clip(vmin, vmax), **props)
-
-limits(5)
-plt.title(r'(f) Key09-401')
-cf5 = plt.contourf(rx/1000, ry/1000, fht5amp.clip(vmin, vmax), **props)
-
-limits(2)
-plt.title(r'(c) Anderson82-801')
-cf6 = plt.contourf(rx/1000, ry/1000, fht6amp.clip(vmin, vmax), **props)
-
-limits(6)
-plt.title(r'(g) Key12-51')
-cf7 = plt.contourf(rx/1000, ry/1000, fht7amp.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-plt.ylabel('Crossline offset (km)')
-plt.xticks(np.arange(6)*2)
-
-limits(7)
-plt.title(r'(h) Key12-101')
-cf8 = plt.contourf(rx/1000, ry/1000, fht8amp.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-limits(8)
-plt.title(r'(i) Key12-201')
-cf9 = plt.contourf(rx/1000, ry/1000, fht9amp.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-# Plot colorbar
-cax, kw = mpl.colorbar.make_axes([axs[0], axs[1], axs[2], axs[3], axs[4],
-                                  axs[5], axs[6], axs[7], axs[8]],
-                                 location='bottom', fraction=.05, pad=0.1,
-                                 aspect=30)
-cb = plt.colorbar(cf8, cax=cax, ticks=10**(-(np.arange(11.)[::-1])+2), **kw)
-cb.set_label(r'Relative Error $(\%)$')
-
-# Save and show
-# plt.savefig('../figures/Figure_4.tif', bbox_inches='tight')
-plt.savefig('../figures/Figure_4.jpg', bbox_inches='tight')
-plt.close()
-
-
-# Plot phase
-
-fig, axs = plt.subplots(figsize=(8.1, 9.6), facecolor='w', nrows=3, ncols=3,
-                        sharex=True, sharey=True)
-axs = axs.ravel()
-
-# Min and max, properties
-vmin = 1e-8
-vmax = 1e0
-props = {'levels': np.logspace(np.log10(vmin), np.log10(vmax), 50),
-         'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys'}
-
-limits(0)
-plt.title(r'(a) Kong07-61')
-cf1 = plt.contourf(rx/1000, ry/1000, fht1pha.clip(vmin, vmax), **props)
-plt.ylabel('Crossline offset (km)')
-
-limits(1)
-plt.title(r'(b) Kong07-241')
-cf2 = plt.contourf(rx/1000, ry/1000, fht2pha.clip(vmin, vmax), **props)
-
-limits(3)
-plt.title(r'(d) Key09-101')
-cf3 = plt.contourf(rx/1000, ry/1000, fht3pha.clip(vmin, vmax), **props)
-plt.ylabel('Crossline offset (km)')
-
-limits(4)
-plt.title(r'(e) Key09-201')
-cf4 = plt.contourf(rx/1000, ry/1000, fht4pha.clip(vmin, vmax), **props)
-
-limits(5)
-plt.title(r'(f) Key09-401')
-cf5 = plt.contourf(rx/1000, ry/1000, fht5pha.clip(vmin, vmax), **props)
-
-limits(2)
-plt.title(r'(c) Anderson82-801')
-cf6 = plt.contourf(rx/1000, ry/1000, fht6pha.clip(vmin, vmax), **props)
-
-limits(6)
-plt.title(r'(g) Key12-51')
-cf7 = plt.contourf(rx/1000, ry/1000, fht7pha.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-plt.ylabel('Crossline offset (km)')
-plt.xticks(np.arange(6)*2)
-
-limits(7)
-plt.title(r'(h) Key12-101')
-cf8 = plt.contourf(rx/1000, ry/1000, fht8pha.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-limits(8)
-plt.title(r'(i) Key12-201')
-cf9 = plt.contourf(rx/1000, ry/1000, fht9pha.clip(vmin, vmax), **props)
-plt.xlabel('Inline offset (km)')
-
-# Plot colorbar
-cax, kw = mpl.colorbar.make_axes([axs[0], axs[1], axs[2], axs[3], axs[4],
-                                  axs[5], axs[6], axs[7], axs[8]],
-                                 location='bottom', fraction=.05, pad=0.1,
-                                 aspect=30)
-cb = plt.colorbar(cf8, cax=cax, ticks=10**(-(np.arange(11.)[::-1])+2), **kw)
-cb.set_label(r'Relative Error $(\%)$')
-
-# Save and show
-# plt.savefig('../figures/Figure_4b.tif', bbox_inches='tight')
-plt.savefig('../figures/Figure_4b.jpg', bbox_inches='tight')
-plt.close()
+    print('Calibration table not stored: the error maps are interpolated')
+
+# If set, the grid is calculated once more with the cheapest filter per
+# offset band which meets this target relative error (%)
+target = None
+if target is not None:
+    selresp, info = select_dipole(params, rx, ry, table, target,
+                                  chunksize=None, nproc=nproc)
+    selamp, selpha = error(selresp)
+    print('Filter selection for %.1e %%: %s' % (target, info['nrec']))
+    print('  Max. error (amp, pha): %.2e, %.2e' % (
+          np.nanmax(selamp), np.nanmax(selpha)))
+
+
+# Plot the errors
+
+# The figures are rendered at the end, each in its own process (render.py).
+# If `decimated`, the fields are decimated to the pixel size of the panels,
+# which is much faster; keep it False to reproduce the figures.
+decimated = False
+
+
+def plot_errors(errors, fname):
+    """Plot the nine error maps `errors` (amplitude or phase) to `fname`."""
+    fig, axs = plt.subplots(figsize=(8.1, 9.6), facecolor='w', nrows=3,
+                            ncols=3, sharex=True, sharey=True)
+    axs = axs.ravel()
+
+    # Min and max, properties
+    vmin = 1e-8
+    vmax = 1e0
+    props = {'levels': np.logspace(np.log10(vmin), np.log10(vmax), 50),
+             'locator': mpl.ticker.LogLocator(), 'cmap': 'Greys',
+             'decimated': decimated}
+
+    # Panel, title, and error of every filter
+    panels = [(0, r'(a) Kong07-61'), (1, r'(b) Kong07-241'),
+              (3, r'(d) Key09-101'), (4, r'(e) Key09-201'),
+              (5, r'(f) Key09-401'), (2, r'(c) Anderson82-801'),
+              (6, r'(g) Key12-51'), (7, r'(h) Key12-101'),
+              (8, r'(i) Key12-201')]
+    cfs = {}
+    for (i, title), err in zip(panels, errors):
+        limits(axs, i)
+        plt.title(title)
+        cfs[i] = contourf(rx/1000, ry/1000, err.clip(vmin, vmax), **props)
+        if i % 3 == 0:
+            plt.ylabel('Crossline offset (km)')
+        if i >= 6:
+            plt.xlabel('Inline offset (km)')
+    plt.sca(axs[6])
+    plt.xticks(np.arange(6)*2)
+
+    # Plot colorbar
+    cax, kw = mpl.colorbar.make_axes(list(axs), location='bottom',
+                                     fraction=.05, pad=0.1, aspect=30)
+    cb = plt.colorbar(cfs[7], cax=cax,
+                      ticks=10**(-(np.arange(11.)[::-1])+2), **kw)
+    cb.set_label(r'Relative Error $(\%)$')
+
+    # Save
+    plt.savefig(fname, bbox_inches='tight')
+    plt.close()
+
+
+# Render amplitude and phase errors (use '.tif' to save them as tif)
+render({'Figure_4': lambda: plot_errors(
+            [fht1amp, fht2amp, fht3amp, fht4amp, fht5amp, fht6amp, fht7amp,
+             fht8amp, fht9amp], '../figures/Figure_4.jpg'),
+        'Figure_4b': lambda: plot_errors(
+            [fht1pha, fht2pha, fht3pha, fht4pha, fht5pha, fht6pha, fht7pha,
+             fht8pha, fht9pha], '../figures/Figure_4b.jpg')})
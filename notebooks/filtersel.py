@@ -0,0 +1,164 @@
+"""
+Accuracy-targeted selection of the Hankel filter per offset band.
+
+Figures 4 and 4b of the article show that short filters are accurate over a
+large range of offsets, and that long filters are only needed at the edges.
+Given a target relative error, the receivers are therefore split into offset
+bands, and every band is calculated with the cheapest (shortest) filter that
+meets the target in that band.
+
+Which filter meets which target is taken from a calibration table, which is
+created from error maps as calculated in *filter-comparison.py* (`calibrate`)
+and stored as JSON (`save_table`, `load_table`). The error of a filter in a
+band is a high percentile of the maximum of amplitude and phase error, so the
+few receivers at field nulls, where every filter fails, do not dominate.
+
+"""
+
+import json
+
+import numpy as np
+from empymod import filters
+
+from gridcalc import grid_dipole
+from resultcache import write_atomic
+
+
+def filter_points(name):
+    """Number of points of the `empymod` filter `name`."""
+    return getattr(filters, name)().base.size
+
+
+def band_edges(off, nbands=16, minoff=100):
+    """Offset band edges: [0, `minoff`, log-spaced up to the maximum]."""
+    return np.r_[0, np.geomspace(minoff, np.max(off), nbands)]
+
+
+def _bands(off, edges):
+    """Band index of each offset (beyond the edges: the last band)."""
+    return np.clip(np.digitize(off, edges[1:-1]), 0, len(edges)-2)
+
+
+def calibrate(errors, off, edges=None, percentile=99):
+    """Calibration table of filter errors per offset band.
+
+    Parameters
+    ----------
+    errors : dict
+        {filter name: (amperr, phaerr)}, relative errors (%) of the filter
+        at the offsets `off`, as returned by `ErrorKernel`.
+
+    off : array
+        Offsets of the receivers, same shape as the errors.
+
+    edges : array or None
+        Offset band edges; defaults to `band_edges(off)`.
+
+    percentile : float
+        Percentile of the errors in a band taken as error of the filter.
+
+    Returns
+    -------
+    table : dict
+        {'edges': band edges, 'percentile': percentile, 'filters': {name:
+        {'npts': number of filter points, 'error': error per band}}}.
+
+    """
+    off = np.ravel(off)
+    if edges is None:
+        edges = band_edges(off)
+    bands = _bands(off, edges)
+
+    table = {'edges': list(map(float, edges)), 'percentile': percentile,
+             'filters': {}}
+    for name, (amperr, phaerr) in errors.items():
+        err = np.fmax(np.ravel(amperr), np.ravel(phaerr))
+        perband = []
+        for i in range(len(edges)-1):
+            e = err[bands == i]
+            e = e[np.isfinite(e)]
+            perband.append(float(np.percentile(e, percentile)) if e.size
+                           else np.inf)
+        table['filters'][name] = {'npts': filter_points(name),
+                                  'error': perband}
+    return table
+
+
+def save_table(fname, table):
+    """Store a calibration table as JSON."""
+    write_atomic(fname, lambda f: f.write(
+        json.dumps(table, indent=2).encode()))
+
+
+def load_table(fname):
+    """Load a calibration table stored with `save_table`."""
+    with open(fname) as f:
+        return json.load(f)
+
+
+def select(table, target):
+    """Cheapest filter per band meeting the relative error `target` (%).
+
+    In bands where no filter meets the target, the most accurate filter is
+    taken.
+    """
+    byname = table['filters']
+    cheap = sorted(byname, key=lambda n: byname[n]['npts'])
+    out = []
+    for i in range(len(table['edges'])-1):
+        ok = [n for n in cheap if byname[n]['error'][i] <= target]
+        out.append(ok[0] if ok else min(cheap,
+                                        key=lambda n: byname[n]['error'][i]))
+    return out
+
+
+def select_dipole(params, rx, ry, table, target, chunksize=30000, nproc=None,
+                  **kwargs):
+    """`grid_dipole` with the cheapest filter per offset band.
+
+    Parameters
+    ----------
+    params, rx, ry, chunksize, nproc : as in `grid_dipole`
+        The offsets are computed from `params['src']`.
+
+    table : dict
+        Calibration table, see `calibrate`.
+
+    target : float
+        Target relative error (%) of amplitude and phase.
+
+    **kwargs
+        Additional parameters passed to `dipole` (except `htarg`).
+
+    Returns
+    -------
+    resp : array
+        Complex response, same shape as `rx`.
+
+    info : dict
+        'filters': selected filter per band; 'nrec': number of receivers
+        calculated per filter.
+
+    """
+    shape = np.shape(rx)
+    x = np.asarray(rx, dtype=float).ravel()
+    y = np.asarray(ry, dtype=float).ravel()
+    src = params['src']
+    off = np.hypot(x - np.squeeze(src[0]), y - np.squeeze(src[1]))
+
+    # Filter of each receiver
+    chosen = select(table, target)
+    bands = _bands(off, np.array(table['edges']))
+
+    # Calculate the receivers of each filter in one go
+    resp = np.zeros(x.size, dtype=complex)
+    nrec = {}
+    for name in sorted(set(chosen)):
+        ind = np.isin(bands, [i for i, n in enumerate(chosen) if n == name])
+        if not ind.any():
+            continue
+        resp[ind] = grid_dipole(params, x[ind], y[ind], chunksize, nproc,
+                                htarg=getattr(filters, name)(), **kwargs)
+        nrec[name] = int(ind.sum())
+
+    return resp.reshape(shape), {'filters': chosen, 'nrec': nrec}
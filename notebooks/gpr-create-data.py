@@ -21,9 +21,13 @@ import scipy
 import subprocess
 import numpy as np
 
-from empymod.model import gpr, tem
 from empymod.utils import printstartfinish
 
+from emmodio import load_bin
+from gprcalc import gpr, gpr_sweep, freq2gpr
+from profiling import Profile
+from resultcache import ResultCache
+
 
 # Parameters
 # Parameters as in Hunziker et al., 2015
@@ -54,27 +58,78 @@ inp = {'src': [0, 0, zsrc], 'rec': [x, y, zrec], 'depth': depth, 'res': res,
 
 # Calculate GPR with `empymod` for FHT, QWE, and QUAD and store it in
 # `*.npy`-files which are loaded in the `gpr-figures.ipynb`.
+#
+# The results are cached in *./data/cache*, keyed on all inputs and the
+# empymod version; only changed configurations are recalculated.
+#
+# The frequencies are calculated in blocks, which are checkpointed in
+# *./data/checkpoint*. If the calculation is interrupted (crash, kill, or the
+# SciPy 0.19.0 memory leak), re-running this script continues from the last
+# completed blocks. The blocks are distributed over `nproc` processes (None
+# uses all CPUs).
+nproc = None
+cache = ResultCache('data/cache')
+
+# If True, the stages of empymod (input checks, kernel, Hankel transform,
+# frequency-to-time transform, ...) are profiled for every calculated model,
+# and written as Chrome trace to *./data/profile/<name>.json*.
+profile = False
+
+
+def cached_gpr(name, ht, htarg):
+    """Return gpr(ht, htarg, **inp) from the cache, or calculate it."""
+    def calc(filename):
+        if ht != 'fht' and scipy.__version__ == '0.19.0':
+            print('SciPy 0.19.0 has a memory leak in QUAD, use another '
+                  'version!')
+        with Profile('data/profile/%s.json' % name, enabled=profile):
+            return {'gpr': gpr(ht=ht, htarg=htarg,
+                               checkpoint='data/checkpoint', nproc=nproc,
+                               **inp)}
+
+    call = {'inp': inp, 'ht': ht, 'htarg': htarg}
+    return cache.fetch(call, calc, name)['gpr']
+
 
 # 1. FHT
-gprFHT = gpr(ht='fht', htarg=['key_401_2009', 100], **inp)
+fht_htarg = ['key_401_2009', 100]
+gprFHT = cached_gpr('GPR-FHT', 'fht', fht_htarg)
 np.save('data/GPR-FHT', gprFHT)
 
 
 # 2. QWE
-if scipy.__version__ == '0.19.0':
-    print('SciPy 0.19.0 has a memory leak in QUAD, use another version!')
-gprQWE = gpr(ht='qwe', htarg=[1e-8, 1e-15, '', 200, 200, 60, 1e-6, 160, 4000],
-             **inp)
+gprQWE = cached_gpr('GPR-QWE', 'qwe',
+                    [1e-8, 1e-15, '', 200, 200, 60, 1e-6, 160, 4000])
 np.save('data/GPR-QWE', gprQWE)
 
 
 # 3. QUAD
-if scipy.__version__ == '0.19.0':
-    print('SciPy 0.19.0 has a memory leak in QUAD, use another version!')
-gprQUA = gpr(ht='quad', htarg=['', '', 51, '', 160, 500], **inp)
+gprQUA = cached_gpr('GPR-QUA', 'quad', ['', '', 51, '', 160, 500])
 np.save('data/GPR-QUA', gprQUA)
 
 
+# 4. FHT for the model as used by `EMmod` (see the errata in the README),
+# together with the model above; both models share geometry and frequencies,
+# so further models could be calculated in the same sweep, result shape
+# (model, time, offset). The first model is the one of 1., which is reused.
+models = [{'depth': depth, 'res': res},
+          {'depth': depth, 'res': [2e14, 200, 200]}]
+
+
+def calc_sweep(filename):
+    sinp = {k: v for k, v in inp.items() if k not in ['depth', 'res']}
+    with Profile('data/profile/GPR-FHT-sweep.json', enabled=profile):
+        gprErrata = gpr_sweep(models=models[1:], ht='fht', htarg=fht_htarg,
+                              checkpoint='data/checkpoint', nproc=nproc,
+                              **sinp)
+    return {'gpr': np.r_[gprFHT[None], gprErrata]}
+
+
+call = {'inp': inp, 'models': models, 'ht': 'fht', 'htarg': fht_htarg}
+gprSweep = cache.fetch(call, calc_sweep, 'GPR-FHT-sweep')['gpr']
+np.save('data/GPR-FHT-sweep', gprSweep)
+
+
 # Calculate GPR with `EMmod`
 # To calculate the `EMmod`-result, `EMmod` must be installed and in the
 # bash-PATH.
@@ -92,25 +147,14 @@ subprocess.run('bash gprloop_twointerface.scr', shell=True,
 # Change back to original directory
 os.chdir('../..')
 
-# Read data
-fEM = np.zeros((f.size, x.size), dtype=complex)
-for i in range(f.size):
-    filename = 'data/GPR/gprloop_twointmod_freq'+str(i+1)+'_11.bin'
-    tf = open(filename, 'rb')
-    temp = np.fromfile(tf)
-    fEM[i, :] = temp[x.size*2:x.size*4:2] + 1j*temp[x.size*2+1:x.size*4+1:2]
-
-# Multiply with ricker wavelet
-cfc = -(np.r_[0, f[:-1]]/250e6)**2
-fwave = cfc*np.exp(cfc)
-fEM *= fwave[:, None]
-
-# Do f->t transform
-tEM, conv = tem(fEM, x, f, t, 0, 'fft', [f[0], f.size, 2048, None])
-
-# Apply gain; make pure real
-tEM *= (1 + np.abs((t*10**9)**3))[:, None]
-gprEMmod = tEM.real
+# Read data; the per-frequency files are packed once into one file, of which
+# the result is a memory-mapped view
+files = ['data/GPR/gprloop_twointmod_freq'+str(i+1)+'_11.bin'
+         for i in range(f.size)]
+fEM = load_bin(files, x.size, x.size, 'data/GPR/gprloop_twointmod_11.npy')
+
+# Multiply with ricker wavelet, do f->t transform, apply gain; make pure real
+gprEMmod = freq2gpr(fEM, x, f, t, 250e6, 3, 'fft', [f[0], f.size, 2048, None])
 
 # Print execution time (it will show 'empymod', but obviously in this case it
 # is `EMmod`)
@@ -0,0 +1,319 @@
+"""
+Checkpointed GPR calculation, as used in *gpr-create-data.py*.
+
+`empymod.model.gpr` calculates the frequency-domain response for all
+frequencies in one call to `dipole`, and transforms it then to the time
+domain. With QWE and QUAD this takes many hours, and a crash loses all
+progress.
+
+Here the frequency-domain response is calculated in blocks of frequencies
+and offsets, which are independent of each other and can hence be
+distributed over several processes. Every completed block is written
+atomically to a checkpoint directory, so a restarted calculation continues
+with the missing blocks; at most the blocks in progress are calculated
+twice. The checkpoint directory
+is named after the hash of all inputs, so checkpoints of different
+calculations never mix.
+
+`gpr_sweep` calculates several models which share geometry and frequencies
+(e.g. variants of the two-interface model) in one go: the blocks of all
+models share the worker processes, and the time-domain transform is carried
+out once for all models.
+
+"""
+
+import os
+import shutil
+
+import numpy as np
+from empymod import dipole
+from empymod.model import tem
+from empymod.utils import check_time
+
+from gridcalc import fork_context
+from profiling import flush as profile_flush
+from resources import layout, limit_threads
+from resultcache import call_hash, write_atomic
+
+
+def freq2gpr(fEM, off, freq, time, cf, gain, ft, ftarg):
+    """Frequency-domain response to GPR time-domain traces.
+
+    Multiplies `fEM` (nfreq, noff) with the Ricker wavelet of centre
+    frequency `cf`, transforms it to the time domain, and applies the gain;
+    as in `empymod.model.gpr`.
+    """
+    # Multiply with ricker wavelet
+    cfc = -(np.r_[0, freq[:-1]]/cf)**2
+    fricker = cfc*np.exp(cfc)
+    fEM = fEM*fricker[:, None]
+
+    # Do f->t transform
+    tEM, _ = tem(fEM, off, freq, time, 0, ft, ftarg)
+
+    # Apply gain; make pure real
+    tEM *= (1 + np.abs((time*10**9)**gain))[:, None]
+    return tEM.real
+
+
+def _checkpoint_dir(checkpoint, src, rec, depth, res, freq, fblock, oblock,
+                    kwargs):
+    """Checkpoint directory of a calculation, named after its inputs."""
+    key = call_hash({'src': src, 'rec': rec, 'depth': depth, 'res': res,
+                     'freq': freq, 'fblock': fblock, 'oblock': oblock,
+                     'kwargs': kwargs})
+    return os.path.join(checkpoint, key[:16])
+
+
+def _block_file(directory, i, j):
+    return os.path.join(directory, 'f%04d-o%04d.npy' % (i, j))
+
+
+# Per-process state of the workers, set by `_init_worker`
+_worker = {}
+
+
+def _init_worker(state, nthreads=None):
+    """Set the inputs shared by all blocks in a worker; limit its threads."""
+    _worker.update(state)
+    if nthreads is not None:
+        limit_threads(nthreads)
+
+
+def _calc_block(block):
+    """Calculate and store block (m, i, j): model, frequencies, offsets."""
+    m, i, j = block
+    w = _worker
+    depth, res, kwargs, directory = w['models'][m]
+    fs = slice(i*w['fblock'], (i+1)*w['fblock'])
+    rs = slice(j*w['oblock'], (j+1)*w['oblock'])
+    rec = w['rec']
+    brec = [np.atleast_1d(rec[0])[rs], np.atleast_1d(rec[1])[rs], rec[2]]
+    out = dipole(w['src'], brec, depth, res, w['freq'][fs], verb=0, **kwargs)
+    out = np.reshape(out, (w['freq'][fs].size, -1))
+    if directory is not None:
+        write_atomic(_block_file(directory, i, j), lambda f: np.save(f, out))
+    profile_flush()
+    return m, i, j, out
+
+
+def _model_list(models):
+    """Models as list of dicts, from a list of dicts or a dict of stacks.
+
+    A dict of stacks has one row per model for every parameter, e.g.
+    {'depth': (nmodel, nlayer-1), 'res': (nmodel, nlayer), ...}.
+    """
+    if isinstance(models, dict):
+        nmodel = len(models['res'])
+        return [{k: v[m] for k, v in models.items()} for m in range(nmodel)]
+    return list(models)
+
+
+def spectra(src, rec, models, freq, checkpoint=None, fblock=10, oblock=None,
+            cleanup=False, nproc=1, verb=2, **kwargs):
+    """Frequency-domain responses of several models, in checkpointed blocks.
+
+    The models share source, receivers, and frequencies. The blocks of
+    frequencies and offsets of all models are distributed together over the
+    worker processes; every model has its own checkpoint directory, the same
+    as `spectrum` of that model.
+
+    Parameters
+    ----------
+    models : list of dict, or dict of arrays
+        Every model has 'depth' and 'res', and optionally other model
+        parameters of `dipole` (aniso, epermH, ...), which take precedence
+        over `kwargs`. Alternatively a dict with one row per model for every
+        parameter (see `_model_list`).
+
+    The other parameters are as in `spectrum`.
+
+    Returns
+    -------
+    fEM : array
+        Frequency-domain responses, shape (nmodel, nfreq, nrec).
+
+    """
+    models = _model_list(models)
+    freq = np.atleast_1d(np.asarray(freq, dtype=float))
+    nrec = np.size(rec[0])
+    fblock = freq.size if fblock is None else fblock
+    oblock = nrec if oblock is None else oblock
+    nfb = int(np.ceil(freq.size/fblock))
+    nob = int(np.ceil(nrec/oblock))
+
+    # Model parameters and checkpoint directory of every model
+    mstate = []
+    for model in models:
+        mkwargs = dict(kwargs, **{k: v for k, v in model.items()
+                                  if k not in ['depth', 'res']})
+        directory = None
+        if checkpoint is not None:
+            directory = _checkpoint_dir(checkpoint, src, rec, model['depth'],
+                                        model['res'], freq, fblock, oblock,
+                                        mkwargs)
+            os.makedirs(directory, exist_ok=True)
+        mstate.append((model['depth'], model['res'], mkwargs, directory))
+
+    # Load completed blocks, collect the missing ones
+    fEM = np.zeros((len(models), freq.size, nrec), dtype=complex)
+    todo = []
+    for m, (_, _, _, directory) in enumerate(mstate):
+        for i in range(nfb):
+            for j in range(nob):
+                fname = None
+                if directory is not None:
+                    fname = _block_file(directory, i, j)
+                if fname is not None and os.path.isfile(fname):
+                    fEM[m, i*fblock:(i+1)*fblock,
+                        j*oblock:(j+1)*oblock] = np.load(fname)
+                else:
+                    todo.append((m, i, j))
+    ntot = len(models)*nfb*nob
+    if verb > 1 and len(todo) < ntot:
+        print('   %d/%d blocks loaded from checkpoint' %
+              (ntot-len(todo), ntot))
+
+    # Calculate the missing blocks, serially or in worker processes
+    state = {'src': src, 'rec': rec, 'freq': freq, 'fblock': fblock,
+             'oblock': oblock, 'models': mstate}
+    lay = layout(nproc, len(todo))
+    nproc = lay['nproc']
+
+    def gather(blocks):
+        for n, (m, i, j, out) in enumerate(blocks):
+            fEM[m, i*fblock:(i+1)*fblock, j*oblock:(j+1)*oblock] = out
+            if verb > 1:
+                print('   Block %d/%d finished' % (n+1, len(todo)))
+
+    ctx = fork_context()
+    if nproc < 2 or ctx is None:
+        _init_worker(state)
+        gather(map(_calc_block, todo))
+    else:
+        if verb > 1:
+            print('   %d cores = %d processes x %d thread(s)' % (
+                  lay['cores'], nproc, lay['threads']))
+        with ctx.Pool(nproc, _init_worker, (state, lay['threads'])) as pool:
+            gather(pool.imap_unordered(_calc_block, todo))
+
+    if cleanup:
+        for _, _, _, directory in mstate:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    return fEM
+
+
+def spectrum(src, rec, depth, res, freq, checkpoint=None, fblock=10,
+             oblock=None, cleanup=False, nproc=1, verb=2, **kwargs):
+    """Frequency-domain response, calculated in checkpointed blocks.
+
+    Parameters
+    ----------
+    src, rec, depth, res : as in `dipole`
+        The source has to be a single dipole.
+
+    freq : array
+        Frequencies (Hz).
+
+    checkpoint : str or None
+        Base directory for the checkpoints; None to not checkpoint.
+
+    fblock, oblock : int or None
+        Number of frequencies and offsets per block; None for all.
+
+    cleanup : bool
+        If True, the checkpoints are removed once all blocks are calculated.
+
+    nproc : int or None
+        Number of worker processes over which the blocks are distributed;
+        None for the number of CPUs. Every frequency is independent, so the
+        blocks can be calculated in any order; they are gathered in order.
+
+    verb : int
+        Verbosity; > 1 prints the progress.
+
+    **kwargs
+        Additional parameters passed to `dipole` (ab, ht, htarg, ...).
+
+    Returns
+    -------
+    fEM : array
+        Frequency-domain response, shape (nfreq, nrec).
+
+    """
+    return spectra(src, rec, [{'depth': depth, 'res': res}], freq,
+                   checkpoint, fblock, oblock, cleanup, nproc, verb,
+                   **kwargs)[0]
+
+
+def gpr(src, rec, depth, res, freqtime, cf, gain=None, ft='fft', ftarg=None,
+        checkpoint=None, fblock=10, oblock=None, cleanup=True, nproc=1,
+        verb=2, **kwargs):
+    """GPR response, as `empymod.model.gpr`, but with checkpoints.
+
+    The frequency-domain response is calculated with `spectrum`, which stores
+    every completed block of `fblock` frequencies and `oblock` offsets in
+    `checkpoint`; a restart continues from the completed blocks. If
+    `cleanup`, the checkpoints are removed once the calculation finished.
+    The blocks are distributed over `nproc` processes (None: all CPUs).
+
+    The other parameters are the same as in `empymod.model.gpr`; the source
+    has to be a single dipole.
+    """
+    # Check times and Fourier Transform arguments, get required frequencies
+    time, freq, ft, ftarg = check_time(freqtime, 0, ft, ftarg, verb)
+
+    # Calculate the frequency-domain response, block by block
+    fEM = spectrum(src, rec, depth, res, freq, checkpoint, fblock, oblock,
+                   cleanup, nproc, verb, **kwargs)
+
+    # Offsets
+    off = np.sqrt((np.atleast_1d(rec[0]) - src[0])**2 +
+                  (np.atleast_1d(rec[1]) - src[1])**2)
+
+    return np.squeeze(freq2gpr(fEM, off, freq, time, cf, gain, ft, ftarg))
+
+
+def gpr_sweep(src, rec, models, freqtime, cf, gain=None, ft='fft',
+              ftarg=None, checkpoint=None, fblock=10, oblock=None,
+              cleanup=True, nproc=1, verb=2, **kwargs):
+    """GPR responses of several models sharing geometry and frequencies.
+
+    Times, frequencies and the Fourier transform are set up once. The
+    frequency-domain responses of all models are calculated with `spectra`,
+    whose blocks of all models are distributed together over `nproc`
+    processes, and transformed to the time domain in one batch.
+
+    Parameters
+    ----------
+    models : list of dict, or dict of arrays
+        Models, see `spectra`; e.g. [{'depth': [0, 1], 'res': [2e14, 200,
+        20], 'epermH': [1, 9, 15], 'epermV': [1, 9, 15]}, ...].
+
+    The other parameters are the same as in `gpr`.
+
+    Returns
+    -------
+    gprEM : array
+        GPR responses, shape (nmodel, ntime, noff).
+
+    """
+    # Check times and Fourier Transform arguments, get required frequencies
+    time, freq, ft, ftarg = check_time(freqtime, 0, ft, ftarg, verb)
+
+    # Frequency-domain responses of all models, (nmodel, nfreq, nrec)
+    fEM = spectra(src, rec, models, freq, checkpoint, fblock, oblock,
+                  cleanup, nproc, verb, **kwargs)
+    nmodel, _, nrec = fEM.shape
+
+    # Offsets
+    off = np.sqrt((np.atleast_1d(rec[0]) - src[0])**2 +
+                  (np.atleast_1d(rec[1]) - src[1])**2)
+
+    # All models in one transform, as (nfreq, nmodel*nrec)
+    fEM = fEM.transpose(1, 0, 2).reshape(freq.size, nmodel*nrec)
+    tEM = freq2gpr(fEM, np.tile(off, nmodel), freq, time, cf, gain, ft,
+                   ftarg)
+    return tEM.reshape(time.size, nmodel, nrec).transpose(1, 0, 2)
@@ -0,0 +1,940 @@
+"""
+Chunked, process-parallel evaluation of `empymod.dipole` on receiver grids.
+
+The error maps of *analytical.py* and *filter-comparison.py* are calculated
+on over 1 million receivers. They do not fit into memory in one go, hence the
+receivers are split into chunks. Every chunk is independent, so the chunks are
+distributed to a pool of worker processes, which write their result directly
+into an output array in shared memory.
+
+The result is identical to calling `dipole` chunk by chunk in a loop.
+
+The chunk size can be derived from a memory budget (`chunksize=None`): the
+memory per receiver is estimated from the number of layers, frequencies, and
+filter or QWE points (`receiver_bytes`), and then measured (`tracemalloc`)
+while the chunks are calculated; later chunks are sized with the measured
+value (`ChunkSizer`). The first chunk is calculated alone, the others are
+only submitted to the workers once a measurement exists.
+
+For regular grids the calculation can be restricted to the part of the grid
+which is not a mirror image of another part: in a horizontally layered model
+the response of a dipole source is, depending on the component, symmetric or
+antisymmetric with respect to the vertical planes through the source in x-
+and y-direction.
+
+For big grids it is much cheaper to evaluate the response on a table of
+offsets, and to interpolate it onto the grid, see `interp_dipole`: in a 1D
+model the response depends only on offset and azimuth, and the azimuth enters
+through the factors cos(phi), sin(phi), cos(2 phi), and sin(2 phi).
+
+Error maps are smooth over most of the grid; `adaptive_dipole` starts from a
+coarse grid and refines it near the source and where amplitude, phase or
+error vary, and interpolates the rest.
+
+Responses and errors can be stored in single precision (`dtype`), which halves
+the memory of the output arrays and files. `dipole` and `ErrorKernel` still
+calculate in double precision; every chunk is rounded when it is written.
+Rounded errors are fine for the plots, but errors calculated from a rounded
+response lose everything below about 1e-5 %; whether this is visible in the
+error maps is checked on a sample of receivers with `check_single`.
+
+"""
+
+import os
+import tracemalloc
+import multiprocessing as mp
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+from empymod import dipole, filters
+
+from profiling import flush as profile_flush
+import resources
+from resources import budget, layout, limit_threads, log_layout
+
+
+# Per-process state of the workers, set by `_init_worker`
+_worker = {}
+
+
+def _open_output(target, shape, dtype):
+    """Return the output array described by `target`, as flat array.
+
+    `target` is either ('shm', name) for a shared-memory block, or
+    ('file', filename) for a memory-mapped `.npy`-file.
+    """
+    kind, name = target
+    if kind == 'shm':
+        shm = shared_memory.SharedMemory(name=name)
+        _worker['shm'] = shm  # Keep a reference, or the buffer is released
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return np.load(name, mmap_mode='r+').reshape(-1)
+
+
+def _init_worker(params, x, y, z, target, kwargs, dtype=complex, nthreads=1,
+                 trace=False):
+    """Attach a worker to the shared output array; limit its threads.
+
+    If `trace`, the memory of every chunk is traced (see `ChunkSizer`).
+    """
+    limit_threads(nthreads)
+    _worker['out'] = _open_output(target, x.shape, dtype)
+    _worker['params'] = params
+    _worker['x'] = x
+    _worker['y'] = y
+    _worker['z'] = z
+    _worker['kwargs'] = kwargs
+    if trace:
+        tracemalloc.start()
+
+
+def _calc_chunk(chunk):
+    """Calculate the receivers `chunk` = (start, stop) into the output array.
+
+    Returns the number of receivers, and the peak memory (bytes) used by
+    `dipole` if the memory is traced, else 0.
+    """
+    start, stop = chunk
+    w = _worker
+    params = dict(w['params'])
+    params['rec'] = [w['x'][start:stop], w['y'][start:stop], w['z']]
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    w['out'][start:stop] = dipole(**params, **w['kwargs'])
+    peak = tracemalloc.get_traced_memory()[1] - base if tracing else 0
+    if isinstance(w['out'], np.memmap):
+        w['out'].flush()
+    profile_flush()
+    return stop - start, peak
+
+
+# Complex values per receiver and frequency held by `dipole`, in units of the
+# number of wavenumbers; estimated with `tracemalloc`. Standard DLF/FHT:
+# 'layer' per layer plus 'fixed'; lagged DLF/FHT: 'lagged'; QWE: 'qwe' times
+# nquad*maxint; QUAD: 'quad' values.
+_KERNEL = {'layer': 2, 'fixed': 10, 'lagged': 7, 'qwe': 1.6, 'quad': 1000}
+
+
+def _htarg(htarg, i, keys, default):
+    """Argument `i` of a list `htarg`, or the first of `keys` of a dict."""
+    value = None
+    if isinstance(htarg, dict):
+        value = next((htarg[k] for k in keys if k in htarg), None)
+    elif isinstance(htarg, (list, tuple)) and len(htarg) > i:
+        value = htarg[i]
+    return default if value is None or value == '' else value
+
+
+def receiver_bytes(params, kwargs):
+    """Estimated memory (bytes) per receiver of `dipole`.
+
+    From the number of frequencies and layers, and the number of wavenumbers
+    of the Hankel transform (filter length, or QWE points). `params` and
+    `kwargs` as in `grid_dipole`.
+    """
+    nfreq = np.size(params['freqtime'])
+    nlayer = np.size(params['res'])
+    ht = str(kwargs.get('ht') or 'fht').lower()
+    htarg = kwargs.get('htarg')
+
+    if ht in ('qwe', 'hqwe'):
+        nquad = int(_htarg(htarg, 2, ['nquad'], 51))
+        maxint = int(_htarg(htarg, 3, ['maxint'], 100))
+        values = _KERNEL['qwe']*nquad*maxint
+    elif ht in ('quad', 'hquad'):
+        values = _KERNEL['quad']
+    else:
+        filt = htarg
+        if htarg is None or isinstance(htarg, (list, tuple, dict)):
+            filt = _htarg(htarg, 0, ['dlf', 'fhtfilt'], 'key_201_2009')
+        if isinstance(filt, str):
+            filt = getattr(filters, filt)()
+        npts = filt.base.size
+        lagged = kwargs.get('opt') == 'spline' or (
+                isinstance(htarg, dict) and htarg.get('pts_per_dec', 0))
+        if lagged:
+            values = _KERNEL['lagged']*npts
+        else:
+            values = (_KERNEL['layer']*nlayer + _KERNEL['fixed'])*npts
+
+    return int(16*nfreq*values)
+
+
+class ChunkSizer:
+    """Number of receivers per chunk, from a memory budget.
+
+    The chunk size is the budget divided by the memory per receiver, which is
+    first estimated (`receiver_bytes`). Once chunks are calculated, their
+    measured peak memory (`update`) replaces the estimate: the largest
+    measured memory per receiver is taken, so the chunks grow if the
+    estimate was too high, and shrink if it was too low.
+
+    Parameters
+    ----------
+    size : int
+        Fixed chunk size; used if `nbytes` is None.
+
+    nbytes : int or None
+        Estimated memory per receiver (bytes).
+
+    memory : int
+        Memory budget (bytes) of one process.
+
+    maxsize : int
+        Largest chunk size.
+
+    fill : float
+        Fraction of the budget used, as margin for the rest of the process.
+
+    """
+
+    def __init__(self, size=None, nbytes=None, memory=None, maxsize=None,
+                 fill=0.8):
+        self.nbytes = nbytes
+        self.memory = memory
+        self.maxsize = maxsize
+        self.fill = fill
+        self.measured = None
+        self.size = size if nbytes is None else self._size(nbytes)
+
+    def _size(self, nbytes):
+        size = max(int(self.fill*self.memory/max(nbytes, 1)), 1)
+        return size if self.maxsize is None else min(size, self.maxsize)
+
+    def update(self, nrec, peak):
+        """Adapt the chunk size to the peak memory of `nrec` receivers."""
+        if self.nbytes is None or not peak:
+            return
+        nbytes = peak/nrec
+        self.measured = nbytes if self.measured is None else max(
+                self.measured, nbytes)
+        self.size = self._size(self.measured)
+
+
+def _log_sizer(sizer):
+    """Log the final chunk size and memory per receiver of `sizer`."""
+    if sizer.measured is not None:
+        resources.log.info(
+            'grid_dipole: %d receivers per chunk, %.0f bytes per receiver '
+            '(estimated %.0f)', sizer.size, sizer.measured, sizer.nbytes)
+
+
+def _calc_chunks(submit, n, sizer, inflight=1):
+    """Calculate receivers 0 to `n` in chunks of `sizer.size`.
+
+    `submit(chunk)` starts the calculation of `chunk` = (start, stop) and
+    returns a function which returns its result (see `_calc_chunk`). Up to
+    `inflight` chunks are calculated at a time; the chunk size is adapted to
+    every result, in order of submission.
+
+    As long as the chunk size is only estimated (no chunk measured yet), one
+    chunk is calculated at a time: the estimate can be too low, and `inflight`
+    chunks of it could together exceed the memory budget.
+    """
+    pending = deque()
+    start = 0
+    while start < n or pending:
+        estimated = sizer.nbytes is not None and sizer.measured is None
+        while start < n and len(pending) < (1 if estimated else inflight):
+            stop = min(start + sizer.size, n)
+            pending.append(submit((start, stop)))
+            start = stop
+        sizer.update(*pending.popleft()())
+
+
+def fork_context():
+    """Return the fork-context, or None if the platform does not support it.
+
+    The notebooks are scripts without a `__main__`-guard; with the spawn
+    start method every worker would re-run the entire script.
+    """
+    if 'fork' in mp.get_all_start_methods():
+        return mp.get_context('fork')
+    return None
+
+
+def parity(ab, axis):
+    """Sign of the response of `ab` when mirrored at the `axis`-plane.
+
+    Electric fields are vectors, which flip the component normal to the
+    mirror plane; magnetic fields are pseudo-vectors, which flip the two
+    components parallel to it. The sign of `ab` is the product of the signs
+    of its receiver and its source.
+
+    Parameters
+    ----------
+    ab : int
+        Source-receiver configuration, as in `dipole`.
+
+    axis : int
+        0 for x (x -> -x), 1 for y (y -> -y).
+
+    """
+    sign = 1
+    for digit in divmod(ab, 10):
+        comp = (digit - 1) % 3
+        magnetic = digit > 3
+        sign *= (-1 if comp == axis else 1)*(-1 if magnetic else 1)
+    return sign
+
+
+def _mirror_axis(v, c):
+    """Find the entries of axis `v` which are mirrors of others about `c`.
+
+    Returns the indices which have to be calculated, and for every entry of
+    `v` the index into those calculated entries and whether it is mirrored.
+    """
+    v = np.asarray(v, dtype=float)
+    tol = 1e-9*max(np.abs(v).max(), 1.0)
+
+    # Mirror value of every entry, and where it is in v (if at all)
+    isort = np.argsort(v)
+    mirror = 2*c - v
+    pos = np.clip(np.searchsorted(v[isort], mirror), 0, v.size-1)
+    pos = np.where(np.abs(v[isort][np.maximum(pos-1, 0)] - mirror) <
+                   np.abs(v[isort][pos] - mirror), np.maximum(pos-1, 0), pos)
+    imirror = isort[pos]
+    has_mirror = np.abs(v[imirror] - mirror) < tol
+
+    # Entries on the negative side with a mirror are derived, not calculated
+    derived = has_mirror & (v < c - tol)
+    icalc = np.flatnonzero(~derived)
+    src = np.where(derived, imirror, np.arange(v.size))
+    return icalc, np.searchsorted(icalc, src), derived
+
+
+def grid_symmetry(params, rx, ry):
+    """Detect the mirror symmetry of a regular receiver grid.
+
+    The grid is regular if all rows of `rx` are equal and all columns of `ry`
+    are equal, as created with `np.repeat`/`np.meshgrid`. The source has to be
+    a single dipole.
+
+    Returns None if the grid or the source do not qualify; otherwise a dict
+    with the indices of the columns and rows to calculate ('ix', 'iy'), the
+    indices to fill the full grid from the calculated part ('fx', 'fy'), and
+    the corresponding signs ('sx', 'sy').
+    """
+    rx = np.asarray(rx)
+    ry = np.asarray(ry)
+    src = params['src']
+    if (rx.ndim != 2 or rx.shape != ry.shape or len(src) != 3 or
+            np.size(src[0]) != 1 or np.size(src[1]) != 1):
+        return None
+    x = rx[0, :]
+    y = ry[:, 0]
+    if not (np.all(rx == x[None, :]) and np.all(ry == y[:, None])):
+        return None
+
+    ab = params.get('ab', 11)
+    ix, fx, dx = _mirror_axis(x, float(np.squeeze(src[0])))
+    iy, fy, dy = _mirror_axis(y, float(np.squeeze(src[1])))
+    return {'ix': ix, 'fx': fx, 'sx': np.where(dx, parity(ab, 0), 1),
+            'iy': iy, 'fy': fy, 'sy': np.where(dy, parity(ab, 1), 1)}
+
+
+def grid_dipole(params, rx, ry, chunksize=30000, nproc=None, symmetry=False,
+                out=None, dtype=complex, memory=None, **kwargs):
+    """Calculate `dipole` for all receivers of a receiver grid.
+
+    Parameters
+    ----------
+    params : dict
+        Input parameters for `dipole`; `params['rec'][2]` is used as receiver
+        depth, the receiver x- and y-coordinates are taken from `rx`, `ry`.
+
+    rx, ry : array
+        Receiver x- and y-coordinates; any shape, but the same for both.
+
+    chunksize : int or None
+        Number of receivers calculated in one call to `dipole`. If None, it
+        is derived from the memory budget, and adapted to the measured peak
+        memory of the chunks (see `ChunkSizer`).
+
+    nproc : int or None
+        Number of worker processes; defaults to the number of CPUs. If it is
+        1, or the platform does not support forking, the chunks are
+        calculated serially in this process. The core budget is split
+        between the workers and their numexpr/BLAS threads (see
+        *resources.py*).
+
+    symmetry : bool
+        If True, and `rx`, `ry` are a regular grid (see `grid_symmetry`),
+        only the part of the grid which is not a mirror image of another part
+        is calculated; the rest is filled in with the correct sign.
+
+    out : str or None
+        If given, the response is streamed chunk by chunk into this
+        `.npy`-file, which is returned memory-mapped; peak memory is then
+        bounded by the chunk size instead of the grid size.
+
+    dtype : dtype
+        Data type of the response; `np.complex64` stores it in single
+        precision (see `check_single`).
+
+    memory : int or None
+        Memory budget (bytes) of all processes together, if `chunksize` is
+        None; defaults to the budget of *resources.py*. The output array is
+        subtracted, unless it is written to `out`.
+
+    **kwargs
+        Additional parameters passed to `dipole` (ht, htarg, opt, ...).
+
+    Returns
+    -------
+    resp : array
+        Complex response, same shape as `rx`.
+
+    """
+    shape = np.shape(rx)
+
+    if symmetry:
+        sym = grid_symmetry(params, rx, ry)
+        if sym is not None:
+            sub = np.ix_(sym['iy'], sym['ix'])
+            subout = None if out is None else out + '.sub.npy'
+            subresp = grid_dipole(params, np.asarray(rx)[sub],
+                                  np.asarray(ry)[sub], chunksize, nproc,
+                                  out=subout, dtype=dtype, memory=memory,
+                                  **kwargs)
+            resp = _empty(shape, out, dtype)
+
+            # Fill the grid row-block by row-block from the calculated part
+            nrows = max((chunksize or 30000)//shape[1], 1)
+            for i in range(0, shape[0], nrows):
+                rows = slice(i, i+nrows)
+                resp[rows] = subresp[sym['fy'][rows], :][:, sym['fx']]
+                resp[rows] *= sym['sy'][rows, None]*sym['sx'][None, :]
+
+            if out is not None:
+                del subresp
+                os.remove(subout)
+                resp.flush()
+            return resp
+
+    x = np.asarray(rx, dtype=float).ravel()
+    y = np.asarray(ry, dtype=float).ravel()
+    z = params['rec'][2]
+    params = {k: v for k, v in params.items() if k != 'rec'}
+
+    # Chunk size: fixed, or from the memory budget per process
+    if chunksize is None:
+        nbytes = receiver_bytes(params, kwargs)
+        maxproc = layout(nproc)['nproc']
+        if memory is None:
+            memory = resources.memory()
+        if out is None:  # Output array (and its copy from shared memory)
+            memory -= 2*x.size*np.dtype(dtype).itemsize
+        sizer = ChunkSizer(nbytes=nbytes, memory=max(memory, 0)//maxproc,
+                           maxsize=int(np.ceil(x.size/maxproc)))
+    else:
+        sizer = ChunkSizer(chunksize)
+    lay = layout(nproc, int(np.ceil(x.size/sizer.size)))
+    nproc = lay['nproc']
+    ctx = fork_context()
+
+    # Serial: the same chunks, calculated in this process
+    if nproc < 2 or ctx is None:
+        resp = _empty(shape, out, dtype)
+        _worker.update(out=resp.reshape(-1), params=params, x=x, y=y, z=z,
+                       kwargs=kwargs)
+        trace = sizer.nbytes is not None and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        try:
+            _calc_chunks(lambda c: (lambda: _calc_chunk(c)), x.size, sizer)
+        finally:
+            if trace:
+                tracemalloc.stop()
+            _worker.clear()
+        _log_sizer(sizer)
+        if out is not None:
+            resp.flush()
+        return resp
+
+    def run(target):
+        """Calculate all chunks in a pool of workers writing to `target`."""
+        initargs = (params, x, y, z, target, kwargs, dtype, lay['threads'],
+                    sizer.nbytes is not None)
+        log_layout('grid_dipole', lay)
+        with ctx.Pool(nproc, _init_worker, initargs) as pool:
+            _calc_chunks(lambda c: pool.apply_async(_calc_chunk, (c, )).get,
+                         x.size, sizer, nproc)
+        _log_sizer(sizer)
+
+    # Parallel: workers write into a memory-mapped file ...
+    if out is not None:
+        resp = _empty(shape, out, dtype)
+        run(('file', out))
+        return resp
+
+    # ... or into a shared output array
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=x.size*dtype.itemsize)
+    try:
+        run(('shm', shm.name))
+        resp = np.ndarray(x.shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return resp.reshape(shape)
+
+
+def _empty(shape, out=None, dtype=complex):
+    """Return a zero array, or a memory-mapped `.npy`-file `out`."""
+    if out is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(out, 'w+', dtype, shape)
+
+
+class ErrorKernel:
+    """Relative amplitude and phase error (%) with respect to a reference.
+
+    Amplitude and phase of the reference are calculated once, at creation.
+    The errors of a response are then calculated chunk by chunk directly in
+    the output arrays, without full-size temporary arrays; the chunks can be
+    distributed over threads (NumPy releases the GIL).
+
+    Parameters
+    ----------
+    ref : array
+        Reference response.
+
+    chunksize : int
+        Number of values per chunk.
+
+    nthreads : int or None
+        Number of threads; None for the core budget (see *resources.py*).
+
+    """
+
+    def __init__(self, ref, chunksize=30000, nthreads=None):
+        self.shape = np.shape(ref)
+        ref = np.reshape(ref, -1)
+        self.amp = np.abs(ref)
+        self.pha = np.arctan2(ref.imag, ref.real)
+        self.chunksize = chunksize
+        self.nthreads = budget() if nthreads is None else nthreads
+
+    def _chunk(self, resp, amperr, phaerr, i):
+        """Calculate the errors of chunk `i` in place.
+
+        The errors are calculated in double precision; for single-precision
+        outputs in chunk-sized buffers, which are then rounded.
+        """
+        sl = slice(i, i+self.chunksize)
+        c, a, p = resp[sl], amperr[sl], phaerr[sl]
+        ra, rp = self.amp[sl], self.pha[sl]
+        single = a.dtype != np.float64
+        if single:
+            a, p = np.empty(a.shape), np.empty(p.shape)
+
+        # |(|ref| - |resp|)/|ref||*100
+        np.abs(c, out=a)
+        np.subtract(ra, a, out=a)
+        np.divide(a, ra, out=a)
+        np.abs(a, out=a)
+        np.multiply(a, 100, out=a)
+
+        # |(angle(ref) - angle(resp))/angle(ref)|*100
+        np.arctan2(c.imag, c.real, out=p)
+        np.subtract(rp, p, out=p)
+        np.divide(p, rp, out=p)
+        np.abs(p, out=p)
+        np.multiply(p, 100, out=p)
+
+        if single:
+            amperr[sl], phaerr[sl] = a, p
+
+    def __call__(self, resp, amp=None, pha=None, dtype=float):
+        """Return amplitude and phase error of `resp`.
+
+        If `amp`, `pha` are given, the errors are streamed into these
+        `.npy`-files, and returned memory-mapped. `dtype` is the data type
+        of the errors; `np.float32` stores them in single precision.
+        """
+        amperr = _empty(self.shape, amp, dtype)
+        phaerr = _empty(self.shape, pha, dtype)
+        args = (np.reshape(resp, -1), amperr.reshape(-1), phaerr.reshape(-1))
+        chunks = range(0, args[0].size, self.chunksize)
+
+        if self.nthreads > 1:
+            with ThreadPoolExecutor(self.nthreads) as ex:
+                list(ex.map(lambda i: self._chunk(*args, i), chunks))
+        else:
+            for i in chunks:
+                self._chunk(*args, i)
+
+        for err in (amperr, phaerr):
+            if isinstance(err, np.memmap):
+                err.flush()
+        return amperr, phaerr
+
+
+def check_single(params, rx, ry, ref, nsample=100, vmin=1e-8, **kwargs):
+    """Deviation of single- from double-precision errors on a sample.
+
+    The response at `nsample` randomly drawn receivers is calculated, and its
+    amplitude and phase errors with respect to `ref` (see `ErrorKernel`) are
+    computed in double precision, and after rounding it to single precision.
+    Errors below `vmin` (%), the lower limit of the error maps, are set to
+    `vmin`.
+
+    Returns the maximum deviation of the log10-errors, in decades; compare it
+    to the spacing of the contour levels of the error maps.
+    """
+    x = np.asarray(rx, dtype=float).ravel()
+    y = np.asarray(ry, dtype=float).ravel()
+    isample = np.random.RandomState(0).choice(
+            x.size, min(nsample, x.size), replace=False)
+    sresp = grid_dipole(params, x[isample], y[isample], nproc=1, **kwargs)
+    kernel = ErrorKernel(np.ravel(ref)[isample])
+    dev = 0.0
+    for e64, e32 in zip(kernel(sresp), kernel(sresp.astype(np.complex64))):
+        d = np.abs(np.log10(np.fmax(e64, vmin)) - np.log10(np.fmax(e32, vmin)))
+        dev = max(dev, np.max(d[np.isfinite(d)], initial=0.0))
+    return float(dev)
+
+
+# Azimuths at which the offset table is evaluated; five equally spaced angles
+# determine the five angle factors exactly
+_ANGLES = 2*np.pi*np.arange(5)/5
+
+
+def _angle_factors(ang):
+    """Angle factors [1, cos(2a), sin(2a), cos(a), sin(a)], shape (5, n)."""
+    ang = np.asarray(ang, dtype=float)
+    return np.array([np.ones(ang.shape), np.cos(2*ang), np.sin(2*ang),
+                     np.cos(ang), np.sin(ang)])
+
+
+def _radial_parts(params, off, chunksize, nproc, kwargs):
+    """Radial parts of the response at offsets `off`, shape (5, off.size).
+
+    The response is evaluated at five azimuths for every offset, and the
+    radial parts are the coefficients of the five angle factors.
+    """
+    xs, ys = (float(np.squeeze(params['src'][i])) for i in range(2))
+    tx = xs + off[None, :]*np.cos(_ANGLES)[:, None]
+    ty = ys + off[None, :]*np.sin(_ANGLES)[:, None]
+    resp = grid_dipole(params, tx, ty, chunksize, nproc, **kwargs)
+    return np.linalg.solve(_angle_factors(_ANGLES).T, resp)
+
+
+def interp_dipole(params, rx, ry, rtol=1e-6, pts_per_dec=10, maxiter=10,
+                  nsample=100, chunksize=30000, nproc=None, **kwargs):
+    """Calculate `dipole` on a receiver grid by offset-interpolation.
+
+    The radial parts of the response are evaluated on a log-spaced table of
+    offsets, from the smallest to the largest offset of the grid. The table
+    is refined adaptively: the radial parts are evaluated at the centre of
+    every table interval, and compared to the cubic spline through the table.
+    Intervals where the relative difference exceeds `rtol` are halved, until
+    all intervals are accurate or `maxiter` refinements are reached. The
+    full grid is then rebuilt from the splined radial parts and the angle
+    factors of each receiver.
+
+    Receivers at zero offset (at the source position) are calculated directly.
+
+    Parameters
+    ----------
+    params : dict
+        Input parameters for `dipole`, as in `grid_dipole`. The source has to
+        be a single dipole.
+
+    rx, ry : array
+        Receiver x- and y-coordinates; any shape, but the same for both.
+
+    rtol : float
+        Target relative interpolation error.
+
+    pts_per_dec : int
+        Points per decade of the initial offset table.
+
+    maxiter : int
+        Maximum number of refinements.
+
+    nsample : int
+        Number of randomly drawn receivers which are calculated directly to
+        verify the result; 0 to skip it.
+
+    chunksize, nproc : int
+        Passed to `grid_dipole`, which evaluates the offset table.
+
+    **kwargs
+        Additional parameters passed to `dipole` (ht, htarg, opt, ...).
+
+    Returns
+    -------
+    resp : array
+        Complex response, same shape as `rx`.
+
+    info : dict
+        'error': estimated max. relative interpolation error of the table;
+        'sample_error': max. relative error of the `nsample` receivers;
+        'noff': number of offsets in the table; 'ndistinct': number of
+        distinct offsets in the grid.
+
+    """
+    x = np.asarray(rx, dtype=float).ravel()
+    y = np.asarray(ry, dtype=float).ravel()
+    src = params['src']
+    if len(src) != 3 or np.size(src[0]) != 1 or np.size(src[1]) != 1:
+        raise ValueError('interp_dipole requires a single dipole source')
+    xs, ys = (float(np.squeeze(src[i])) for i in range(2))
+
+    # Distinct offsets and azimuths of all receivers
+    off = np.hypot(x - xs, y - ys)
+    ang = np.arctan2(y - ys, x - xs)
+    uoff, iuoff = np.unique(off, return_inverse=True)
+    direct = uoff[iuoff] <= 1e-9*max(uoff[-1], 1.0)
+    toff = uoff[uoff > 1e-9*max(uoff[-1], 1.0)]
+    lmin, lmax = np.log(toff[0]), np.log(toff[-1])
+
+    # Initial log-spaced offset table
+    nint = max(int(np.ceil(pts_per_dec*(lmax - lmin)/np.log(10))), 1)
+    lr = np.linspace(lmin, lmax, nint+1)
+    parts = _radial_parts(params, np.exp(lr), chunksize, nproc, kwargs)
+
+    # Adaptive refinement: test interval centres against the spline
+    check = np.ones(nint, dtype=bool)
+    error = 0.0
+    for _ in range(maxiter+1):
+        mid = ((lr[:-1] + lr[1:])/2)[check]
+        mparts = _radial_parts(params, np.exp(mid), chunksize, nproc, kwargs)
+        spline = CubicSpline(lr, parts, axis=1)
+        merr = np.abs(spline(mid) - mparts).max(0)
+        merr /= np.maximum(np.abs(mparts).max(0), np.finfo(float).tiny)
+
+        # Add the centres to the table
+        lr = np.r_[lr, mid]
+        isort = np.argsort(lr)
+        lr = lr[isort]
+        parts = np.c_[parts, mparts][:, isort]
+
+        failed = merr > rtol
+        if np.any(~failed):
+            error = max(error, merr[~failed].max())
+        if not np.any(failed):
+            break
+
+        # Next, test the two halves of every failed interval
+        check = np.isin(lr[:-1], mid[failed]) | np.isin(lr[1:], mid[failed])
+    else:
+        error = max(error, merr.max())
+
+    # Rebuild the grid, chunk by chunk
+    spline = CubicSpline(lr, parts, axis=1)
+    upart = spline(np.log(np.maximum(uoff, toff[0])))
+    resp = np.zeros(x.shape, dtype=complex)
+    for i in range(int(np.ceil(x.size/chunksize))):
+        sl = slice(i*chunksize, (i+1)*chunksize)
+        resp[sl] = np.sum(upart[:, iuoff[sl]]*_angle_factors(ang[sl]), 0)
+
+    # Receivers at the source position
+    if np.any(direct):
+        resp[direct] = grid_dipole(params, x[direct], y[direct], chunksize,
+                                   1, **kwargs)
+
+    # Verify on a random sample of receivers
+    sample_error = None
+    if nsample > 0:
+        isample = np.random.RandomState(0).choice(
+                x.size, min(nsample, x.size), replace=False)
+        sresp = grid_dipole(params, x[isample], y[isample], chunksize, 1,
+                            **kwargs)
+        # Relative error, not considering receivers on nulls of the field
+        keep = np.abs(sresp) > 1e-10*np.abs(sresp).max()
+        sample_error = np.max(np.abs(resp[isample] - sresp)[keep] /
+                              np.abs(sresp)[keep], initial=0.0)
+
+    info = {'error': error, 'sample_error': sample_error, 'noff': lr.size,
+            'ndistinct': uoff.size}
+
+    return resp.reshape(np.shape(rx)), info
+
+
+def _corner_logs(v):
+    """Logarithm of the corner values `v` (..., 4) of cells.
+
+    For complex values the phase of every corner is unwrapped relative to the
+    first corner, so the imaginary part can be interpolated.
+    """
+    v = np.where(v == 0, np.finfo(float).tiny, v)
+    return np.log(v[..., :1]) + np.log(v/v[..., :1])
+
+
+def fill_cells(data, cells, mask):
+    """Fill the points of `data` which are not in `mask` from cell corners.
+
+    Every cell (i0, i1, j0, j1) of `cells` is filled by bilinear
+    interpolation of the logarithm of its corner values (amplitude and phase
+    for complex data). Finer cells are filled last, so they take precedence on
+    edges shared with coarser cells. `data` is changed in place.
+    """
+    size = (cells[:, 1] - cells[:, 0])*(cells[:, 3] - cells[:, 2])
+    for i0, i1, j0, j1 in cells[np.argsort(-size, kind='stable')]:
+        if i1 - i0 < 2 and j1 - j0 < 2:
+            continue  # All points are corners
+        lv = _corner_logs(data[[i0, i0, i1, i1], [j0, j1, j0, j1]])
+        ti = np.linspace(0, 1, i1-i0+1)[:, None]
+        tj = np.linspace(0, 1, j1-j0+1)[None, :]
+        li = ((1-ti)*((1-tj)*lv[0] + tj*lv[1]) +
+              ti*((1-tj)*lv[2] + tj*lv[3]))
+        block = data[i0:i1+1, j0:j1+1]
+        fill = ~mask[i0:i1+1, j0:j1+1]
+        block[fill] = np.exp(li[fill]) if np.iscomplexobj(data) else np.exp(
+                li[fill]).real
+
+
+def adaptive_dipole(params, rx, ry, step=32, atol=0.5, ptol=0.5, ref=None,
+                    etol=0.2, minoff=None, chunksize=30000, nproc=None,
+                    **kwargs):
+    """Calculate `dipole` on a regular receiver grid by adaptive refinement.
+
+    The response is first calculated on a coarse grid of every `step`th
+    receiver. Cells (between four calculated receivers) are then split into
+    four, and the new corners calculated, where the amplitude varies over the
+    cell corners by more than `atol` decades, or the phase by more than
+    `ptol` radians; if `ref` is given, also where the relative error of the
+    amplitude or the phase with respect to `ref` varies by more than `etol`
+    decades. Cells within `minoff` of the source are always split, as the
+    response and its error change fastest there. The refinement stops at the
+    grid spacing. All receivers which were not calculated are interpolated
+    (see `fill_cells`).
+
+    The tolerances are meant for error maps, where errors are interpolated
+    instead of the response. With the defaults, on the grid of
+    *analytical.py* (10 m spacing, 1051 x 1051 receivers, FHT), 9 % of the
+    receivers are calculated. The interpolated error maps (clipped to 1e-8 -
+    1 %, as plotted) differ from the maps of all receivers by 0.004 decades
+    (90th percentile) and 0.017 decades (99th percentile), about a tenth of a
+    contour level; 0.3 % of the receivers are off by more than one level, up
+    to 2 decades, in narrow minima of the error. On a smaller area the saving
+    is smaller (15 % calculated on 421 x 421 receivers), and larger
+    tolerances save more at the cost of accuracy (`etol=0.3`: 6 % calculated,
+    0.04 decades at the 99th percentile). Without `ref` only amplitude and
+    phase steer the refinement, which does not resolve the error maps.
+
+    Parameters
+    ----------
+    params : dict
+        Input parameters for `dipole`, as in `grid_dipole`.
+
+    rx, ry : array
+        Receiver x- and y-coordinates of a regular grid, shape (ny, nx).
+
+    step : int
+        Spacing of the initial coarse grid, in receivers.
+
+    atol, ptol : float
+        Tolerances of the variation of amplitude (decades) and phase (rad).
+
+    ref : array or None
+        Reference response, same shape as `rx`, e.g. an analytical solution.
+
+    etol : float
+        Tolerance of the variation of the relative error (decades), if `ref`
+        is given.
+
+    minoff : float or None
+        Cells closer to the source than `minoff` (m) are always refined, so
+        all receivers within `minoff` of the source are calculated; None for
+        the size of the coarse cells (`step` times the grid spacing).
+
+    chunksize, nproc : int or None
+        Passed to `grid_dipole`, which is called once per refinement level.
+
+    **kwargs
+        Additional parameters passed to `dipole` (ht, htarg, opt, ...).
+
+    Returns
+    -------
+    resp : array
+        Complex response, same shape as `rx`.
+
+    info : dict
+        'mask': boolean array, True where the response was calculated;
+        'cells': final cells (i0, i1, j0, j1), to interpolate other
+        quantities with `fill_cells`; 'ncomputed': number of calculated
+        receivers.
+
+    """
+    rx = np.asarray(rx, dtype=float)
+    ry = np.asarray(ry, dtype=float)
+    if rx.ndim != 2 or min(rx.shape) < 2:
+        raise ValueError('adaptive_dipole requires a 2D receiver grid')
+    ny, nx = rx.shape
+    resp = np.zeros(rx.shape, dtype=complex)
+    mask = np.zeros(rx.shape, dtype=bool)
+    tiny = np.finfo(float).tiny
+    xs, ys = (float(np.squeeze(params['src'][i])) for i in range(2))
+    if minoff is None:
+        minoff = step*max(abs(rx[0, 1] - rx[0, 0]), abs(ry[1, 0] - ry[0, 0]))
+
+    def calc(ii, jj):
+        """Calculate the receivers (ii, jj) not yet calculated."""
+        ind = np.unique(ii*nx + jj)
+        ind = ind[~mask.ravel()[ind]]
+        if ind.size:
+            ii, jj = np.divmod(ind, nx)
+            resp[ii, jj] = grid_dipole(params, rx[ii, jj], ry[ii, jj],
+                                       chunksize, nproc, **kwargs)
+            mask[ii, jj] = True
+
+    def variation(v):
+        """Variation over the corners, in decades."""
+        lv = np.log10(v + tiny)
+        return lv.max(1) - lv.min(1)
+
+    # Coarse grid and its cells
+    ii = np.unique(np.r_[0:ny:step, ny-1])
+    jj = np.unique(np.r_[0:nx:step, nx-1])
+    calc(*(g.ravel() for g in np.meshgrid(ii, jj, indexing='ij')))
+    i0, j0 = (g.ravel() for g in np.meshgrid(ii[:-1], jj[:-1], indexing='ij'))
+    i1, j1 = (g.ravel() for g in np.meshgrid(ii[1:], jj[1:], indexing='ij'))
+    cells = np.c_[i0, i1, j0, j1]
+
+    final = []
+    while cells.size:
+        i0, i1, j0, j1 = cells.T
+        corners = ([i0, i0, i1, i1], [j0, j1, j0, j1])
+        v = resp[corners].T
+        refine = variation(np.abs(v)) > atol
+        ph = np.angle(v/np.where(v[:, :1] == 0, tiny, v[:, :1]))
+        refine |= ph.max(1) - ph.min(1) > ptol
+        if ref is not None:
+            r = np.asarray(ref)[corners].T
+            refine |= variation(np.abs((np.abs(r) - np.abs(v))/r)) > etol
+            rp = np.angle(r)
+            rp = np.where(rp == 0, tiny, rp)
+            refine |= variation(np.abs((rp - np.angle(v))/rp)) > etol
+
+        # Cells close to the source
+        cx, cy = rx[corners].T, ry[corners].T
+        dx = np.maximum(np.maximum(cx.min(1) - xs, xs - cx.max(1)), 0)
+        dy = np.maximum(np.maximum(cy.min(1) - ys, ys - cy.max(1)), 0)
+        refine |= np.hypot(dx, dy) < minoff
+        refine &= (i1 - i0 > 1) | (j1 - j0 > 1)
+
+        final.append(cells[~refine])
+        i0, i1, j0, j1 = cells[refine].T
+        im, jm = (i0 + i1)//2, (j0 + j1)//2
+        calc(np.r_[i0, i1, im, im, im], np.r_[jm, jm, j0, j1, jm])
+
+        # Four children per cell; halves of width 0 are dropped
+        cells = np.r_[np.c_[i0, im, j0, jm], np.c_[i0, im, jm, j1],
+                      np.c_[im, i1, j0, jm], np.c_[im, i1, jm, j1]]
+        keep = (cells[:, 0] < cells[:, 1]) & (cells[:, 2] < cells[:, 3])
+        cells = cells[keep]
+
+    cells = np.concatenate(final)
+    fill_cells(resp, cells, mask)
+
+    return resp, {'mask': mask, 'cells': cells, 'ncomputed': int(mask.sum())}
@@ -0,0 +1,389 @@
+"""
+Dependency-aware runner of the data-generation and figure scripts.
+
+The scripts communicate through files: *gpr-create-data.py* writes the
+`npy`/`npz` files in *./data* which *gpr-figure.py* reads, and most scripts
+call `os.chdir` into *./data* for the external codes. The table `STAGES` below
+declares for every script its command, inputs and outputs; a stage depends on
+the stages which produce its inputs. The helper modules a script imports from
+this directory are added to its inputs automatically, except those which do
+not change what a script computes (`NEUTRAL`: core budget, profiling,
+version information).
+
+A stage is up to date if all its outputs exist, if the contents of its inputs
+did not change since its last successful run, and if no stage it depends on
+has to run; up-to-date stages are skipped. The content hashes (of the code
+of Python files, so comments and formatting do not count) are stored in
+*./data/pipeline-state.json*; for stages which never ran through the pipeline
+the outputs have to be newer than the inputs instead.
+
+The other stages are run as soon as their dependencies have finished, as
+many at a time as fit in the CPU budget. Every stage runs in its own process
+in this directory, with its share of the budget as core budget (environment
+variable `RESOURCES_CORES`, see *resources.py*), so stages running at the
+same time do not oversubscribe the CPUs; its output goes to
+*./data/logs/<stage>.log*. Status and wall time of every stage are stored as
+JSON in *./data/pipeline.json*.
+
+Usage:
+
+    python pipeline.py                       # Run all stale stages
+    python pipeline.py -n                    # Show what would run
+    python pipeline.py -f gpr-figure         # Force a stage to run
+    python pipeline.py -c 4 analytical       # A stage and its dependencies
+
+"""
+
+import os
+import sys
+import ast
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from resources import CORES_VAR, budget
+from resultcache import call_hash, write_atomic
+
+# Directory of the scripts; all paths below are relative to it
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Content hashes of the inputs of the last successful run of every stage
+STATE = 'data/pipeline-state.json'
+
+# Helper modules which do not change what a script computes, only how (core
+# budget, profiling, version information); they are not inputs of a stage
+NEUTRAL = {'resources.py', 'printinfo.py', 'profiling.py'}
+
+# Stages: command, inputs (besides the script and its helper modules),
+# outputs, and number of CPUs used (None: all of the budget). The grid and
+# GPR calculations use all CPUs; the benchmark takes all as well, so its
+# timings are not disturbed by other stages.
+STAGES = {
+    'analytical': {
+        'command': ['python', 'analytical.py'],
+        'inputs': ['data/halfspacemod_10m.scr'],
+        'outputs': ['../figures/Figure_1.jpg', '../figures/Figure_2.jpg',
+                    '../figures/Figure_3.jpg', '../figures/Figure_5.jpg'],
+        'cpus': None},
+    'filter-comparison': {
+        'command': ['python', 'filter-comparison.py'],
+        'inputs': [],
+        'outputs': ['../figures/Figure_4.jpg', '../figures/Figure_4b.jpg',
+                    'data/filter-calibration.json'],
+        'cpus': None},
+    'gpr-create-data': {
+        'command': ['python', 'gpr-create-data.py'],
+        'inputs': ['data/GPR/gprloop_twointerface.scr'],
+        'outputs': ['data/GPR-FHT.npy', 'data/GPR-QWE.npy',
+                    'data/GPR-QUA.npy', 'data/GPR-FHT-sweep.npy',
+                    'data/GPR-EMmod.npy', 'data/ArrivalTimes.npz'],
+        'cpus': None},
+    'gpr-figure': {
+        'command': ['python', 'gpr-figure.py'],
+        'inputs': ['data/GPR-FHT.npy', 'data/GPR-QWE.npy',
+                   'data/GPR-QUA.npy', 'data/GPR-EMmod.npy',
+                   'data/ArrivalTimes.npz'],
+        'outputs': ['../figures/Figure_6.tif'],
+        'cpus': 1},
+    'time-domain': {
+        'command': ['python', 'time-domain.py'],
+        'inputs': [],
+        'outputs': ['../figures/Figure_7.tif'],
+        'cpus': 1},
+    # The `empymod`-part of runtimes.ipynb (Tables 2 and 3)
+    'runtimes': {
+        'command': ['python', 'benchmark.py', '-o', 'data/benchmark.json'],
+        'inputs': [],
+        'outputs': ['data/benchmark.json'],
+        'cpus': None},
+}
+
+
+def local_imports(script, found=None):
+    """Modules of this directory imported by `script`, recursively.
+
+    `NEUTRAL` modules, and the modules only they import, are left out.
+    """
+    found = set() if found is None else found
+    with open(os.path.join(HERE, script)) as f:
+        tree = ast.parse(f.read(), script)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            fname = name.split('.')[0] + '.py'
+            if fname in NEUTRAL:
+                continue
+            if fname not in found and os.path.isfile(
+                    os.path.join(HERE, fname)):
+                found.add(fname)
+                local_imports(fname, found)
+    return found
+
+
+def inputs(stage):
+    """All inputs of `stage`: script, helper modules, declared inputs."""
+    script = [c for c in STAGES[stage]['command'] if c.endswith('.py')]
+    modules = set()
+    for s in script:
+        local_imports(s, modules)
+    return script + sorted(modules - set(script)) + STAGES[stage]['inputs']
+
+
+def dependencies(stage):
+    """Stages producing an input of `stage`."""
+    ins = set(inputs(stage))
+    return [s for s in STAGES if s != stage and
+            ins.intersection(STAGES[s]['outputs'])]
+
+
+def _mtime(fname):
+    """Modification time of `fname`, None if it does not exist."""
+    try:
+        return os.path.getmtime(os.path.join(HERE, fname))
+    except OSError:
+        return None
+
+
+def _digest(fname):
+    """Hash of the content of `fname`, None if it does not exist.
+
+    Of Python files the syntax tree is hashed, without comments and
+    formatting.
+    """
+    try:
+        with open(os.path.join(HERE, fname), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if fname.endswith('.py'):
+        data = ast.dump(ast.parse(data, fname)).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def input_hash(stage):
+    """Hash of the command and of the contents of all inputs of `stage`."""
+    return call_hash({'command': STAGES[stage]['command'],
+                      'inputs': {f: _digest(f) for f in inputs(stage)}})
+
+
+def load_state():
+    """{stage: input hash} of the last successful runs."""
+    try:
+        with open(os.path.join(HERE, STATE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def up_to_date(stage, state=None):
+    """True if all outputs of `stage` exist and its inputs are unchanged.
+
+    Unchanged means the same input hash as in `state` (see `load_state`);
+    if `stage` is not in it, the outputs have to be newer than the inputs.
+    """
+    tout = [_mtime(f) for f in STAGES[stage]['outputs']]
+    if not tout or None in tout:
+        return False
+    if state and stage in state:
+        return state[stage] == input_hash(stage)
+    tin = [t for t in map(_mtime, inputs(stage)) if t is not None]
+    return not tin or min(tout) >= max(tin)
+
+
+def plan(targets=None, force=()):
+    """Stages to consider and stages to run.
+
+    Parameters
+    ----------
+    targets : list of str or None
+        Stages to bring up to date, with their dependencies; None for all.
+
+    force : list of str
+        Stages to run even if up to date; their dependents run as well.
+
+    Returns
+    -------
+    deps : dict
+        {stage: dependencies}, of the targets and their dependencies.
+
+    stale : set
+        Stages which have to run.
+
+    """
+    deps = {}
+    state = load_state()
+    todo = list(STAGES if targets is None else targets)
+    while todo:
+        stage = todo.pop()
+        if stage not in STAGES:
+            raise ValueError('Unknown stage: %s' % stage)
+        if stage not in deps:
+            deps[stage] = dependencies(stage)
+            todo += deps[stage]
+
+    # A stage is stale if forced, out of date, or if a dependency is stale
+    stale = set()
+    changed = True
+    while changed:
+        changed = False
+        for stage, sdeps in deps.items():
+            if stage not in stale and (
+                    stage in force or not up_to_date(stage, state) or
+                    stale.intersection(sdeps)):
+                stale.add(stage)
+                changed = True
+    return deps, stale
+
+
+def _run_stage(stage, cpus):
+    """Run `stage` on `cpus` cores, logging to data/logs.
+
+    Returns exit status and wall time.
+    """
+    os.makedirs(os.path.join(HERE, 'data', 'logs'), exist_ok=True)
+    log = os.path.join(HERE, 'data', 'logs', stage+'.log')
+    command = [sys.executable if c == 'python' else c
+               for c in STAGES[stage]['command']]
+    env = dict(os.environ, **{CORES_VAR: str(cpus)})
+    tstart = time.perf_counter()
+    with open(log, 'w') as f:
+        status = subprocess.run(command, cwd=HERE, env=env, stdout=f,
+                                stderr=subprocess.STDOUT).returncode
+    return status, time.perf_counter() - tstart
+
+
+def run(targets=None, force=(), cpus=None, dry=False, verb=1):
+    """Run the stale stages, in dependency order, within a CPU budget.
+
+    Parameters
+    ----------
+    targets, force :
+        See `plan`.
+
+    cpus : int or None
+        CPU budget; None for the available CPUs (see *resources.py*).
+        Stages are started as long as the sum of their `cpus` stays within
+        the budget; a stage with `cpus=None` takes the whole budget. Every
+        stage gets its `cpus` as core budget.
+
+    dry : bool
+        If True, only report which stages would run.
+
+    verb : int
+        Verbosity; > 0 prints start and end of every stage.
+
+    Returns
+    -------
+    record : dict
+        {stage: {'status': 'done', 'failed', 'skipped', 'blocked' or
+        'stale' (dry run), 'wall': wall time (s), 'returncode': exit
+        status}}.
+
+    """
+    cpus = budget() if cpus is None else cpus
+    deps, stale = plan(targets, force)
+    record = {s: {'status': 'skipped'} for s in deps if s not in stale}
+    if dry:
+        record.update({s: {'status': 'stale'} for s in stale})
+        if verb > 0:
+            for stage in (s for s in STAGES if s in deps):
+                print('   %-18s %s' % (stage, record[stage]['status']))
+        return record
+
+    def need(stage):
+        return min(STAGES[stage]['cpus'] or cpus, cpus)
+
+    # Input hashes of the skipped stages, and of the stages when they start
+    state = load_state()
+    hashes = {s: input_hash(s) for s in record}
+
+    pending, running, used = set(stale), {}, 0
+    with ThreadPoolExecutor(max(len(stale), 1)) as pool:
+        while pending or running:
+
+            # Stages with a failed dependency are not run
+            for stage in sorted(pending):
+                if any(record.get(d, {}).get('status') in
+                       ('failed', 'blocked') for d in deps[stage]):
+                    pending.discard(stage)
+                    record[stage] = {'status': 'blocked'}
+                    if verb > 0:
+                        print('   %-18s blocked' % stage)
+
+            # Start ready stages while they fit in the budget
+            for stage in sorted(pending):
+                ready = all(record.get(d, {}).get('status') in
+                            ('done', 'skipped') for d in deps[stage])
+                if ready and (not running or used + need(stage) <= cpus):
+                    pending.discard(stage)
+                    used += need(stage)
+                    hashes[stage] = input_hash(stage)
+                    future = pool.submit(_run_stage, stage, need(stage))
+                    running[future] = stage
+                    if verb > 0:
+                        print('   %-18s started (%d CPUs)' % (
+                              stage, need(stage)))
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                used -= need(stage)
+                status, wall = future.result()
+                record[stage] = {'status': 'failed' if status else 'done',
+                                 'wall': wall, 'returncode': status}
+                if verb > 0:
+                    print('   %-18s %s in %.1f s' % (
+                          stage, record[stage]['status'], wall))
+
+    # Store the input hashes of the successful stages
+    for stage, rec in record.items():
+        if rec['status'] in ('done', 'skipped'):
+            state[stage] = hashes[stage]
+        else:
+            state.pop(stage, None)
+    write_atomic(os.path.join(HERE, STATE),
+                 lambda f: f.write(json.dumps(state, indent=2).encode()))
+
+    return record
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('stages', nargs='*',
+                        help='stages to bring up to date (default: all)')
+    parser.add_argument('-c', '--cpus', type=int,
+                        help='CPU budget (default: available CPUs)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='run the given stages even if up to date')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only show which stages would run')
+    args = parser.parse_args(args)
+
+    targets = args.stages or None
+    force = (args.stages or list(STAGES)) if args.force else ()
+    tstart = time.perf_counter()
+    record = run(targets, force, args.cpus, args.dry_run)
+
+    if not args.dry_run:
+        out = {'cpus': args.cpus or budget(),
+               'wall': time.perf_counter() - tstart, 'stages': record}
+        write_atomic(os.path.join(HERE, 'data', 'pipeline.json'),
+                     lambda f: f.write(json.dumps(out, indent=2).encode()))
+
+    return int(any(r['status'] in ('failed', 'blocked')
+                   for r in record.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,22 +6,133 @@ This script was heavily inspired by:
     - ipynbtools.py from qutip https://github.com/qutip
     - watermark.py from https://github.com/rasbt/watermark
 
+`fingerprint` returns the same information, and the CPU (model, vector
+instruction sets, cores) and thread settings (numexpr, BLAS, environment),
+as a dict for JSON; benchmarks and cached results store it. Packages are only
+imported when their version is asked for, so importing this module is cheap.
+
+Usage:
+
+    python printinfo.py                          # Fingerprint as JSON
+
 """
 
+import os
 import sys
+import json
 import time
 import platform
-import numpy
-import scipy
-import numexpr
-import IPython
-import empymod
-import matplotlib
-from IPython.display import HTML
+import importlib
+import functools
+
+# Packages of which the versions are reported by default
+PACKAGES = ['empymod', 'numpy', 'scipy', 'numexpr', 'matplotlib', 'IPython']
+
+# Prefixes of the CPU flags of vector instruction sets
+SIMD_FLAGS = ('sse', 'ssse', 'avx', 'fma', 'f16c', 'neon', 'asimd', 'sve',
+              'amx')
+
+# Environment variables which set the number of threads
+THREAD_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+               'NUMEXPR_NUM_THREADS', 'NUMEXPR_MAX_THREADS']
+
+
+def _module(name):
+    """Import package `name`; None if it is not installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def versions(packages=PACKAGES):
+    """Versions of `packages` (None if not installed)."""
+    out = {}
+    for name in packages:
+        mod = _module(name)
+        out[name] = getattr(mod, '__version__', None)
+    return out
+
+
+@functools.lru_cache()
+def cpu():
+    """CPU model, vector instruction sets, and number of cores.
+
+    The model and flags are read from */proc/cpuinfo* (Linux); elsewhere the
+    model is `platform.processor()` and the flags are empty.
+    """
+    info = {'model': platform.processor() or platform.machine(),
+            'flags': [], 'logical': os.cpu_count(), 'physical': None,
+            'available': None}
+    if hasattr(os, 'sched_getaffinity'):
+        info['available'] = len(os.sched_getaffinity(0))
+    try:
+        with open('/proc/cpuinfo') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return info
+
+    cores = set()
+    phys = None
+    for line in lines:
+        key, _, value = (s.strip() for s in line.partition(':'))
+        if key == 'model name':
+            info['model'] = value
+        elif key in ('flags', 'Features') and not info['flags']:
+            info['flags'] = sorted(f for f in value.split()
+                                   if f.startswith(SIMD_FLAGS))
+        elif key == 'physical id':
+            phys = value
+        elif key == 'core id':
+            cores.add((phys, value))
+    info['physical'] = len(cores) or None
+    return info
+
+
+def threads(numexpr=True):
+    """Thread settings: environment, numexpr (if `numexpr`) and BLAS.
+
+    The BLAS libraries and their threads are only reported if `threadpoolctl`
+    is installed.
+    """
+    info = {'environment': {v: os.environ.get(v) for v in THREAD_VARS}}
+
+    if numexpr:
+        ne = _module('numexpr')
+        info['numexpr'] = None if ne is None else {
+            'nthreads': getattr(ne, 'nthreads', None),
+            'ncores': getattr(ne, 'ncores', None),
+            'detected': ne.detect_number_of_threads()
+            if hasattr(ne, 'detect_number_of_threads') else None,
+            'vml': ne.get_vml_version() if getattr(ne, 'use_vml', False)
+            else None}
+
+    tpc = _module('threadpoolctl')
+    info['blas'] = None if tpc is None else [
+            {k: lib.get(k) for k in ('internal_api', 'version', 'num_threads')}
+            for lib in tpc.threadpool_info() if lib.get('user_api') == 'blas']
+    return info
+
+
+def fingerprint(packages=PACKAGES):
+    """Date, Python, platform, CPU, threads, and versions of `packages`.
+
+    numexpr (for its threads and VML) is only imported if it is in
+    `packages`. The result consists of plain types, for JSON.
+    """
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S %Z'),
+            'python': sys.version, 'platform': platform.platform(),
+            'cpu': cpu(), 'threads': threads('numexpr' in packages),
+            'versions': versions(packages)}
 
 
 def info():
     """Print date and version information as a html-table."""
+    from IPython.display import HTML
+
+    fp = fingerprint()
+    ver = fp['versions']
+    ne = fp['threads']['numexpr'] or {}
 
     # Define styles
     style1 = " style='width: 20%; border: 2px solid #fff;'"
@@ -36,28 +147,40 @@ def info():
 
     # empymod, OS, threads, IPython
     html += "<tr" + style1 + ">"
-    html += "<td" + style2 + ">%s</td>" % empymod.__version__
+    html += "<td" + style2 + ">%s</td>" % ver['empymod']
     html += "<td" + style1 + ">empymod</td>"
     html += "<td" + style2 + ">%s</td>" % platform.system()
     html += "<td" + style1 + ">OS</td>"
-    html += "<td" + style2 + ">%s</td>" % numexpr.detect_number_of_threads()
+    html += "<td" + style2 + ">%s</td>" % ne.get('detected')
     html += "<td" + style1 + ">CPU(s)</td>"
-    html += "<td" + style2 + ">%s</td>" % IPython.__version__
+    html += "<td" + style2 + ">%s</td>" % ver['IPython']
     html += "<td" + style1 + ">IPython</td>"
     html += "</tr>"
 
     # numpy, scipy, numexpr, matplotlib
     html += "<tr" + style1 + ">"
-    html += "<td" + style2 + ">%s</td>" % numpy.__version__
+    html += "<td" + style2 + ">%s</td>" % ver['numpy']
     html += "<td" + style1 + ">numpy</td>"
-    html += "<td" + style2 + ">%s</td>" % scipy.__version__
+    html += "<td" + style2 + ">%s</td>" % ver['scipy']
     html += "<td" + style1 + ">scipy</td>"
-    html += "<td" + style2 + ">%s</td>" % numexpr.__version__
+    html += "<td" + style2 + ">%s</td>" % ver['numexpr']
     html += "<td" + style1 + ">numexpr</td>"
-    html += "<td" + style2 + ">%s</td>" % matplotlib.__version__
+    html += "<td" + style2 + ">%s</td>" % ver['matplotlib']
     html += "<td" + style1 + ">matplotlib</td>"
     html += "</tr>"
 
+    # Cores: logical, available to this process, physical; numexpr threads
+    html += "<tr" + style1 + ">"
+    html += "<td" + style2 + ">%s</td>" % fp['cpu']['logical']
+    html += "<td" + style1 + ">Logical CPU(s)</td>"
+    html += "<td" + style2 + ">%s</td>" % fp['cpu']['available']
+    html += "<td" + style1 + ">Available CPU(s)</td>"
+    html += "<td" + style2 + ">%s</td>" % fp['cpu']['physical']
+    html += "<td" + style1 + ">Physical cores</td>"
+    html += "<td" + style2 + ">%s</td>" % ne.get('nthreads')
+    html += "<td" + style1 + ">numexpr threads</td>"
+    html += "</tr>"
+
     # sys.version
     html += "<tr" + style1 + ">"
     html += "<td" + style1 + " colspan='8'>%s</td>" % sys.version
@@ -65,10 +188,14 @@ def info():
 
     # vml version
     html += "<tr" + style2 + ">"
-    html += "<td" + style2 + " colspan='8'>%s</td>" % numexpr.get_vml_version()
+    html += "<td" + style2 + " colspan='8'>%s</td>" % ne.get('vml')
     html += "</tr>"
 
     # Finish table
     html += "</table>"
 
     return HTML(html)
+
+
+if __name__ == '__main__':
+    print(json.dumps(fingerprint(), indent=2))
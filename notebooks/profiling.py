@@ -0,0 +1,250 @@
+"""
+Opt-in profiling of the stages of `empymod`.
+
+`printstartfinish` reports the run time of a whole `dipole` call. Within a
+`Profile` context the functions of `empymod` listed in `STAGES` are wrapped,
+and every call records its wall time and the size of its result:
+
+- check: checking the input parameters (`utils.check_*`);
+- model: `dipole`/`bipole` and `fem` themselves (geometry, loops);
+- kernel: the wavenumber-domain kernel (`kernel.wavenumber`, ...);
+- hankel: the Hankel transform (DLF/FHT, QWE, QUAD);
+- spline: setting up the spline interpolations;
+- fourier: the frequency-to-time transform (`model.tem`, ...).
+
+Stages are nested (the kernel is called by the Hankel transform, ...); the
+time of a stage is its own time, without the stages it calls. The names of
+both the `empymod` 1.x and 2.x functions are listed, missing ones are
+skipped. The wrappers are installed in every module which imported the
+functions by name, so calls through *gprcalc.py* are recorded as well.
+
+Worker processes forked within the context (*gridcalc.py*, *gprcalc.py*)
+record their calls too, and hand them over with `flush` after every chunk or
+block. On exit, the calls are written as Chrome trace (JSON, open it in
+chrome://tracing or https://ui.perfetto.dev), one row per process, together
+with the per-stage summary.
+
+Usage:
+
+    with Profile('data/profile/dipole.json') as prof:
+        dipole(...)
+    print(prof.summary())
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import tempfile
+import threading
+
+import numpy as np
+import empymod
+
+from resultcache import write_atomic
+
+# Stages: {stage: [(empymod module, function names or patterns), ...]}
+STAGES = {
+    'check': [('utils', ['check_*'])],
+    'model': [('model', ['dipole', 'bipole', 'fem'])],
+    'kernel': [('kernel', ['wavenumber', 'fullspace', 'halfspace'])],
+    'hankel': [('transform', ['fht', 'hqwe', 'hquad', 'hankel_dlf',
+                              'hankel_qwe', 'hankel_quad'])],
+    'spline': [('transform', ['iuSpline'])],
+    'fourier': [('model', ['tem']),
+                ('transform', ['ffht', 'fqwe', 'fftlog', 'fft', 'fourier_dlf',
+                               'fourier_qwe', 'fourier_fftlog',
+                               'fourier_fft'])],
+}
+
+# State of the active profile; inherited by forked workers
+_state = {'dir': None, 'events': []}
+_stack = threading.local()
+
+
+def _size(out):
+    """Number of elements of the (first) array in `out`."""
+    if isinstance(out, tuple):
+        out = next((o for o in out if isinstance(o, np.ndarray)), None)
+    return int(np.size(out)) if isinstance(out, np.ndarray) else 0
+
+
+def _wrap(func, stage):
+    """Wrap `func`, recording its calls as `stage`."""
+    def wrapper(*args, **kwargs):
+        if not hasattr(_stack, 'children'):
+            _stack.children = []
+        _stack.children.append(0.0)
+        tstart = time.perf_counter()
+        try:
+            out = func(*args, **kwargs)
+        finally:
+            dur = time.perf_counter() - tstart
+            children = _stack.children.pop()
+            if _stack.children:
+                _stack.children[-1] += dur
+        _state['events'].append(
+            (stage, func.__name__, tstart, dur, dur - children, _size(out),
+             os.getpid(), threading.get_ident()))
+        return out
+
+    wrapper.__wrapped__ = func
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _targets():
+    """{id(function): (function, stage)} of all `STAGES` which exist."""
+    targets = {}
+    for stage, entries in STAGES.items():
+        for module, patterns in entries:
+            mod = getattr(empymod, module)
+            for name in dir(mod):
+                func = getattr(mod, name)
+                if (any(fnmatch.fnmatchcase(name, p) for p in patterns) and
+                        callable(func) and id(func) not in targets):
+                    targets[id(func)] = (func, stage)
+    return targets
+
+
+def _install():
+    """Wrap the targets wherever they are imported; return the originals."""
+    targets = _targets()
+    wrappers = {}
+    patched = []
+    for mod in list(sys.modules.values()):
+        name = getattr(mod, '__name__', '')
+        if mod is None or name.split('.')[0] in ('numpy', 'scipy'):
+            continue
+        for key, value in list(vars(mod).items()):
+            if id(value) in targets and value is targets[id(value)][0]:
+                if id(value) not in wrappers:
+                    wrappers[id(value)] = _wrap(*targets[id(value)])
+                setattr(mod, key, wrappers[id(value)])
+                patched.append((mod, key, value))
+    return patched
+
+
+def flush():
+    """Hand the calls recorded in a forked worker over to the profile.
+
+    No-op if no profile is active, or in the process which started it.
+    """
+    if _state['dir'] is None or os.getpid() == _state['pid']:
+        return
+    events, _state['events'] = _state['events'], []
+    if events:
+        fname = os.path.join(_state['dir'], '%d.json' % os.getpid())
+        with open(fname, 'a') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+
+
+def _clear_child():
+    """Forked workers start without the calls of their parent."""
+    _state['events'] = []
+    _stack.children = []
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_clear_child)
+
+
+def summarize(events, wall=None):
+    """Per-stage summary of recorded calls.
+
+    Returns {stage: {'calls', 'time' (own time, s), 'inclusive' (s), 'size'
+    (max. size of the results)}}; with `wall` also 'total' (s) and 'other',
+    the wall time not spent in any stage. Calls in worker processes add to
+    the times, so 'other' is only meaningful for serial runs.
+    """
+    out = {}
+    for stage, _, _, dur, own, size, _, _ in events:
+        s = out.setdefault(stage, {'calls': 0, 'time': 0.0,
+                                   'inclusive': 0.0, 'size': 0})
+        s['calls'] += 1
+        s['time'] += own
+        s['inclusive'] += dur
+        s['size'] = max(s['size'], size)
+    if wall is not None:
+        out['total'] = wall
+        out['other'] = wall - sum(s['time'] for s in out.values()
+                                  if isinstance(s, dict))
+    return out
+
+
+class Profile:
+    """Context in which the stages of `empymod` are profiled.
+
+    Profiles can not be nested.
+
+    Parameters
+    ----------
+    trace : str or None
+        If given, the recorded calls and the summary are written as Chrome
+        trace to this JSON-file on exit.
+
+    enabled : bool
+        If False, the context does nothing; for opt-in profiling in scripts.
+
+    """
+
+    def __init__(self, trace=None, enabled=True):
+        self.trace = trace
+        self.enabled = enabled
+        self.events = []
+        self.wall = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        if _state['dir'] is not None:
+            raise RuntimeError('Profiles can not be nested')
+        _state['dir'] = tempfile.mkdtemp(prefix='profile')
+        _state['pid'] = os.getpid()
+        _state['events'] = []
+        self._patched = _install()
+        self._tstart = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.enabled:
+            return False
+        self.wall = time.perf_counter() - self._tstart
+        for mod, key, value in self._patched:
+            setattr(mod, key, value)
+
+        # Calls of this process and of the workers
+        self.events = _state['events']
+        for fname in sorted(os.listdir(_state['dir'])):
+            with open(os.path.join(_state['dir'], fname)) as f:
+                self.events += [tuple(json.loads(line)) for line in f]
+        shutil.rmtree(_state['dir'])
+        _state['dir'], _state['events'] = None, []
+
+        if self.trace is not None:
+            self.write(self.trace)
+        return False
+
+    def summary(self):
+        """Per-stage summary, see `summarize`."""
+        return summarize(self.events, self.wall)
+
+    def write(self, fname):
+        """Write the calls as Chrome trace, with the summary."""
+        t0 = self._tstart
+        trace = {'traceEvents': [
+                    {'name': name, 'cat': stage, 'ph': 'X',
+                     'ts': 1e6*(tstart - t0), 'dur': 1e6*dur, 'pid': pid,
+                     'tid': tid, 'args': {'own': 1e6*own, 'size': size}}
+                    for stage, name, tstart, dur, own, size, pid, tid
+                    in self.events],
+                 'displayTimeUnit': 'ms', 'summary': self.summary()}
+        directory = os.path.dirname(fname)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_atomic(fname, lambda f: f.write(json.dumps(trace).encode()))
@@ -0,0 +1,125 @@
+"""
+Analytical reference solutions for whole parameter sweeps.
+
+`empymod.analytical` takes one resistivity, anisotropy and component per
+call. `reference` broadcasts receiver coordinates, resistivity, anisotropy,
+frequency or time, and component against each other (NumPy broadcasting
+rules), and evaluates them with as few calls to `analytical` as possible: one
+per distinct model (resistivity, anisotropy, component) and chunk of
+values, for all its frequencies or times at once. The parameters
+are not broadcast to their full size: the receivers, frequencies or times
+and models of every chunk are taken from broadcast views, so the chunks limit
+the memory of the bookkeeping as well as of the calls; only the result has
+the full size.
+
+The closed-form impulse response of *time-domain.py* is here as well.
+
+"""
+
+import numpy as np
+from empymod import analytical
+
+
+def ee_xx_impulse(res, off, time):
+    """Electric halfspace impulse response to an electric source, xx, inline.
+
+    Wilson, A. J. S., 1997, equation 5.38.
+    The equivalent wavefield concept in multichannel transient electromagnetic
+    surveying.
+    Ph.D., University Of Edinburgh.
+    http://hdl.handle.net/1842/7101
+
+    res   : resistivity [Ohm.m]
+    off   : offset [m]
+    time  : time(s) [s]
+
+    All parameters broadcast against each other.
+    """
+    mu_0 = 4e-7*np.pi  # Permeability of free space  [H/m]
+    res, off, time = np.broadcast_arrays(res, off, time)
+    fact = np.sqrt(mu_0**3/(time**5*res*np.pi**3))/8
+    return fact*np.exp(-mu_0*off**2/(4*res*time))
+
+
+def reference(src, x, y, zrec, res, freqtime, ab=11, aniso=1,
+              solution='dhs', signal=None, chunksize=100000, **kwargs):
+    """Analytical solution, broadcast over all parameters.
+
+    Parameters
+    ----------
+    src : list
+        Source coordinates [x, y, z] (m) of a single dipole.
+
+    x, y : array_like
+        Receiver x- and y-coordinates (m).
+
+    zrec : float
+        Receiver depth (m).
+
+    res, freqtime, ab, aniso : array_like
+        Resistivity, frequency or time, component, and anisotropy, as in
+        `empymod.analytical`.
+
+    solution, signal : str, int or None
+        As in `empymod.analytical`.
+
+    chunksize : int
+        Number of values per chunk, and maximum number of values
+        (frequencies x receivers) per call to `analytical`.
+
+    **kwargs
+        Additional parameters passed to `analytical` (epermH, epermV, ...).
+
+    Returns
+    -------
+    resp : array
+        Complex response (real for time-domain), of the broadcast shape of
+        `x`, `y`, `res`, `freqtime`, `ab`, and `aniso`.
+
+    """
+    shape = np.broadcast(x, y, res, freqtime, ab, aniso).shape
+    vshape = shape or (1, )
+    size = int(np.prod(vshape))
+
+    # Distinct models, from the model parameters broadcast only against each
+    # other; the model index is a broadcast view of the full shape
+    mres, maniso, mab = np.broadcast_arrays(res, aniso, ab)
+    umod, imod = np.unique(np.c_[np.ravel(mres), np.ravel(maniso),
+                                 np.ravel(mab)], axis=0, return_inverse=True)
+    imod = np.reshape(imod, mres.shape)
+
+    # Broadcast views (no copies) of receivers, frequencies/times, models
+    views = [np.broadcast_to(a, vshape) for a in (x, y, freqtime, imod)]
+
+    out = np.zeros(size, dtype=complex if signal is None else float)
+    for start in range(0, size, chunksize):
+
+        # Receivers, frequencies/times and models of this chunk of values
+        idx = np.unravel_index(np.arange(start, min(start+chunksize, size)),
+                               vshape)
+        cx, cy, cft, cmod = (v[idx] for v in views)
+
+        for m in np.unique(cmod):
+            sel = np.flatnonzero(cmod == m)
+            mres, maniso, mab = umod[m]
+
+            # Distinct frequencies/times and receivers of this model
+            uft, ift = np.unique(cft[sel], return_inverse=True)
+            urec, irec = np.unique(np.c_[cx[sel], cy[sel]], axis=0,
+                                   return_inverse=True)
+            ift, irec = ift.ravel(), irec.ravel()
+
+            # All frequencies/times at once, for chunks of receivers
+            step = max(chunksize//uft.size, 1)
+            for i in range(0, len(urec), step):
+                rec = [urec[i:i+step, 0], urec[i:i+step, 1], zrec]
+                em = analytical(src, rec, mres, uft, solution=solution,
+                                signal=signal, ab=int(mab), aniso=maniso,
+                                verb=0, **kwargs)
+                em = np.reshape(em, (uft.size, -1))
+                if signal is not None:
+                    em = em.real
+                rows = (irec >= i) & (irec < i+step)
+                out[start + sel[rows]] = em[ift[rows], irec[rows]-i]
+
+    return out.reshape(shape)
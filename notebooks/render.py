@@ -0,0 +1,119 @@
+"""
+Parallel, headless rendering of the figures.
+
+The error maps are 50-level filled contours of 1051 x 1051 arrays, in six- or
+nine-panel figures. Here every figure is rendered in its own worker process
+(forked, with the non-interactive Agg backend), once all data is calculated.
+
+The figures are saved as JPEG, so the contours are rasterized at the savefig
+resolution anyway. Optionally `contourf` decimates the fields to the pixel
+resolution of the axes in the saved figure first, as finer detail is not
+visible, which makes contouring faster.
+
+"""
+
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from gridcalc import fork_context
+from resources import layout, limit_threads
+
+
+def axes_pixels(ax=None, dpi=None):
+    """Size (width, height) in pixels of the axes `ax` in the saved figure.
+
+    `dpi` defaults to the savefig dpi (or the figure dpi).
+    """
+    ax = plt.gca() if ax is None else ax
+    fig = ax.get_figure()
+    if dpi is None:
+        dpi = plt.rcParams['savefig.dpi']
+        if dpi == 'figure':
+            dpi = fig.dpi
+    pos = ax.get_position()
+    width, height = fig.get_size_inches()
+    return (max(int(pos.width*width*dpi), 1),
+            max(int(pos.height*height*dpi), 1))
+
+
+def decimate(fields, npix):
+    """Decimate 2D `fields` (list of arrays) to about `npix` = (nx, ny).
+
+    Every n-th row and column is taken, keeping at least `npix` points.
+    """
+    ny, nx = np.shape(fields[0])
+    sx = max(nx//npix[0], 1)
+    sy = max(ny//npix[1], 1)
+    return [np.asarray(f)[::sy, ::sx] for f in fields]
+
+
+def contourf(x, y, z, *args, decimated=False, **kwargs):
+    """`plt.contourf` on the current axes.
+
+    If `decimated`, `x`, `y`, `z` are first decimated to the pixel size of
+    the axes in the saved figure.
+    """
+    if decimated:
+        x, y, z = decimate([x, y, z], axes_pixels())
+    return plt.contourf(x, y, z, *args, **kwargs)
+
+
+# Figures to render, inherited by the forked workers
+_jobs = {}
+
+
+def _render(name):
+    """Render figure `name` in a worker; return its name and run time."""
+    plt.switch_backend('Agg')
+    tstart = time.perf_counter()
+    _jobs[name]()
+    plt.close('all')
+    return name, time.perf_counter() - tstart
+
+
+def render(jobs, nproc=None, verb=1):
+    """Render figures, every figure in its own worker process.
+
+    Parameters
+    ----------
+    jobs : dict
+        {name: function}; every function draws and saves one figure.
+
+    nproc : int or None
+        Number of worker processes; None for the number of CPUs. If it is 1,
+        or the platform does not support forking, the figures are rendered
+        serially in this process. The core budget is split between the
+        workers and their threads (see *resources.py*).
+
+    verb : int
+        Verbosity; > 0 prints the run time of every figure.
+
+    Returns
+    -------
+    times : dict
+        {name: run time (s)}.
+
+    """
+    _jobs.clear()
+    _jobs.update(jobs)
+    lay = layout(nproc, len(jobs))
+    nproc = lay['nproc']
+
+    times = {}
+
+    def gather(results):
+        for name, dt in results:
+            times[name] = dt
+            if verb > 0:
+                print('   %s rendered in %.1f s' % (name, dt))
+
+    ctx = fork_context()
+    if nproc < 2 or ctx is None:
+        gather(map(_render, jobs))
+    else:
+        with ctx.Pool(nproc, limit_threads, (lay['threads'], )) as pool:
+            gather(pool.imap_unordered(_render, jobs))
+
+    return times
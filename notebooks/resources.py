@@ -0,0 +1,136 @@
+"""
+Split of a core budget between worker processes and threads.
+
+*gridcalc.py* and *gprcalc.py* distribute chunks over worker processes. Each
+of them would by default start as many numexpr threads (`opt='parallel'`) and
+BLAS threads as there are cores, so `nproc` workers on `n` cores run up to
+`nproc*n` threads, which compete for the same cores.
+
+`layout` splits the core budget (`CORES`, by default the cores available to
+this process) into a number of processes and threads per process, and
+`limit_threads` applies the threads in a worker: numexpr through
+`numexpr.set_num_threads`, BLAS through `threadpoolctl` (if installed), and
+the environment variables for libraries loaded later. The layout is logged
+(logger `resources`, level INFO; the effective threads of every worker at
+level DEBUG).
+
+The core budget can also be set through the environment variable
+`RESOURCES_CORES`; *pipeline.py* gives every stage its share of the budget
+this way.
+
+The memory budget (`MEMORY`, by default half of the available memory) is
+split the same way; *gridcalc.py* derives the chunk size from it.
+
+"""
+
+import os
+import sys
+import logging
+
+from printinfo import cpu, threads
+
+log = logging.getLogger('resources')
+
+# Core budget of all processes together; None for all available cores (or
+# the environment variable CORES_VAR, if set)
+CORES_VAR = 'RESOURCES_CORES'
+CORES = int(os.environ[CORES_VAR]) if os.environ.get(CORES_VAR) else None
+
+# Memory budget (bytes) of all processes together; None for half of the
+# memory available when a calculation starts
+MEMORY = None
+
+# Environment variables set in the workers
+THREAD_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+               'NUMEXPR_NUM_THREADS']
+
+
+def budget():
+    """Core budget: `CORES` (or `RESOURCES_CORES`), or the available cores."""
+    if CORES is not None:
+        return CORES
+    return cpu()['available'] or os.cpu_count() or 1
+
+
+def memory():
+    """Memory budget (bytes): `MEMORY`, or half of the available memory.
+
+    The available memory is read from */proc/meminfo* (Linux), else from
+    `os.sysconf`; 4 GiB are assumed if both fail.
+    """
+    if MEMORY is not None:
+        return MEMORY
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024//2
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')//2
+    except (AttributeError, ValueError, OSError):
+        return 2*1024**3
+
+
+def layout(nproc=None, ntasks=None):
+    """Split the core budget into processes and threads per process.
+
+    Parameters
+    ----------
+    nproc : int or None
+        Requested number of processes; None for one per core. It is limited
+        to the budget and to `ntasks`.
+
+    ntasks : int or None
+        Number of tasks (chunks, blocks); there are not more processes than
+        tasks.
+
+    Returns
+    -------
+    layout : dict
+        'cores': budget; 'nproc': number of processes; 'threads': threads
+        per process, the budget divided by `nproc`.
+
+    """
+    cores = budget()
+    nproc = cores if nproc is None else nproc
+    if ntasks is not None:
+        nproc = min(nproc, ntasks)
+    nproc = max(min(nproc, cores), 1)
+    return {'cores': cores, 'nproc': nproc, 'threads': max(cores//nproc, 1)}
+
+
+def log_layout(name, lay):
+    """Log the layout `lay` of `name`."""
+    log.info('%s: %d cores = %d process(es) x %d thread(s)', name,
+             lay['cores'], lay['nproc'], lay['threads'])
+
+
+def limit_threads(nthreads):
+    """Limit the numexpr and BLAS threads of this process to `nthreads`.
+
+    numexpr is only limited if it is loaded (`empymod` loads it if it is
+    installed). Returns the effective thread settings (see
+    `printinfo.threads`).
+    """
+    for var in THREAD_VARS:
+        os.environ[var] = str(nthreads)
+
+    ne = sys.modules.get('numexpr')
+    if ne is not None:
+        ne.set_num_threads(nthreads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(nthreads)
+    except ImportError:
+        pass
+
+    info = threads(numexpr=ne is not None)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('pid %d: numexpr %s, BLAS %s', os.getpid(),
+                  (info.get('numexpr') or {}).get('nthreads'),
+                  [b['num_threads'] for b in info['blas']]
+                  if info['blas'] is not None else 'not limited')
+    return info
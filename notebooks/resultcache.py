@@ -0,0 +1,316 @@
+"""
+Content-addressed cache for time-intensive results.
+
+Results are stored under a key which is the hash of the full description of
+the calculation (model, receivers, transform arguments, ...) and of the
+`empymod` version. A changed input hence results in a new key, and a stale
+result is never served.
+
+Every entry consists of one `npy`-file per array and a `json`-manifest with
+the description of the entry and the environment it was calculated in (see
+`printinfo.fingerprint`); the entry only exists once its manifest is
+written. Arrays are loaded memory-mapped, and big results can be streamed
+directly into their cache files. If the cache grows beyond its maximum size,
+the least recently used entries are removed.
+
+While an entry is calculated, a marker file with the process id marks its
+files as in progress. Files without manifest and without marker of a running
+process (left behind by interrupted calculations) are removed when entries
+are evicted.
+
+"""
+
+import os
+import json
+import time
+import types
+import hashlib
+
+import numpy as np
+import empymod
+
+from printinfo import fingerprint
+
+
+def _update(h, obj, seen=()):
+    """Update hash `h` with a canonical representation of `obj`.
+
+    NumPy scalars are hashed as the corresponding Python scalars. Functions
+    are hashed by name, byte code, constants, referenced names, defaults,
+    and the values of their closure, so two lambdas (or closures of the same
+    name) only get the same hash if they compute the same; `seen` guards
+    against recursive functions and objects.
+    """
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+
+    if isinstance(obj, dict):
+        h.update(b'dict')
+        for k in sorted(obj, key=str):
+            _update(h, str(k), seen)
+            _update(h, obj[k], seen)
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'list%d' % len(obj))
+        for v in obj:
+            _update(h, v, seen)
+    elif isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        h.update(('array%s%s' % (arr.dtype.str, arr.shape)).encode())
+        h.update(arr.tobytes())
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        h.update((type(obj).__name__ + repr(obj)).encode())
+    elif isinstance(obj, types.CodeType):
+        h.update(b'code' + obj.co_code)
+        _update(h, obj.co_consts, seen)
+        _update(h, obj.co_names, seen)
+    elif isinstance(obj, types.FunctionType):
+        h.update(('function' + obj.__module__ + obj.__qualname__).encode())
+        if id(obj) in seen:
+            return
+        seen = seen + (id(obj), )
+        _update(h, obj.__code__, seen)
+        _update(h, obj.__defaults__, seen)
+        _update(h, obj.__kwdefaults__, seen)
+        for cell in obj.__closure__ or ():
+            try:
+                value = cell.cell_contents
+            except ValueError:  # Empty cell
+                h.update(b'empty')
+                continue
+            _update(h, value, seen)
+    elif isinstance(obj, types.ModuleType):
+        h.update(('module' + obj.__name__).encode())
+    elif callable(obj) and hasattr(obj, '__qualname__'):  # Built-ins, ufuncs
+        h.update(('callable%s%s' % (getattr(obj, '__module__', ''),
+                                    obj.__qualname__)).encode())
+    elif hasattr(obj, '__dict__'):  # E.g., empymod.filters.DigitalFilter
+        h.update(type(obj).__name__.encode())
+        if id(obj) not in seen:
+            _update(h, vars(obj), seen + (id(obj), ))
+    else:
+        h.update(repr(obj).encode())
+
+
+def _alive(pid):
+    """True if process `pid` is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_atomic(filename, write):
+    """Write a file through a temporary file, so it is complete or absent."""
+    tmp = filename + '.tmp%d' % os.getpid()
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, filename)
+
+
+def call_hash(call, version=None):
+    """Return the sha256-hash of `call` and `version` (default: empymod's)."""
+    if version is None:
+        version = empymod.__version__
+    h = hashlib.sha256()
+    _update(h, {'version': version, 'call': call})
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Cache of results, keyed on the hash of the calculation.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory; created if it does not exist.
+
+    maxsize : int
+        Maximum size of the cache in bytes.
+
+    version : str or None
+        Version which is part of every key; defaults to the `empymod`
+        version.
+
+    """
+
+    def __init__(self, directory='data/cache', maxsize=2*1024**3,
+                 version=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        if version is None:
+            version = empymod.__version__
+        self.version = version
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, call):
+        """Return the key of `call`, a description of the calculation."""
+        return call_hash(call, self.version)
+
+    def filename(self, key, name):
+        """Return the file name of array `name` of entry `key`."""
+        return os.path.join(self.directory, key + '-' + name + '.npy')
+
+    def _manifest(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _marker(self, key):
+        return os.path.join(self.directory, key + '.pending')
+
+    def manifests(self):
+        """Return the manifests of all entries."""
+        out = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, fname)) as f:
+                        out.append(json.load(f))
+                except (OSError, ValueError):
+                    pass
+        return out
+
+    def load(self, key, mmap_mode='r'):
+        """Return the arrays of `key` as dict, or None if not cached.
+
+        The arrays are memory-mapped with `mmap_mode`, hence only the parts
+        which are used are read from disk.
+        """
+        fmanifest = self._manifest(key)
+        try:
+            with open(fmanifest) as f:
+                manifest = json.load(f)
+            out = {k: np.load(self.filename(key, k), mmap_mode=mmap_mode)
+                   for k in manifest['arrays']}
+        except (OSError, ValueError):
+            return None
+
+        # Record the access, for the LRU-eviction
+        manifest['accessed'] = time.time()
+        write_atomic(fmanifest, lambda f: f.write(
+            json.dumps(manifest, indent=2).encode()))
+        return out
+
+    def save(self, key, arrays, name=''):
+        """Store the dict `arrays` under `key`, and evict old entries.
+
+        Arrays which are memory-mapped from their cache file already (see
+        `filename`) are only flushed, not written again.
+        """
+        size = 0
+        for k, v in arrays.items():
+            fname = self.filename(key, k)
+            if isinstance(v, np.memmap) and v.filename == os.path.abspath(
+                    fname):
+                v.flush()
+            else:
+                write_atomic(fname, lambda f: np.save(f, v))
+            size += os.path.getsize(fname)
+        now = time.time()
+        manifest = {
+            'key': key,
+            'name': name,
+            'version': self.version,
+            'created': now,
+            'accessed': now,
+            'size': size,
+            'environment': fingerprint(['empymod', 'numpy', 'scipy',
+                                        'numexpr']),
+            'arrays': {k: {'shape': np.shape(v),
+                           'dtype': np.asarray(v).dtype.str}
+                       for k, v in arrays.items()},
+        }
+        write_atomic(self._manifest(key), lambda f: f.write(
+            json.dumps(manifest, indent=2).encode()))
+        self.evict(keep=key)
+
+    def sweep(self, manifests=None):
+        """Remove files which belong to no entry and no running calculation.
+
+        These are arrays and temporary files of interrupted calculations,
+        and markers of processes which do not run anymore.
+        """
+        if manifests is None:
+            manifests = self.manifests()
+        keys = {m['key'] for m in manifests}
+
+        # Keys which are calculated by a running process
+        running = set()
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.pending'):
+                try:
+                    with open(os.path.join(self.directory, fname)) as f:
+                        pid = int(f.read())
+                except (OSError, ValueError):
+                    continue
+                if _alive(pid):
+                    running.add(fname[:-8])
+
+        for fname in os.listdir(self.directory):
+            key, _, tmp = fname.partition('.tmp')
+            key = key.split('-')[0].split('.')[0]
+            if key in running:
+                continue
+            if tmp:  # Written by process `tmp`
+                if tmp.isdigit() and _alive(int(tmp)):
+                    continue
+            elif key in keys and not fname.endswith('.pending'):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, fname))
+            except OSError:
+                pass
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits maxsize.
+
+        Files of interrupted calculations are removed as well (`sweep`).
+        """
+        manifests = self.manifests()
+        self.sweep(manifests)
+        manifests = sorted(manifests, key=lambda m: m['accessed'])
+        size = sum(m['size'] for m in manifests)
+        for m in manifests:
+            if size <= self.maxsize:
+                break
+            if m['key'] == keep:
+                continue
+            os.remove(self._manifest(m['key']))
+            for k in m['arrays']:
+                fname = self.filename(m['key'], k)
+                if os.path.isfile(fname):
+                    os.remove(fname)
+            size -= m['size']
+
+    def fetch(self, call, calc, name=''):
+        """Return the cached result of `call`, or calculate and store it.
+
+        Parameters
+        ----------
+        call : dict
+            Full description of the calculation, from which the key is
+            created: model, receivers, transform arguments, ...
+
+        calc : callable
+            Function which carries out the calculation and returns a dict of
+            arrays. It is called with one argument, a function which returns
+            for an array name its file name in the cache; big arrays can be
+            streamed directly into these files (memory-mapped `.npy`).
+
+        name : str
+            Human readable name, stored in the manifest.
+
+        """
+        key = self.key(call)
+        out = self.load(key)
+        if out is None:
+            marker = self._marker(key)
+            write_atomic(marker, lambda f: f.write(b'%d' % os.getpid()))
+            try:
+                out = calc(lambda array: self.filename(key, array))
+                self.save(key, out, name)
+            finally:
+                os.remove(marker)
+            out = self.load(key)
+        return out
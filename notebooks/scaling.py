@@ -0,0 +1,206 @@
+"""
+Scaling study of `empymod`: run time as a function of problem size.
+
+*runtimes.ipynb* and *benchmark.py* measure two layer counts, five offset
+counts and a single frequency. Here the number of layers, offsets,
+frequencies, and the length of the Hankel filter are swept on log grids, one
+at a time around the base case `BASE`, for each Hankel transform/optimisation
+combination in `COMBOS`.
+
+From the timings two empirical cost models are fitted per combination:
+
+- a power law, time = c * layers^a * offsets^b * freqs^c * filter^d;
+- a linear model, time = t0 + k * layers * offsets * freqs * filter.
+
+For every swept dimension the local exponent (slope in log-log) shows where
+the run time starts to scale linearly (below, the fixed overhead dominates)
+and where it becomes super-linear. The results are stored as JSON, and
+plotted if an image file is given.
+
+Usage:
+
+    python scaling.py -o scaling.json -p scaling.png
+    python scaling.py -k spline -r 3
+
+"""
+
+import sys
+import json
+import argparse
+
+import numpy as np
+from empymod import dipole
+
+from benchmark import timeit, environment
+
+
+# Base case, and the values of the dimensions which are swept
+BASE = {'layers': 5, 'noff': 21, 'nfreq': 1, 'filter': 201}
+SWEEPS = {
+    'layers': [2, 4, 8, 16, 32, 64, 128],
+    'noff': [1, 4, 16, 64, 256, 1024],
+    'nfreq': [1, 4, 16, 64, 256],
+    'filter': [51, 101, 201, 401, 801],
+}
+
+# Hankel filters by length
+FILTERS = {51: 'key_51_2012', 101: 'key_101_2009', 201: 'key_201_2009',
+           401: 'key_401_2009', 801: 'anderson_801_1982'}
+
+# Hankel transform and optimisation combinations; the filter length is only
+# swept for the FHT
+COMBOS = [
+    {'name': 'FHT', 'ht': 'FHT', 'opt': None},
+    {'name': 'FHT spline', 'ht': 'FHT', 'opt': 'spline'},
+    {'name': 'FHT parallel', 'ht': 'FHT', 'opt': 'parallel'},
+    {'name': 'QWE', 'ht': 'QWE', 'opt': None},
+]
+
+# Range of the local exponent regarded as linear scaling
+LINEAR = (0.8, 1.2)
+
+
+def inputs(combo, layers, noff, nfreq, filter):
+    """Input parameters for `dipole` of one point of the sweep."""
+    depth = np.r_[0, np.linspace(1000, 12100, layers-2)]
+    res = np.r_[1e12, np.resize([0.3, 1, 100, 1], layers-1)]
+    htarg = FILTERS[filter] if combo['ht'] == 'FHT' else None
+    return {'src': [0, 0, 990],
+            'rec': [np.linspace(500, 20000, noff), np.zeros(noff), 1000],
+            'depth': depth, 'res': res,
+            'freqtime': np.logspace(-1, 1, nfreq), 'ab': 11,
+            'xdirect': False, 'ht': combo['ht'], 'htarg': htarg,
+            'opt': combo['opt'], 'verb': 0}
+
+
+def sweep(combo, repeat=3, warmup=1, verb=1):
+    """Time all points of all sweeps of `combo`; return list of dicts."""
+    results = []
+    for dim, values in SWEEPS.items():
+        if dim == 'filter' and combo['ht'] != 'FHT':
+            continue
+        for value in values:
+            point = dict(BASE, **{dim: value})
+            inp = inputs(combo, **point)
+            times = timeit(lambda: dipole(**inp), repeat, warmup)
+            results.append(dict(point, sweep=dim, best=min(times)))
+            if verb > 0:
+                print('%10.1f ms :: %s :: %s = %d' % (
+                      1000*min(times), combo['name'], dim, value))
+    return results
+
+
+def _work(r, ht):
+    """Size of the problem: layers x offsets x frequencies (x filter)."""
+    work = r['layers']*r['noff']*r['nfreq']
+    return work*r['filter'] if ht == 'FHT' else work
+
+
+def fit(results, ht):
+    """Fit the power-law and the linear cost model to `results`."""
+    dims = [d for d in SWEEPS if ht == 'FHT' or d != 'filter']
+    times = np.array([r['best'] for r in results])
+
+    # Power law: log(t) = log(c) + sum(exponent*log(dim))
+    A = np.array([[1] + [np.log(r[d]) for d in dims] for r in results])
+    coef = np.linalg.lstsq(A, np.log(times), rcond=None)[0]
+    power = {'c': float(np.exp(coef[0]))}
+    power.update({d: float(e) for d, e in zip(dims, coef[1:])})
+
+    # Linear: t = t0 + k*work
+    work = np.array([_work(r, ht) for r in results], dtype=float)
+    A = np.c_[np.ones(work.size), work]
+    t0, k = np.linalg.lstsq(A, times, rcond=None)[0]
+
+    return {'power': power, 'linear': {'t0': float(t0), 'k': float(k)}}
+
+
+def breakpoints(results):
+    """Where each sweep starts to scale linearly, and super-linearly.
+
+    Returns per swept dimension the local exponents, the first value from
+    which the local exponent is in the `LINEAR` range, and the first value
+    from which it is above.
+    """
+    out = {}
+    for dim in SWEEPS:
+        pts = sorted((r[dim], r['best']) for r in results if r['sweep'] == dim)
+        if len(pts) < 2:
+            continue
+        x, t = np.log(np.array(pts)).T
+        slope = np.diff(t)/np.diff(x)
+        values = [p[0] for p in pts[1:]]
+        linear = [v for v, s in zip(values, slope)
+                  if LINEAR[0] <= s <= LINEAR[1]]
+        superlinear = [v for v, s in zip(values, slope) if s > LINEAR[1]]
+        out[dim] = {'values': values, 'exponents': slope.tolist(),
+                    'linear_from': linear[0] if linear else None,
+                    'superlinear_from': superlinear[0] if superlinear
+                    else None}
+    return out
+
+
+def plot(study, filename):
+    """Plot the sweeps of all combinations, with the linear cost model."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axs = plt.subplots(1, len(SWEEPS), figsize=(3*len(SWEEPS), 3),
+                            sharey=True)
+    for ax, dim in zip(axs, SWEEPS):
+        for i, combo in enumerate(study):
+            pts = sorted((r[dim], r['best'], _work(r, combo['ht']))
+                         for r in combo['results'] if r['sweep'] == dim)
+            if not pts:
+                continue
+            x, t, work = np.array(pts).T
+            lin = combo['fit']['linear']
+            ax.loglog(x, t*1000, 'C%d.-' % i, label=combo['name'])
+            ax.loglog(x, (lin['t0'] + lin['k']*work)*1000, 'C%d:' % i)
+            bp = combo['breakpoints'][dim]['superlinear_from']
+            if bp is not None:
+                ax.loglog(bp, t[list(x).index(bp)]*1000, 'C%dx' % i, ms=8)
+        ax.set_xlabel(dim)
+    axs[0].set_ylabel('Time (ms)')
+    axs[0].legend(fontsize=7)
+    fig.suptitle('Measured (solid), linear cost model (dotted), '
+                 'super-linear from (x)', fontsize=8)
+    fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-o', '--output', help='JSON output file')
+    parser.add_argument('-p', '--plot', help='image file of the plot')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timed repeats')
+    parser.add_argument('-k', '--keyword', default='',
+                        help='only run combinations containing this keyword')
+    args = parser.parse_args(args)
+
+    study = []
+    for combo in COMBOS:
+        if args.keyword not in combo['name']:
+            continue
+        results = sweep(combo, args.repeat)
+        study.append(dict(combo, results=results,
+                          fit=fit(results, combo['ht']),
+                          breakpoints=breakpoints(results)))
+        p = study[-1]['fit']['power']
+        print('%s :: time ~ %s' % (combo['name'], ' * '.join(
+              '%s^%.2f' % (d, p[d]) for d in SWEEPS if d in p)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'base': BASE,
+                       'study': study}, f, indent=2)
+    if args.plot:
+        plot(study, args.plot)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
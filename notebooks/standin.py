@@ -0,0 +1,96 @@
+"""
+Stand-ins of the external codes `DIPOLE1D` and `EMmod`, using `empymod`.
+
+They read the same input files, and write their text output in the same
+format as the real codes, so *extsolver.py* and *analytical.py* can be run on
+machines without the real binaries.
+
+The binary output of `emmod` (`writebin=1`) is NOT in the format of the real
+code: the stand-in writes the nx*ny complex values of its grid, without any
+header, while *gpr-create-data.py* reads the real files with the values of
+its receivers starting at complex value `x.size` (a layout which could not
+be verified without the real code). The stand-in can hence not replace
+`EMmod` for the GPR data. The executables *./bin/DIPOLE1D* and
+*./bin/emmod* call `dipole1d` and `emmod` of this module.
+
+The results are calculated with `empymod` (FHT), not with the methods of the
+real codes; the run times are hence not the run times of the real codes.
+The argument `--noop` makes both return after start-up, which is used to
+measure the spawn overhead.
+
+"""
+
+import numpy as np
+from scipy.constants import mu_0
+from empymod import dipole
+
+from gridcalc import grid_dipole
+from emmodio import parse_args
+from extsolver import read_runfile, write_csem
+
+# DIPOLE1D filters and the corresponding `empymod` filters
+FILTERS = {'kk_ht_101': 'key_101_2009', 'kk_ht_201': 'key_201_2009',
+           'kk_ht_401': 'key_401_2009'}
+
+
+def dipole1d(args):
+    """`DIPOLE1D RUNFILE`: x-directed electric source, E and B fields."""
+    if args == ['--noop']:
+        return 0
+
+    inp = read_runfile(args[0])
+    kwargs = {'ht': 'FHT', 'htarg': FILTERS[inp['filt']], 'xdirect': False,
+              'opt': 'spline' if inp['spline'] else None, 'verb': 0}
+    fields = np.empty((inp['freq'].size, inp['rec'][0].size, 6),
+                      dtype=complex)
+    rec = [inp['rec'][0], inp['rec'][1], inp['rec'][2][0]]
+    for i, ab in enumerate([11, 21, 31, 41, 51, 61]):
+        out = dipole(inp['src'], rec, inp['depth'], inp['res'], inp['freq'],
+                     ab=ab, **kwargs)
+        fields[..., i] = np.reshape(out, fields.shape[:2])
+    fields[..., 3:] *= mu_0  # H to B
+
+    write_csem(inp['output'], inp['src'], rec, inp['freq'], fields)
+    return 0
+
+
+def emmod(args):
+    """`emmod key=value ...`: regular nx x ny grid, centred on the source.
+
+    The grid is x = (arange(nx) - nx//2)*dx (and the same for y), x varying
+    fastest. With `writebin=1`, the values are written as raw complex
+    numbers, in this order; see the module docstring for how this differs
+    from the real code.
+    """
+    if args == ['--noop']:
+        return 0
+
+    a = parse_args(args)
+    nx, ny = int(a['nx']), int(a['ny'])
+    x = (np.arange(nx) - nx//2)*a['dx']
+    y = (np.arange(ny) - ny//2)*a['dy']
+    rx, ry = np.meshgrid(x, y)
+
+    # Conductivities to resistivities and anisotropy; air for zero
+    condH = np.atleast_1d(a['econdH'])
+    condV = np.atleast_1d(a['econdV'])
+    res = 1/np.where(condH > 0, condH, 1/2e14)
+    resV = 1/np.where(condV > 0, condV, 1/2e14)
+
+    params = {'src': [0, 0, a['zsrc']], 'rec': [None, None, a['zrcv']],
+              'depth': np.atleast_1d(a['z'])[1:], 'res': res,
+              'freqtime': a['freq'], 'ab': int(a['component']),
+              'aniso': np.sqrt(resV/res), 'epermH': a['epermH'],
+              'epermV': a['epermV'], 'mpermH': a['mpermH'],
+              'mpermV': a['mpermV'],
+              'xdirect': bool(int(a.get('xdirect', 0))), 'verb': 0}
+    resp = grid_dipole(params, rx, ry, nproc=1)
+
+    if int(a.get('writebin', 0)):
+        np.ravel(resp).astype(complex).tofile(a['file_out'])
+    else:
+        data = np.c_[rx.ravel(), ry.ravel(), np.ones(rx.size)*a['zrcv'],
+                     np.ravel(resp).real, np.ravel(resp).imag]
+        np.savetxt(a['file_out'], data, fmt='%15.6f %15.6f %15.6f %22.14e '
+                   '%22.14e', header='x y z real imag', comments='')
+    return 0
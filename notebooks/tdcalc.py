@@ -0,0 +1,188 @@
+"""
+Time-domain responses of several transforms and signals from one spectrum.
+
+`dipole` calculates the frequency-domain response for the frequencies
+required by one frequency-to-time transform, and transforms it for one
+signal. Comparing transforms, as in *time-domain.py*, or signals (impulse,
+switch-on, switch-off) therefore recalculates the frequency-domain response
+of the same model for every combination.
+
+Here the frequencies of all requested transforms are collected first, and
+the frequency-domain response is calculated once for their union (or on a
+log-spaced grid covering them, from which it is interpolated). Every
+transform and signal is then applied to this one spectrum with
+`empymod.model.tem`. The spectrum can be stored in a `ResultCache`.
+
+The interpolation (amplitude and unwrapped phase, in log-frequency) is only
+accurate where the spectrum is smooth in log-frequency. It is not, for
+instance, where the air wave oscillates (source and receivers at the
+surface, frequencies above some kHz); the interpolated spectrum is therefore
+checked against directly calculated frequencies, with a warning if it is off.
+
+"""
+
+import warnings
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+from empymod import dipole
+from empymod.model import tem
+from empymod.utils import check_time
+
+
+def td_plan(time, transforms, signals=(0, )):
+    """Frequencies and transform arguments of all transforms and signals.
+
+    Parameters
+    ----------
+    time : array
+        Times (s).
+
+    transforms : dict
+        {name: (ft, ftarg)}, as in `dipole`.
+
+    signals : list of int
+        Signals: 0 impulse, 1 switch-on, -1 switch-off.
+
+    Returns
+    -------
+    plan : dict
+        {(name, signal): (time, freq, ft, ftarg)}, as returned by
+        `check_time`.
+
+    """
+    plan = {}
+    for name, (ft, ftarg) in transforms.items():
+        for signal in signals:
+            plan[name, signal] = check_time(time, signal, ft, ftarg, 0)
+    return plan
+
+
+def _spectrum(params, freq, kwargs):
+    """Frequency-domain response at `freq`, shape (nfreq, nrec)."""
+    fEM = dipole(freqtime=freq, signal=None, **params, **kwargs)
+    return np.reshape(fEM, (freq.size, -1))
+
+
+def _interpolator(freq, fEM):
+    """Cubic spline of amplitude and unwrapped phase, in log-frequency."""
+    tiny = np.finfo(float).tiny
+    lamp = CubicSpline(np.log(freq), np.log(np.maximum(np.abs(fEM), tiny)),
+                       axis=0)
+    pha = CubicSpline(np.log(freq), np.unwrap(np.angle(fEM), axis=0), axis=0)
+    return lambda f: np.exp(lamp(np.log(f)) + 1j*pha(np.log(f)))
+
+
+def td_dipole(params, time, transforms, signals=(0, ), pts_per_dec=None,
+              rtol=1e-3, nsample=20, cache=None, verb=1, **kwargs):
+    """Time-domain responses of several transforms and signals.
+
+    Parameters
+    ----------
+    params : dict
+        Input parameters for `dipole`, without `freqtime`, `signal`, `ft`,
+        and `ftarg`. The source has to be a single dipole.
+
+    time, transforms, signals :
+        See `td_plan`.
+
+    pts_per_dec : int or None
+        If None, the frequency-domain response is calculated at the union of
+        all required frequencies. Otherwise it is calculated on a log-spaced
+        grid with `pts_per_dec` frequencies per decade, covering all required
+        frequencies, and interpolated with a cubic spline (amplitude and
+        unwrapped phase, in log-frequency).
+
+    rtol : float
+        Tolerated interpolation error, relative to the max. amplitude of the
+        spectrum. Only used with `pts_per_dec`: the spectrum is calculated
+        directly at `nsample` frequencies (centres of grid intervals, spread
+        over the whole range), and a warning is issued if the interpolation
+        is off by more than `rtol` at any of them. Increase `pts_per_dec`,
+        or use the exact union (None), in that case.
+
+    nsample : int
+        Number of frequencies to check the interpolation; 0 to skip it.
+
+    cache : ResultCache or None
+        If given, the frequency-domain response is stored in and loaded
+        from it.
+
+    verb : int
+        Verbosity; > 0 prints the number of calculated frequencies.
+
+    **kwargs
+        Additional parameters passed to `dipole` (ht, htarg, opt, ...).
+
+    Returns
+    -------
+    out : dict
+        {(name, signal): time-domain response}, squeezed as from `dipole`.
+
+    """
+    plan = td_plan(time, transforms, signals)
+
+    # Frequencies to calculate
+    required = np.unique(np.concatenate([p[1] for p in plan.values()]))
+    if pts_per_dec is None:
+        freq = required
+        check = np.array([])
+    else:
+        lmin, lmax = np.log10(required[0]), np.log10(required[-1])
+        nfreq = max(int(np.ceil((lmax - lmin)*pts_per_dec)) + 1, 4)
+        freq = np.logspace(lmin, lmax, nfreq)
+
+        # Centres of evenly spread grid intervals, to check the interpolation
+        mid = np.sqrt(freq[:-1]*freq[1:])
+        check = mid[np.unique(np.linspace(
+                0, mid.size-1, min(nsample, mid.size)).astype(int))]
+    if verb > 0:
+        print('   Frequencies calculated: %d (required: %d, of all transforms'
+              ': %d)' % (freq.size, required.size,
+                         sum(p[1].size for p in plan.values())))
+
+    # Calculate the spectrum once (and at the check frequencies), or load it
+    # from the cache
+    def calc(filename=None):
+        fEM = _spectrum(params, np.r_[freq, check], kwargs)
+        return {'fEM': fEM[:freq.size], 'check': fEM[freq.size:]}
+
+    if cache is None:
+        spectrum = calc()
+    else:
+        call = {'params': params, 'freq': freq, 'check': check,
+                'kwargs': kwargs}
+        spectrum = cache.fetch(call, calc, 'spectrum')
+    fEM = spectrum['fEM']
+
+    # Interpolate, and check the interpolation
+    if pts_per_dec is not None:
+        spline = _interpolator(freq, fEM)
+        if check.size:
+            error = np.abs(spline(check) - spectrum['check']).max()
+            error /= max(np.abs(fEM).max(), np.finfo(float).tiny)
+            if verb > 0:
+                print('   Max. rel. interpolation error at %d frequencies: '
+                      '%.1e' % (check.size, error))
+            if error > rtol:
+                warnings.warn(
+                    'Interpolated spectrum is off by %.1e (relative to its '
+                    'max. amplitude) > rtol = %.1e; increase pts_per_dec, or '
+                    'use pts_per_dec=None.' % (error, rtol))
+
+    # Offsets
+    src, rec = params['src'], params['rec']
+    off = np.sqrt((np.atleast_1d(rec[0]) - src[0])**2 +
+                  (np.atleast_1d(rec[1]) - src[1])**2)
+
+    # Apply every transform and signal
+    out = {}
+    for (name, signal), (ptime, pfreq, ft, ftarg) in plan.items():
+        if pts_per_dec is None:
+            pfEM = fEM[np.searchsorted(freq, pfreq)]
+        else:
+            pfEM = spline(pfreq)
+        tEM, _ = tem(pfEM, off, pfreq, ptime, signal, ft, ftarg)
+        out[name, signal] = np.squeeze(tEM)
+
+    return out
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from emmodio import read_out
+
+
+def write_out(fname, nx, ny, dx, dy, xfast=True):
+    """Write a fake `EMmod` text output of a grid centred on the origin."""
+    x = (np.arange(nx) - nx//2)*dx
+    y = (np.arange(ny) - ny//2)*dy
+    if xfast:
+        gy, gx = np.meshgrid(y, x, indexing='ij')
+    else:
+        gx, gy = np.meshgrid(x, y, indexing='ij')
+    gx, gy = gx.ravel(), gy.ravel()
+    re, im = gx + 0.1*gy, gx*gy
+    with open(fname, 'w') as f:
+        f.write('header\n')
+        for row in zip(gx, gy, np.full(gx.size, 200.), re, im):
+            f.write('%.6f %.6f %.6f %.9e %.9e\n' % row)
+    return x, y
+
+
+@pytest.mark.parametrize('xfast', [True, False])
+def test_read_out(tmp_path, xfast):
+    ffile = str(tmp_path/'out.out')
+    x, y = write_out(ffile, 40, 30, 10., 20., xfast)
+
+    # Receivers: a sub-grid (y-rows, x-columns), as in *analytical.py*
+    rx = np.repeat([x[10:31]], 11, axis=0)
+    ry = np.repeat([y[5:16]], 21, axis=0).T
+    data = read_out(ffile, rx, ry, 10., 20., 40, 30)
+
+    # The original matching: np.in1d (np.isin) of the rounded coordinates,
+    # which returns the receivers in the order of the file
+    temp = np.loadtxt(ffile, skiprows=1, unpack=True)
+    tct = np.round(temp[0], 3) + 1j*np.round(temp[1], 3)
+    tcr = np.round(rx.ravel(), 3) + 1j*np.round(ry.ravel(), 3)
+    itr = np.isin(tct, tcr)
+    ref = temp[3][itr] + 1j*temp[4][itr]
+    if not xfast:
+        ref = ref.reshape(rx.shape[::-1]).T
+    np.testing.assert_array_equal(data, ref.reshape(rx.shape))
+
+
+def test_read_out_outside(tmp_path):
+    ffile = str(tmp_path/'out.out')
+    x, y = write_out(ffile, 10, 10, 10., 10.)
+    with pytest.raises(ValueError):
+        read_out(ffile, x + 100, y, 10., 10., 10, 10)
+    with pytest.raises(ValueError):
+        read_out(ffile, x + 3, y, 10., 10., 10, 10)
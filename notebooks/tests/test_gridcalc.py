@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from empymod import dipole
+
+import resources
+from gridcalc import grid_dipole, grid_symmetry, parity
+
+
+def model(ab=11):
+    """Small version of the model of *analytical.py*."""
+    x = np.arange(-400., 401., 100.)
+    rx = np.repeat([x], x.size, axis=0)
+    ry = rx.T.copy()
+    params = {'src': [0, 0, 150], 'rec': [rx.ravel(), ry.ravel(), 200],
+              'depth': 0, 'res': [2e14, 1/3], 'freqtime': 0.5, 'ab': ab,
+              'aniso': [1, np.sqrt(10)], 'xdirect': False, 'verb': 0}
+    return params, rx, ry
+
+
+def test_parity():
+    # Electric field: x flips at the x-plane; magnetic field: y and z do
+    assert parity(11, 0) == 1
+    assert parity(12, 0) == -1
+    assert parity(13, 1) == 1
+    assert parity(14, 0) == -1
+    assert parity(41, 0) == -1
+    assert parity(46, 1) == 1
+
+
+@pytest.mark.parametrize('ab', [11, 12, 13, 31, 14, 41])
+def test_symmetry(ab):
+    params, rx, ry = model(ab)
+    full = dipole(**params).reshape(rx.shape)
+
+    sym = grid_symmetry(params, rx, ry)
+    assert sym['ix'].size == sym['iy'].size == 5
+    resp = grid_dipole(params, rx, ry, chunksize=20, nproc=1, symmetry=True)
+    np.testing.assert_allclose(resp, full, rtol=1e-10,
+                               atol=1e-10*np.abs(full).max())
+
+
+def test_symmetry_offcentre():
+    # Source off the grid centre: only part of the grid is mirrored
+    params, rx, ry = model(12)
+    params['src'] = [100, -200, 150]
+    full = dipole(**params).reshape(rx.shape)
+    resp = grid_dipole(params, rx, ry, chunksize=20, nproc=1, symmetry=True)
+    np.testing.assert_allclose(resp, full, rtol=1e-10,
+                               atol=1e-10*np.abs(full).max())
+
+
+def test_parallel(monkeypatch, tmp_path):
+    params, rx, ry = model()
+    monkeypatch.setattr(resources, 'CORES', 3)
+    serial = grid_dipole(params, rx, ry, chunksize=10, nproc=1)
+    parallel = grid_dipole(params, rx, ry, chunksize=10, nproc=3)
+    np.testing.assert_array_equal(parallel, serial)
+
+    # Streamed to a file, with the chunk size from the memory budget
+    out = grid_dipole(params, rx, ry, chunksize=None, nproc=3,
+                      out=str(tmp_path/'resp.npy'), memory=2**28)
+    np.testing.assert_array_equal(out, serial)
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+
+from resultcache import ResultCache, call_hash
+
+
+def test_call_hash():
+    call = {'params': {'res': [2e14, 1/3], 'freqtime': 0.5}, 'ht': 'fht'}
+    assert call_hash(call) == call_hash(dict(call))
+    assert call_hash(call) != call_hash({**call, 'ht': 'qwe'})
+    assert call_hash(call, 'a') != call_hash(call, 'b')
+
+    # NumPy scalars hash as Python scalars
+    assert call_hash({'a': np.float64(0.5)}) == call_hash({'a': 0.5})
+
+    # Functions hash by their code and closure, not only by their name
+    def scale(c):
+        return lambda x: c*x
+    assert call_hash(scale(2)) == call_hash(scale(2))
+    assert call_hash(scale(2)) != call_hash(scale(3))
+    assert call_hash(lambda x: x) != call_hash(lambda x: -x)
+
+
+def test_hit(tmp_path):
+    cache = ResultCache(str(tmp_path), version='test')
+    ncalls = []
+
+    def calc(filename):
+        ncalls.append(1)
+        out = np.lib.format.open_memmap(filename('b'), 'w+', float, (3, ))
+        out[:] = 2
+        return {'a': np.arange(4), 'b': out}
+
+    first = cache.fetch({'x': 1}, calc, 'first')
+    second = cache.fetch({'x': 1}, calc, 'second')
+    assert len(ncalls) == 1
+    for out in (first, second):
+        np.testing.assert_array_equal(out['a'], np.arange(4))
+        np.testing.assert_array_equal(out['b'], [2, 2, 2])
+    assert isinstance(second['a'], np.memmap)
+
+    cache.fetch({'x': 2}, calc)
+    assert len(ncalls) == 2
+    assert not [f for f in os.listdir(tmp_path) if 'pending' in f]
+
+
+def test_evict(tmp_path):
+    cache = ResultCache(str(tmp_path), maxsize=3000, version='test')
+
+    def calc(filename):
+        return {'a': np.zeros(100)}  # 928 bytes
+
+    for i in range(3):
+        cache.fetch({'x': i}, calc)
+        time.sleep(0.01)
+    keys = [cache.key({'x': i}) for i in range(4)]
+    assert all(cache.load(k) is not None for k in keys[:3])
+
+    # The fourth entry evicts the least recently used one, the second
+    cache.load(keys[0])
+    cache.fetch({'x': 3}, calc)
+    assert cache.load(keys[1]) is None
+    assert all(cache.load(keys[i]) is not None for i in (0, 2, 3))
+
+
+def test_sweep(tmp_path):
+    cache = ResultCache(str(tmp_path), version='test')
+    cache.fetch({'x': 1}, lambda filename: {'a': np.zeros(3)})
+    files = sorted(os.listdir(tmp_path))
+
+    # Leftovers of an interrupted calculation, and of a running one
+    for fname in ['dead-a.npy', 'dead.pending', 'other.json.tmp999999999']:
+        with open(os.path.join(tmp_path, fname), 'w') as f:
+            f.write('999999999')
+    with open(os.path.join(tmp_path, 'live.pending'), 'w') as f:
+        f.write('%d' % os.getpid())
+    with open(os.path.join(tmp_path, 'live-a.npy'), 'w') as f:
+        f.write('')
+
+    cache.sweep()
+    assert sorted(os.listdir(tmp_path)) == sorted(
+            files + ['live.pending', 'live-a.npy'])
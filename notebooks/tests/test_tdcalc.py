@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from empymod import dipole
+
+from tdcalc import td_dipole
+
+# Land CSEM, as in *time-domain.py*, at three offsets
+params = {'src': [0, 0, 0.001], 'rec': [[1000, 2000, 3000], 0, 0.001],
+          'depth': [0, 1000, 2000], 'res': [2e14, 10, 100, 10], 'ab': 11,
+          'verb': 0}
+time = np.logspace(-2, 1, 21)
+transforms = {'fftlog': ('fftlog', {}), 'fftlog-30': (
+    'fftlog', {'pts_per_dec': 30})}
+
+
+@pytest.mark.parametrize('signal', [0, 1, -1])
+def test_td_dipole(signal):
+    out = td_dipole(params, time, transforms, signals=(0, 1, -1), verb=0)
+    for name, (ft, ftarg) in transforms.items():
+        ref = dipole(freqtime=time, signal=signal, ft=ft, ftarg=ftarg,
+                     **params)
+        np.testing.assert_allclose(out[name, signal], ref, rtol=1e-10,
+                                   atol=1e-10*np.abs(ref).max())
+
+
+def test_td_dipole_interpolated():
+    ref = dipole(freqtime=time, signal=0, ft='fftlog', **params)
+    out = td_dipole(params, time, transforms, pts_per_dec=20, verb=0)
+    np.testing.assert_allclose(out['fftlog', 0], ref, rtol=1e-2,
+                               atol=1e-3*np.abs(ref).max())
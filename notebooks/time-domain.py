@@ -9,7 +9,14 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-from empymod import dipole
+# Time-domain responses of all transforms from one spectrum
+from tdcalc import td_dipole
+
+# Result cache
+from resultcache import ResultCache
+
+# Analytical impulse response
+from reference import ee_xx_impulse
 
 # Plotting style adjustments
 mpl.rc('text', usetex=True)         # Comment this if you don't have LaTeX. You
@@ -31,23 +38,6 @@ mpl.rc('figure', dpi=1200)
 # for the versions submitted to Geophysics.
 
 
-def ee_xx_impulse(res, off, time):
-    """Electric halfspace impulse response to an electric source, xx, inline.
-
-    Wilson, A. J. S., 1997, equation 5.38.
-    The equivalent wavefield concept in multichannel transient electromagnetic
-    surveying.
-    Ph.D., University Of Edinburgh.
-    http://hdl.handle.net/1842/7101
-
-    res   : resistivity [Ohm.m]
-    off   : offset [m]
-    time  : time(s) [s]
-    """
-    mu_0 = 4e-7*np.pi  # Permeability of free space  [H/m]
-    fact = np.sqrt(mu_0**3/(t**5*res*np.pi**3))/8
-    return fact*np.exp(-mu_0*off**2/(4*res*time))
-
 # Example 1: Source and receiver at z=0m
 
 # Comparison with analytical solution; put 1 mm below the interface, as they
@@ -57,18 +47,27 @@ rec = [6000, 0, 0.001]       # Receivers in-line, 0.5m below interface
 res = [2e14, 10]             # Resistivity: [air, half-space]
 signal = 0                   # Impulse response
 t = np.logspace(-2, 2, 101)  # Desired times (s)
-inparg = {'src': src, 'rec': rec, 'depth': 0, 'freqtime': t, 'res': res,
-          'signal': signal, 'ht': 'fht', 'verb': 1}
+inparg = {'src': src, 'rec': rec, 'depth': 0, 'res': res, 'ht': 'fht',
+          'verb': 1}
 
 # Impulse response
 ex = ee_xx_impulse(res[1], rec[0], t)
 
 # Calculation
-inparg['signal'] = 0  # signal 0 = impulse
-qwe = dipole(**inparg, ft='qwe')
-sin = dipole(**inparg, ft='sin', ftarg='key_81_CosSin_2009')
-ftl = dipole(**inparg, ft='fftlog')
-fft = dipole(**inparg, ft='fft', ftarg=[.00005, 2**20, '', 10])
+# The frequency-domain response is calculated once, for the union of the
+# frequencies required by the four transforms, and stored in the cache in
+# *./data/cache*; every transform is then applied to it. Add 1 (switch-on)
+# and -1 (switch-off) to the signals to get the step responses as well.
+transforms = {'qwe': ('qwe', None),
+              'sin': ('sin', 'key_81_CosSin_2009'),
+              'ftl': ('fftlog', None),
+              'fft': ('fft', [.00005, 2**20, '', 10])}
+out = td_dipole(inparg, t, transforms, signals=[signal],
+                cache=ResultCache('data/cache'))
+qwe = out['qwe', signal]
+sin = out['sin', signal]
+ftl = out['ftl', signal]
+fft = out['fft', signal]
 
 # Figure
 fig, axs = plt.subplots(figsize=(7.2, 2.5), facecolor='w', nrows=1,